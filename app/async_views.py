@@ -0,0 +1,138 @@
+"""
+Асинхронные варианты страниц, которые читают больше всего данных.
+Данные страницы и оба блока сайдбара запрашиваются одновременно,
+поэтому под ASGI-сервером один воркер обслуживает много запросов сразу.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, render
+from django.urls import reverse
+
+from . import cards, live, sidebar, versions, view_counts
+from .models import Question
+from .pagination import KeysetPaginator
+from .query_budget import query_budget
+from .views import load_answer_thread, paginate, paginate_tag_feed
+
+
+def in_thread(func):
+    """
+    Синхронная функция в отдельном потоке со своим соединением к БД:
+    в отличие от thread_sensitive-потока такие вызовы идут параллельно.
+    """
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+def load_page(queryset, request, per_page):
+    """paginate() с выборкой строк страницы в том же потоке"""
+    page = paginate(queryset, request, per_page)
+    page.object_list = list(page.object_list)
+    return page
+
+
+async def paginate_feed(queryset, request, ordering, per_page=20):
+    """Асинхронный аналог views.paginate_feed"""
+    if 'page' in request.GET:
+        page = await in_thread(load_page)(queryset.order_by(*ordering), request, per_page)
+    else:
+        paginator = KeysetPaginator(
+            queryset, ordering, per_page,
+            approximate_count=getattr(settings, 'FEED_APPROXIMATE_COUNT', False),
+        )
+        page = await paginator.apage(request.GET.get('cursor'))
+    return await in_thread(cards.fill_page)(page)
+
+
+async def render_with_sidebar(request, template_name, context, data):
+    """
+    Ждет данные страницы вместе с блоками сайдбара и рендерит шаблон.
+    Сайдбар передается явно, чтобы ленивые объекты контекстного процессора
+    не обращались к БД во время рендеринга.
+    """
+    page_data, popular_tags, best_users = await asyncio.gather(
+        data,
+        in_thread(sidebar.popular_tags)(),
+        in_thread(sidebar.best_users)(),
+    )
+    context = dict(context, popular_tags=popular_tags, best_users=best_users)
+    context.update(page_data)
+    return await sync_to_async(render)(request, template_name, context)
+
+
+@query_budget(6)
+async def new_questions(request):
+    """Главная страница - новые вопросы"""
+    questions = Question.objects.new_questions().only('id', 'created_date')
+
+    async def data():
+        return {'questions': await paginate_feed(questions, request, ('-created_date', '-id'))}
+
+    return await render_with_sidebar(request, 'index.html', {'title': 'New Questions'}, data())
+
+
+@query_budget(6)
+async def hot_questions(request):
+    """Страница популярных вопросов"""
+    questions = Question.objects.hot_questions().only('id', 'hot_score')
+
+    async def data():
+        return {'questions': await paginate_feed(questions, request, ('-hot_score', '-id'))}
+
+    return await render_with_sidebar(request, 'index.html', {'title': 'Hot Questions'}, data())
+
+
+@query_budget(7)
+async def questions_by_tag(request, tag_name):
+    """Вопросы по определенному тегу"""
+    async def data():
+        return {'questions': await in_thread(paginate_tag_feed)(tag_name, request)}
+
+    return await render_with_sidebar(request, 'tag.html', {'tag_name': tag_name}, data())
+
+
+@query_budget(8)
+async def question_page(request, question_id):
+    """Страница одного вопроса с ответами"""
+    user = await request.auser()
+
+    async def data():
+        # Версия раньше данных, как в views.question_page
+        current = await sync_to_async(versions.get_versions)('question', [question_id])
+        question = await aget_object_or_404(
+            Question.objects.with_answers_count().select_related('author__user'), id=question_id
+        )
+        question.cache_version = current[question_id]
+        answers = await in_thread(load_answer_thread)(question, request, user=user)
+        await sync_to_async(view_counts.record)(question.pk, view_counts.viewer_key(request))
+        return {'question': question, 'answers': answers}
+
+    context = {'viewer_id': user.pk or 0}
+    if isinstance(request, ASGIRequest):
+        context['events_url'] = reverse('app:question_events', kwargs={'question_id': question_id})
+    return await render_with_sidebar(request, 'question.html', context, data())
+
+
+@query_budget(1)
+async def question_events(request, question_id):
+    """Поток новых ответов и изменений рейтинга для открытой страницы вопроса (live.py)"""
+    if not isinstance(request, ASGIRequest):
+        # Под WSGI асинхронный поток читается синхронно и занимает воркер
+        # навсегда; на 204 EventSource больше не переподключается
+        return HttpResponse(status=204)
+    if not await Question.objects.filter(pk=question_id).aexists():
+        raise Http404
+    response = StreamingHttpResponse(live.stream(question_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx иначе буферизует поток и события приходят пачками
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,140 @@
+"""
+Миниатюры аватаров: квадраты SIZES пикселей вместо исходного файла.
+
+Миниатюры лежат в хранилище под именем от хэша содержимого исходника
+(avatars/thumbs/ab/<хэш>-32.webp), поэтому их адрес меняется вместе с
+картинкой и их можно кэшировать в браузере без срока. Хэш хранится в
+Profile.avatar_hash: пока его нет, шаблоны ссылаются на представление,
+которое строит миниатюры при первом запросе (файлы, загруженные до
+появления миниатюр или импортом). Новые загрузки обрабатываются в пуле
+потоков после фиксации транзакции.
+"""
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+from . import sidebar
+from .models import Profile
+
+SIZES = (32, 64)
+THUMB_DIR = 'avatars/thumbs'
+THUMB_FORMAT = 'WEBP'
+# Адрес миниатюры зависит от содержимого - кэшировать можно на год
+CACHE_SECONDS = 365 * 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def thumbnail_name(digest, size):
+    return f'{THUMB_DIR}/{digest[:2]}/{digest}-{size}.{THUMB_FORMAT.lower()}'
+
+
+def stored_url(digest, size):
+    return default_storage.url(thumbnail_name(digest, size))
+
+
+def thumbnail_url(profile, size):
+    """Адрес миниатюры профиля; пустая строка, если аватара нет"""
+    return url_for(profile.pk, profile.avatar, profile.avatar_hash, size)
+
+
+def url_for(profile_id, avatar, avatar_hash, size):
+    """То же по значениям колонок профиля, без объекта Profile"""
+    if not avatar:
+        return ''
+    if avatar_hash:
+        return stored_url(avatar_hash, size)
+    return reverse('app:avatar', kwargs={'profile_id': profile_id, 'size': size})
+
+
+def _render(image, size):
+    thumb = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    thumb.save(buffer, THUMB_FORMAT, quality=85, method=4)
+    return buffer.getvalue()
+
+
+def make_thumbnails(source):
+    """Строит недостающие миниатюры файла source; возвращает хэш содержимого"""
+    with source.open('rb') as file:
+        data = file.read()
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    missing = [size for size in SIZES if not default_storage.exists(thumbnail_name(digest, size))]
+    if not missing:
+        return digest
+
+    image = Image.open(io.BytesIO(data))
+    # JPEG декодируется сразу в уменьшенном масштабе - в разы быстрее полного
+    image.draft('RGB', (max(missing) * 2, max(missing) * 2))
+    image = ImageOps.exif_transpose(image)
+    has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    for size in missing:
+        name = thumbnail_name(digest, size)
+        saved = default_storage.save(name, ContentFile(_render(image, size)))
+        if saved != name:
+            # Параллельный процесс успел записать тот же файл
+            default_storage.delete(saved)
+    return digest
+
+
+def process(profile_id):
+    """Миниатюры текущего аватара профиля; возвращает хэш или None"""
+    profile = Profile.objects.only('avatar', 'avatar_hash').filter(pk=profile_id).first()
+    if profile is None or not profile.avatar:
+        return None
+    digest = make_thumbnails(profile.avatar)
+    if digest != profile.avatar_hash:
+        # Аватар могли сменить, пока строились миниатюры - тогда хэш не подходит
+        updated = Profile.objects.filter(pk=profile_id, avatar=profile.avatar.name).update(avatar_hash=digest)
+        if updated:
+            sidebar.bump_version()
+    return digest
+
+
+def _process_in_worker(profile_id):
+    try:
+        process(profile_id)
+    except Exception:
+        logger.exception('Не удалось построить миниатюры аватара профиля %s', profile_id)
+    finally:
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'AVATAR_WORKERS', 2), thread_name_prefix='avatars',
+            )
+        return _executor
+
+
+def schedule(profile_id):
+    """Построить миниатюры в пуле потоков после фиксации транзакции"""
+    transaction.on_commit(lambda: _get_executor().submit(_process_in_worker, profile_id))
+
+
+def build_all(batch_size=500, workers=None):
+    """Миниатюры для всех аватаров без хэша; возвращает число обработанных профилей"""
+    ids = list(
+        Profile.objects.filter(avatar_hash='').exclude(avatar='').exclude(avatar__isnull=True)
+        .order_by('pk').values_list('pk', flat=True)
+    )
+    with ThreadPoolExecutor(max_workers=workers or getattr(settings, 'AVATAR_WORKERS', 2)) as pool:
+        for start in range(0, len(ids), batch_size):
+            list(pool.map(_process_in_worker, ids[start:start + batch_size]))
+    return len(ids)
@@ -0,0 +1,72 @@
+"""
+PostgreSQL (psycopg2) с пулом соединений процесса, см. pool.py.
+
+Настройки пула - ключ POOL в описании базы (не в OPTIONS: их Django
+передает драйверу): MAX_SIZE, TIMEOUT, MAX_IDLE, CHECK_INTERVAL.
+CONN_MAX_AGE и CONN_HEALTH_CHECKS работают как обычно: "закрытие"
+соединения Django возвращает его в пул. Служебные соединения без базы
+(создание и удаление тестовой базы) в пул не попадают.
+"""
+from django.db import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+from psycopg2 import extensions
+
+from .creation import DatabaseCreation
+from .pool import PoolTimeout, get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+    # Пул, из которого взято текущее соединение: в него оно и возвращается,
+    # даже если параметры базы успели смениться
+    connection_pool = None
+
+    def get_new_connection(self, conn_params):
+        if self.alias == NO_DB_ALIAS:
+            return super().get_new_connection(conn_params)
+        pool = get_pool(self.alias, conn_params, self.settings_dict.get('POOL') or {})
+        try:
+            connection = pool.checkout(
+                lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+                self._is_healthy,
+            )
+        except PoolTimeout as exc:
+            # Для кода приложения это обычная django.db.OperationalError
+            raise self.Database.OperationalError(str(exc)) from exc
+        self.connection_pool = pool
+        # Для соединения из пула родительский метод не вызывался; уровень
+        # изоляции у него тот же, что выставлен при создании
+        level = self.settings_dict['OPTIONS'].get('isolation_level')
+        self.isolation_level = IsolationLevel.READ_COMMITTED if level is None else IsolationLevel(level)
+        return connection
+
+    def _is_healthy(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except Exception:
+            return False
+
+    def _reset(self, connection):
+        """Откат незавершенной транзакции; False - соединение нельзя отдавать другому"""
+        if connection.closed:
+            return False
+        status = connection.info.transaction_status
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        try:
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except Exception:
+            return False
+        return not self.errors_occurred or self._is_healthy(connection)
+
+    def _close(self):
+        if self.connection_pool is None:
+            return super()._close()
+        if self.connection is not None:
+            pool, self.connection_pool = self.connection_pool, None
+            with self.wrap_database_errors:
+                pool.checkin(self.connection, self._reset(self.connection))
@@ -0,0 +1,11 @@
+from django.db.backends.postgresql import creation
+
+from .pool import close_all
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Соединения с тестовой базой, вернувшиеся в пул, не дадут выполнить
+        # DROP DATABASE: пулы закрываются до удаления
+        close_all()
+        super()._destroy_test_db(test_database_name, verbosity)
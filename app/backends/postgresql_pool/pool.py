@@ -0,0 +1,214 @@
+"""
+Пул соединений в памяти процесса: соединение, закрытое Django в конце
+запроса или в потоке async-представления, возвращается в пул и берется
+следующим потоком без нового подключения к PostgreSQL.
+
+Модуль не зависит от драйвера: соединения создает и проверяет бэкенд.
+Пулы заводятся на каждый процесс (после fork воркер создает свой) и на
+набор параметров подключения: если у псевдонима сменились параметры
+(тестовый раннер подставил имя тестовой базы), старый пул закрывается и
+соединения к прежней базе больше не выдаются.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    """Все соединения пула заняты дольше TIMEOUT секунд"""
+
+
+class ConnectionPool:
+    """
+    Не больше max_size открытых соединений. Простаивавшие дольше max_idle
+    закрываются, дольше check_interval - проверяются перед выдачей.
+    """
+
+    def __init__(self, max_size=10, timeout=5.0, max_idle=300.0, check_interval=30.0):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self._idle = deque()
+        self._size = 0
+        self.closed = False
+        self._condition = threading.Condition()
+        self._stats = dict.fromkeys(
+            ('checkouts', 'reused', 'created', 'waits', 'timeouts', 'errors', 'discarded'), 0
+        )
+        self._wait_seconds = 0.0
+
+    def checkout(self, connect, is_healthy):
+        """Соединение из пула или новое через connect(); is_healthy(conn) - проверка простоявшего"""
+        with self._condition:
+            self._stats['checkouts'] += 1
+        while True:
+            connection, idle_for = self._acquire()
+            if connection is None:
+                return self._create(connect)
+            if idle_for < self.check_interval or is_healthy(connection):
+                with self._condition:
+                    self._stats['reused'] += 1
+                return connection
+            self._discard(connection, error=True)
+
+    def checkin(self, connection, reusable=True):
+        """
+        Возврат соединения; reusable=False - соединение сломано и закрывается.
+        Соединения закрытого пула тоже закрываются, а не ждут следующего запроса.
+        """
+        if not reusable or self.closed:
+            self._discard(connection, error=True)
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.timeout
+        waited_since = None
+        expired = []
+        try:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    while self._idle:
+                        # Последнее возвращенное соединение - самое "теплое"
+                        connection, returned = self._idle.pop()
+                        if now - returned > self.max_idle:
+                            expired.append(connection)
+                            self._size -= 1
+                            continue
+                        return connection, now - returned
+                    if self._size < self.max_size:
+                        self._size += 1
+                        return None, 0
+                    if waited_since is None:
+                        waited_since = now
+                        self._stats['waits'] += 1
+                    if now >= deadline:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(
+                            f'Нет свободного соединения за {self.timeout} с (размер пула {self.max_size})'
+                        )
+                    self._condition.wait(deadline - now)
+        finally:
+            if waited_since is not None:
+                with self._condition:
+                    self._wait_seconds += time.monotonic() - waited_since
+            for connection in expired:
+                _close_quietly(connection)
+
+    def _create(self, connect):
+        try:
+            connection = connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._stats['errors'] += 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._stats['created'] += 1
+        return connection
+
+    def _discard(self, connection, error=False):
+        with self._condition:
+            self._size -= 1
+            self._stats['discarded'] += 1
+            if error:
+                self._stats['errors'] += 1
+            self._condition.notify()
+        _close_quietly(connection)
+
+    def close(self):
+        """Закрывает свободные соединения; занятые закроются при возврате"""
+        with self._condition:
+            self.closed = True
+        self.close_idle()
+
+    def close_idle(self):
+        """Закрывает все свободные соединения"""
+        with self._condition:
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+        for connection in idle:
+            _close_quietly(connection)
+
+    def stats(self):
+        with self._condition:
+            return dict(
+                self._stats,
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                max_size=self.max_size,
+                wait_ms=round(self._wait_seconds * 1000, 2),
+            )
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def _params_key(params):
+    return tuple(sorted((name, repr(value)) for name, value in params.items()))
+
+
+def get_pool(alias, params, options):
+    """
+    Пул текущего процесса для псевдонима базы и параметров подключения
+    params (то, что бэкенд передает драйверу); options - словарь POOL из
+    DATABASES. Пул псевдонима с другими параметрами закрывается.
+    """
+    global _pools_pid
+    key = (alias, _params_key(params))
+    stale = []
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Соединения родителя после fork не закрываются: сокеты общие
+            _pools.clear()
+            _pools_pid = os.getpid()
+        if key not in _pools:
+            stale = [_pools.pop(other) for other in list(_pools) if other[0] == alias]
+            _pools[key] = ConnectionPool(
+                max_size=options.get('MAX_SIZE', 10),
+                timeout=options.get('TIMEOUT', 5.0),
+                max_idle=options.get('MAX_IDLE', 300.0),
+                check_interval=options.get('CHECK_INTERVAL', 30.0),
+            )
+        pool = _pools[key]
+    for old in stale:
+        old.close()
+    return pool
+
+
+def stats():
+    """Метрики пулов текущего процесса {псевдоним базы: счетчики}"""
+    with _pools_lock:
+        pools = dict(_pools) if _pools_pid == os.getpid() else {}
+    return {alias: pool.stats() for (alias, _), pool in pools.items()}
+
+
+@atexit.register
+def close_all():
+    """
+    Закрывает все пулы процесса: свободные соединения сразу, занятые при
+    возврате. Следующее подключение создаст новый пул.
+    """
+    with _pools_lock:
+        pools = list(_pools.values()) if _pools_pid == os.getpid() else []
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,197 @@
+"""Нагрузочный прогон маршрутов app/urls.py внутри процесса"""
+import asyncio
+import json
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import AsyncClient, Client
+from django.urls import reverse
+
+from .models import Question, Tag
+from .utils import percentile
+
+
+def route_urls():
+    """URL для каждого маршрута с параметрами из текущей базы"""
+    # AsyncClient передает в scope путь в latin-1, поэтому для сравнимости
+    # режимов берется тег с ASCII-именем
+    tag = next((tag for tag in Tag.objects.popular_tags() if tag.name.isascii()), None)
+    question = Question.objects.order_by('-answers_count', '-id').first()
+    urls = {
+        'index': reverse('app:index'),
+        'hot': reverse('app:hot'),
+        'login': reverse('app:login'),
+        'signup': reverse('app:signup'),
+        'ask': reverse('app:ask'),
+        'settings': reverse('app:settings'),
+        'search': reverse('app:search') + '?q=python',
+    }
+    if tag is not None:
+        urls['tag'] = reverse('app:tag', kwargs={'tag_name': tag.name})
+    if question is not None:
+        urls['question'] = reverse('app:question', kwargs={'question_id': question.id})
+    return urls
+
+
+def summarize(latencies, queries, errors, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies), 2),
+            'p50': round(percentile(latencies, 50), 2),
+            'p95': round(percentile(latencies, 95), 2),
+            'p99': round(percentile(latencies, 99), 2),
+        },
+        'queries_per_request': round(statistics.fmean(queries), 2),
+    }
+
+
+class QueryCounter:
+    """Обертка execute_wrapper: число выполненных запросов"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def run_route(url, requests, concurrency, warmup=5):
+    """Запросы к url из concurrency потоков; у каждого потока свой клиент и соединение"""
+    local = threading.local()
+
+    def request_once(_):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = Client()
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = client.get(url)
+        latency = (time.perf_counter() - started) * 1000
+        return latency, counter.count, response.status_code >= 400
+
+    for _ in range(warmup):
+        request_once(None)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(request_once, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    return summarize(
+        [latency for latency, _, _ in results],
+        [queries for _, queries, _ in results],
+        sum(failed for _, _, failed in results),
+        elapsed,
+    )
+
+
+_SQL_COUNT = re.compile(r'SQL x(\d+)')
+
+
+def _queries_from_header(response):
+    """Число SQL-запросов из Server-Timing (PerformanceMiddleware считает и чужие потоки)"""
+    match = _SQL_COUNT.search(response.get('Server-Timing', ''))
+    return int(match.group(1)) if match else 0
+
+
+async def _arun_route(url, requests, concurrency, warmup):
+    client = AsyncClient()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request_once():
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(url)
+            latency = (time.perf_counter() - started) * 1000
+        return latency, _queries_from_header(response), response.status_code >= 400
+
+    for _ in range(warmup):
+        await request_once()
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(request_once() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+def arun_route(url, requests, concurrency, warmup=5):
+    """
+    Те же замеры через ASGI-обработчик: concurrency запросов одновременно
+    в одном цикле событий, как у одного воркера uvicorn
+    """
+    results, elapsed = asyncio.run(_arun_route(url, requests, concurrency, warmup))
+    return summarize(
+        [latency for latency, _, _ in results],
+        [queries for _, queries, _ in results],
+        sum(failed for _, _, failed in results),
+        elapsed,
+    )
+
+
+# Способ получения соединения -> бэкенд PostgreSQL
+CONNECTION_ENGINES = {
+    'direct': 'django.db.backends.postgresql',
+    'pooled': 'app.backends.postgresql_pool',
+}
+
+
+@contextmanager
+def connection_mode(mode):
+    """
+    Прогон с CONN_MAX_AGE=0: соединение закрывается после каждого запроса,
+    и следующий либо подключается заново (direct), либо берет его из пула
+    (pooled). Разница задержек - стоимость подключения к PostgreSQL.
+    """
+    settings_dict = connections.settings[DEFAULT_DB_ALIAS]
+    saved = {key: settings_dict[key] for key in ('ENGINE', 'CONN_MAX_AGE')}
+    _drop_connection()
+    settings_dict.update(ENGINE=CONNECTION_ENGINES[mode], CONN_MAX_AGE=0)
+    try:
+        yield
+    finally:
+        _drop_connection()
+        settings_dict.update(saved)
+
+
+def _drop_connection():
+    """Закрыть соединение потока, чтобы следующее создалось с новым ENGINE"""
+    connections.close_all()
+    if any(conn.alias == DEFAULT_DB_ALIAS for conn in connections.all(initialized_only=True)):
+        del connections[DEFAULT_DB_ALIAS]
+
+
+def compare(results, baseline, threshold, metric='p95'):
+    """Маршруты, где задержка выросла больше чем на threshold (доля) или стало больше SQL"""
+    regressions = []
+    for route, current in results['routes'].items():
+        previous = baseline.get('routes', {}).get(route)
+        if not previous:
+            continue
+        before = previous['latency_ms'][metric]
+        after = current['latency_ms'][metric]
+        if before and (after - before) / before > threshold:
+            regressions.append((route, before, after))
+        if current['queries_per_request'] > previous['queries_per_request']:
+            regressions.append((f'{route} (SQL)', previous['queries_per_request'],
+                                current['queries_per_request']))
+    return regressions
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_results(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
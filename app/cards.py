@@ -0,0 +1,98 @@
+"""
+Карточки вопросов для списков: легкие записи QuestionCard вместо моделей.
+
+Страница ленты выбирает только id вопросов (и ключ сортировки), а данные
+карточек берутся из кэша одним get_many: кортеж на вопрос под ключом с
+версией вопроса (versions.py), поэтому изменение вопроса, его тегов,
+ответов или оценок сразу дает новый ключ. Недостающие карточки читаются
+двумя запросами - строки Question.objects.cards() и имена тегов - и
+кладутся в кэш. Текст вопроса, модели авторов и тегов не загружаются.
+Смена аватара или имени автора версию вопроса не меняет и видна в
+карточках через TEMPLATE_FRAGMENT_TIMEOUT, как и в кэше фрагментов.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from . import versions
+from .avatars import url_for
+from .models import Question
+
+AVATAR_SIZE = 32
+
+
+class QuestionCard:
+    """Данные одной карточки; в кэше хранится кортеж pack()"""
+    __slots__ = (
+        'id', 'title', 'excerpt', 'rating', 'answers_count', 'views', 'created_date',
+        'author_id', 'author_username', 'author_avatar', 'tag_names', 'cache_version',
+    )
+    PACKED = __slots__[:-1]
+
+    def __init__(self, *values, cache_version=None):
+        for name, value in zip(self.PACKED, values):
+            setattr(self, name, value)
+        self.cache_version = cache_version
+
+    @property
+    def pk(self):
+        return self.id
+
+    def pack(self):
+        return tuple(getattr(self, name) for name in self.PACKED)
+
+    def __repr__(self):
+        return f'<QuestionCard {self.id}: {self.title}>'
+
+
+def _key(question_id, version):
+    return f'card:question:{question_id}:{version}'
+
+
+def load(question_ids):
+    """Карточки из БД {id: QuestionCard} за два запроса"""
+    tag_names = {pk: [] for pk in question_ids}
+    rows = (
+        Question.tags.through.objects.filter(question_id__in=question_ids)
+        .order_by('tag__name').values_list('question_id', 'tag__name')
+    )
+    for question_id, name in rows:
+        tag_names[question_id].append(name)
+
+    cards = {}
+    for (pk, title, excerpt, rating, answers_count, views, created_date,
+         author_id, username, avatar, avatar_hash) in Question.objects.filter(pk__in=question_ids).cards():
+        cards[pk] = QuestionCard(
+            pk, title, excerpt, rating, answers_count, views, created_date, author_id, username,
+            url_for(author_id, avatar, avatar_hash, AVATAR_SIZE), tuple(tag_names[pk]),
+        )
+    return cards
+
+
+def for_ids(question_ids):
+    """Карточки в порядке question_ids с проставленной cache_version"""
+    question_ids = list(question_ids)
+    current = versions.get_versions('question', question_ids)
+    keys = {_key(pk, current[pk]): pk for pk in question_ids}
+    found = {keys[key]: packed for key, packed in cache.get_many(list(keys)).items()}
+
+    missing = [pk for pk in question_ids if pk not in found]
+    if missing:
+        loaded = load(missing)
+        cache.set_many(
+            {_key(pk, current[pk]): card.pack() for pk, card in loaded.items()},
+            getattr(settings, 'TEMPLATE_FRAGMENT_TIMEOUT', 600),
+        )
+        found.update((pk, card.pack()) for pk, card in loaded.items())
+
+    return [
+        QuestionCard(*found[pk], cache_version=current[pk])
+        for pk in question_ids if pk in found
+    ]
+
+
+def fill_page(page, question_ids=None):
+    """Заменяет объекты страницы карточками; по умолчанию id берутся из самих объектов"""
+    if question_ids is None:
+        question_ids = [obj.pk for obj in page.object_list]
+    page.object_list = for_ids(question_ids)
+    return page
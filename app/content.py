@@ -0,0 +1,133 @@
+"""
+Производные от текста поля, которые считаются при сохранении, а не при показе:
+начало вопроса для карточек (excerpt) и готовый HTML тела вопроса и ответа
+(body_html). Шаблоны выводят сохраненные значения без обработки текста.
+
+HTML безопасен по построению: весь текст экранируется, разметка добавляется
+только для блоков ```...``` (pre.code-block), `кода` в строке, абзацев
+и переносов строк. После изменения правил старые записи перестраивает
+команда render_content --all.
+"""
+import re
+from itertools import islice
+from multiprocessing import Pool
+
+from django.utils.html import escape
+from django.utils.text import Truncator
+
+from . import versions
+from .models import Answer, Question
+
+EXCERPT_WORDS = 30
+EXCERPT_MAX_LENGTH = 300
+FENCE = '```'
+
+_inline_code = re.compile(r'`([^`\n]+)`')
+
+
+def make_excerpt(text):
+    """Начало текста для карточки в списке: EXCERPT_WORDS слов, не длиннее EXCERPT_MAX_LENGTH"""
+    excerpt = Truncator(' '.join(text.split())).words(EXCERPT_WORDS)
+    if len(excerpt) > EXCERPT_MAX_LENGTH:
+        excerpt = Truncator(excerpt).chars(EXCERPT_MAX_LENGTH)
+    return excerpt
+
+
+def _paragraph(lines):
+    return '<p>' + '<br>'.join(_inline_code.sub(r'<code>\1</code>', escape(line)) for line in lines) + '</p>'
+
+
+def _code_block(lines):
+    return '<pre class="code-block"><code>' + escape('\n'.join(lines)) + '</code></pre>'
+
+
+def render_body(text):
+    """HTML тела вопроса или ответа"""
+    blocks, lines, code = [], [], None
+    for line in text.replace('\r\n', '\n').split('\n'):
+        if line.strip().startswith(FENCE):
+            if code is None:
+                if lines:
+                    blocks.append(_paragraph(lines))
+                    lines = []
+                code = []
+            else:
+                blocks.append(_code_block(code))
+                code = None
+        elif code is not None:
+            code.append(line)
+        elif line.strip():
+            lines.append(line.strip())
+        elif lines:
+            blocks.append(_paragraph(lines))
+            lines = []
+    if code is not None:
+        # Незакрытый блок кода идет до конца текста
+        blocks.append(_code_block(code))
+    if lines:
+        blocks.append(_paragraph(lines))
+    return '\n'.join(blocks)
+
+
+def prepare_question(question):
+    question.excerpt = make_excerpt(question.text)
+    question.body_html = render_body(question.text)
+
+
+def prepare_answer(answer):
+    answer.body_html = render_body(answer.text)
+
+
+def _render_rows(task):
+    """Выполняется в процессе пула: [(pk, связанный id, text)] -> [(pk, связанный id, поля)]"""
+    kind, rows = task
+    if kind == 'question':
+        return [(pk, pk, {'excerpt': make_excerpt(text), 'body_html': render_body(text)})
+                for pk, _, text in rows]
+    return [(pk, question_id, {'body_html': render_body(text)}) for pk, question_id, text in rows]
+
+
+def _batches(model, related, batch_size, everything):
+    queryset = model.objects.order_by('pk')
+    if not everything:
+        queryset = queryset.filter(body_html='')
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_id).values_list('pk', related, 'text')[:batch_size])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def rebuild(batch_size=1000, workers=1, everything=False):
+    """
+    Считает excerpt и body_html для записей без body_html (everything=True -
+    для всех). Пачки читаются и записываются в этом процессе, текст
+    обрабатывается в workers процессах. Возвращает {'question': n, 'answer': n}.
+    """
+    targets = [('question', Question, 'pk'), ('answer', Answer, 'question_id')]
+    written = {}
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        for kind, model, related in targets:
+            written[kind] = 0
+            batches = _batches(model, related, batch_size, everything)
+            while True:
+                tasks = [(kind, rows) for rows in islice(batches, max(workers, 1))]
+                if not tasks:
+                    break
+                results = pool.map(_render_rows, tasks) if pool else map(_render_rows, tasks)
+                for rendered in results:
+                    fields = list(rendered[0][2])
+                    model.objects.bulk_update(
+                        [model(pk=pk, **values) for pk, _, values in rendered], fields,
+                    )
+                    # Закэшированные фрагменты страниц должны увидеть новый HTML
+                    versions.bump('question', {question_id for _, question_id, _ in rendered})
+                    written[kind] += len(rendered)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return written
@@ -1,3 +1,9 @@
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject, lazy
+
+from . import sidebar
+
+
 def user_context(request):
     """Контекстный процессор для фиктивного авторизованного пользователя"""
     class MockUser:
@@ -8,4 +14,20 @@ def user_context(request):
     
     return {
         'user': MockUser()
-    }
\ No newline at end of file
+    }
+
+
+def sidebar_context(request):
+    """Блоки сайдбара; запросы выполняются, только если шаблон их выводит"""
+    return {
+        'popular_tags': SimpleLazyObject(sidebar.popular_tags),
+        'best_users': SimpleLazyObject(sidebar.best_users),
+        'sidebar_stamp': lazy(sidebar.stamp, str)(),
+    }
+
+
+def fragment_cache_context(request):
+    """Время жизни закэшированных фрагментов шаблонов"""
+    return {
+        'fragment_timeout': getattr(settings, 'TEMPLATE_FRAGMENT_TIMEOUT', 600),
+    }
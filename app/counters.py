@@ -0,0 +1,90 @@
+"""Денормализованные счетчики: число ответов у вопроса и число вопросов у тега"""
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, F
+
+from .models import Answer, Question, Tag
+
+
+def change_answers_count(question_id, delta):
+    Question.objects.filter(pk=question_id).update(
+        answers_count=F('answers_count') + delta, hot_dirty=True,
+    )
+
+
+def change_question_count(tag_ids, delta):
+    if tag_ids:
+        Tag.objects.filter(pk__in=tag_ids).update(question_count=F('question_count') + delta)
+
+
+def repair_column(model, field, ids, count, batch_size, fix=True):
+    """
+    Сравнивает колонку пачки объектов ids с реальными значениями count(ids)
+    ({pk: значение}, отсутствующие - 0) и исправляет расхождения. С fix строки
+    пачки блокируются до подсчета: запись, зафиксированная между чтением и
+    исправлением, иначе была бы затерта. Все читается с основной базы,
+    реплика может отставать.
+    """
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        rows = model.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=ids).order_by('pk')
+        if fix:
+            rows = rows.select_for_update()
+        stored = dict(rows.values_list('pk', field))
+        actual = dict.fromkeys(stored, 0)
+        actual.update(count(ids))
+        drifted = [
+            model(pk=pk, **{field: actual[pk]})
+            for pk, value in stored.items() if value != actual[pk]
+        ]
+        if fix:
+            model.objects.using(DEFAULT_DB_ALIAS).bulk_update(drifted, [field], batch_size=batch_size)
+            if model is Question and drifted:
+                # Рейтинг и число ответов входят в оценку "горячих" вопросов
+                Question.objects.using(DEFAULT_DB_ALIAS).filter(
+                    pk__in=[obj.pk for obj in drifted],
+                ).update(hot_dirty=True)
+    return len(drifted)
+
+
+def id_batches(model, batch_size):
+    last_id = 0
+    while True:
+        ids = list(
+            model.objects.using(DEFAULT_DB_ALIAS).filter(pk__gt=last_id).order_by('pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def recount_answers(batch_size=1000):
+    """Пересчет Question.answers_count; возвращает число исправленных вопросов"""
+    def count(ids):
+        return (
+            Answer.objects.using(DEFAULT_DB_ALIAS).filter(question_id__in=ids).order_by()
+            .values('question_id').annotate(total=Count('pk'))
+            .values_list('question_id', 'total')
+        )
+
+    return sum(
+        repair_column(Question, 'answers_count', ids, count, batch_size)
+        for ids in id_batches(Question, batch_size)
+    )
+
+
+def recount_tags(batch_size=1000):
+    """Пересчет Tag.question_count; возвращает число исправленных тегов"""
+    through = Question.tags.through
+
+    def count(ids):
+        return (
+            through.objects.using(DEFAULT_DB_ALIAS).filter(tag_id__in=ids).order_by()
+            .values('tag_id').annotate(total=Count('pk'))
+            .values_list('tag_id', 'total')
+        )
+
+    return sum(
+        repair_column(Tag, 'question_count', ids, count, batch_size)
+        for ids in id_batches(Tag, batch_size)
+    )
@@ -0,0 +1,357 @@
+"""
+Перенос данных: потоковая выгрузка и загрузка в NDJSON (опционально gzip)
+и пересчет производных данных после массовой загрузки.
+
+Файл - одна JSON-запись на строку: сначала {"model": "meta", ...}, затем
+профили, теги, вопросы, связи вопрос-тег, ответы и оценки - в этом порядке,
+чтобы при загрузке все внешние ключи уже были известны. Выгружаются только
+исходные данные; счетчики, рейтинги, репутация и индексы пересчитываются.
+"""
+import datetime
+import gzip
+import json
+from contextlib import contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from . import counters, ranking, reputation, search, sidebar, tag_index, voting
+from .content import make_excerpt, render_body
+from .models import Answer, AnswerLike, Profile, Question, QuestionLike, Tag
+
+FORMAT_VERSION = 1
+
+
+def open_dataset(path, mode, compress=None):
+    """Текстовый файл; gzip - если compress=True или имя оканчивается на .gz"""
+    if compress is None:
+        compress = path.endswith('.gz')
+    if compress:
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class _Encoder(json.JSONEncoder):
+    """Даты с микросекундами (DjangoJSONEncoder округляет до миллисекунд)"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _sections(with_passwords):
+    """(имя записи, queryset.values(), переименование полей) в порядке загрузки"""
+    profile_fields = {
+        'pk': 'id', 'user__username': 'username', 'user__email': 'email',
+        'user__first_name': 'first_name', 'user__last_name': 'last_name',
+        'user__date_joined': 'date_joined', 'avatar': 'avatar',
+    }
+    if with_passwords:
+        profile_fields['user__password'] = 'password'
+    return [
+        ('profile', Profile.objects.all(), profile_fields),
+        ('tag', Tag.objects.all(), {'pk': 'id', 'name': 'name'}),
+        ('question', Question.objects.all(), {
+            'pk': 'id', 'title': 'title', 'text': 'text',
+            'author_id': 'author', 'created_date': 'created_date', 'views': 'views',
+        }),
+        ('question_tag', Question.tags.through.objects.all(), {
+            'question_id': 'question', 'tag_id': 'tag',
+        }),
+        ('answer', Answer.objects.all(), {
+            'pk': 'id', 'text': 'text', 'author_id': 'author', 'question_id': 'question',
+            'is_correct': 'is_correct', 'created_date': 'created_date',
+        }),
+        ('question_like', QuestionLike.objects.all(), {
+            'user_id': 'user', 'question_id': 'question', 'value': 'value',
+        }),
+        ('answer_like', AnswerLike.objects.all(), {
+            'user_id': 'user', 'answer_id': 'answer', 'value': 'value',
+        }),
+    ]
+
+
+def export(stream, batch_size=2000, with_passwords=False):
+    """
+    Пишет набор данных в stream. Строки читаются через iterator(chunk_size),
+    на PostgreSQL - серверным курсором, поэтому память не зависит от объема.
+    Возвращает {имя записи: число строк}.
+    """
+    encoder = _Encoder(ensure_ascii=False, separators=(',', ':'))
+    stream.write(encoder.encode({'model': 'meta', 'format': FORMAT_VERSION}) + '\n')
+    counts = {}
+    for name, queryset, fields in _sections(with_passwords):
+        rows = queryset.order_by('pk').values_list(*fields).iterator(chunk_size=batch_size)
+        keys = list(fields.values())
+        count = 0
+        for row in rows:
+            record = {'model': name}
+            record.update(zip(keys, row))
+            stream.write(encoder.encode(record) + '\n')
+            count += 1
+        counts[name] = count
+    return counts
+
+
+# Записи в порядке файла и последняя запись, которой нужно отображение id:
+# после нее отображение удаляется, а не держится в памяти до конца загрузки
+SECTION_ORDER = ('profile', 'tag', 'question', 'question_tag', 'answer', 'question_like', 'answer_like')
+IDS_NEEDED_UNTIL = {
+    'profile': 'answer_like',
+    'tag': 'question_tag',
+    'question': 'question_like',
+    'answer': 'answer_like',
+}
+
+
+def _create_missing(model, key, objects):
+    """
+    bulk_create только тех объектов, ключа key которых еще нет в базе; число
+    записанных. ignore_conflicts остается на случай параллельной записи, но
+    bulk_create с ним возвращает все переданные объекты, а не записанные
+    """
+    first = key[0]
+    existing = set(
+        model.objects.filter(**{f'{first}__in': {getattr(obj, first) for obj in objects}}).values_list(*key)
+    )
+    new = {}
+    for obj in objects:
+        values = tuple(getattr(obj, name) for name in key)
+        if values not in existing:
+            new[values] = obj
+    model.objects.bulk_create(list(new.values()), ignore_conflicts=True)
+    return len(new)
+
+
+class _SameIds(dict):
+    """
+    Отображение id при --keep-ids: id из файла и есть id в базе, хранятся
+    только отличающиеся (профили и теги, совпавшие с существующими по имени)
+    """
+
+    def __missing__(self, pk):
+        return pk
+
+    def update(self, other):
+        super().update((old, new) for old, new in other.items() if old != new)
+
+
+@contextmanager
+def _explicit_created_date(*models):
+    """bulk_create не должен подменять created_date из файла текущим временем"""
+    fields = [model._meta.get_field('created_date') for model in models]
+    saved = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, saved):
+            field.auto_now_add = value
+
+
+class Importer:
+    """
+    Загрузка записей пачками через bulk_create. Внешние ключи переводятся из id
+    файла в id базы; пользователи и теги сопоставляются с существующими по имени.
+    Отображение id удаляется, когда прошли все записи, которые на него ссылаются.
+    """
+
+    def __init__(self, batch_size=2000, keep_ids=False):
+        self.batch_size = batch_size
+        self.keep_ids = keep_ids
+        self.ids = {name: _SameIds() if keep_ids else {} for name in IDS_NEEDED_UNTIL}
+        self.counts = {}
+        self._pending = []
+        self._pending_model = None
+        self._loaders = {
+            'profile': self._load_profiles,
+            'tag': self._load_tags,
+            'question': self._load_questions,
+            'question_tag': self._load_question_tags,
+            'answer': self._load_answers,
+            'question_like': self._load_question_likes,
+            'answer_like': self._load_answer_likes,
+        }
+
+    def load(self, stream):
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            model = record.pop('model')
+            if model == 'meta':
+                if record.get('format') != FORMAT_VERSION:
+                    raise ValueError(f'Неподдерживаемая версия формата: {record.get("format")}')
+                continue
+            if model not in self._loaders:
+                raise ValueError(f'Строка {line_number}: неизвестный тип записи {model!r}')
+            if self._pending_model and SECTION_ORDER.index(model) < SECTION_ORDER.index(self._pending_model):
+                raise ValueError(f'Строка {line_number}: запись {model!r} после записей {self._pending_model!r}')
+            self.add(model, record)
+        self.flush()
+        self.ids.clear()
+        if self.keep_ids:
+            self._reset_sequences()
+        return self.counts
+
+    def add(self, model, record):
+        if model != self._pending_model:
+            self.flush()
+            self._pending_model = model
+            self._drop_ids(model)
+        self._pending.append(record)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            with transaction.atomic(), _explicit_created_date(Question, Answer):
+                created = self._loaders[self._pending_model](self._pending)
+            self.counts[self._pending_model] = self.counts.get(self._pending_model, 0) + created
+        self._pending = []
+
+    def _drop_ids(self, model):
+        position = SECTION_ORDER.index(model)
+        for name, until in IDS_NEEDED_UNTIL.items():
+            if name in self.ids and SECTION_ORDER.index(until) < position:
+                del self.ids[name]
+
+    def _check_free_ids(self, name, model, pks):
+        """С keep_ids id из файла не должны быть заняты: иначе bulk_create упадет на IntegrityError"""
+        if not self.keep_ids:
+            return
+        taken = list(model.objects.filter(pk__in=pks).order_by('pk').values_list('pk', flat=True)[:10])
+        if taken:
+            raise ValueError(
+                f'Записи {name!r} с id {", ".join(map(str, taken))} уже есть в базе: '
+                f'с keep_ids загружать можно только в базу без этих записей'
+            )
+
+    def _load_profiles(self, records):
+        User.objects.bulk_create([
+            User(
+                username=record['username'], email=record['email'],
+                first_name=record['first_name'], last_name=record['last_name'],
+                date_joined=parse_datetime(record['date_joined']),
+                password=record.get('password') or make_password(None),
+            )
+            for record in records
+        ], ignore_conflicts=True)
+        user_ids = dict(
+            User.objects.filter(username__in=[record['username'] for record in records])
+            .values_list('username', 'pk')
+        )
+        existing = dict(
+            Profile.objects.filter(user_id__in=list(user_ids.values())).values_list('user_id', 'pk')
+        )
+        new_profiles = {}
+        for record in records:
+            user_id = user_ids[record['username']]
+            if user_id in existing:
+                self.ids['profile'].update({record['id']: existing[user_id]})
+            else:
+                new_profiles[record['id']] = Profile(
+                    pk=record['id'] if self.keep_ids else None,
+                    user_id=user_id, avatar=record['avatar'] or None,
+                )
+        self._check_free_ids('profile', Profile, list(new_profiles))
+        Profile.objects.bulk_create(list(new_profiles.values()))
+        self.ids['profile'].update({old: profile.pk for old, profile in new_profiles.items()})
+        return len(new_profiles)
+
+    def _load_tags(self, records):
+        names = [record['name'] for record in records]
+        existing = set(Tag.objects.filter(name__in=names).values_list('name', flat=True))
+        Tag.objects.bulk_create([
+            Tag(pk=record['id'] if self.keep_ids else None, name=record['name'])
+            for record in records if record['name'] not in existing
+        ], ignore_conflicts=True)
+        tag_ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'pk'))
+        self.ids['tag'].update({record['id']: tag_ids[record['name']] for record in records})
+        return len(tag_ids) - len(existing)
+
+    def _load_questions(self, records):
+        authors = self.ids['profile']
+        self._check_free_ids('question', Question, [record['id'] for record in records])
+        questions = Question.objects.bulk_create([
+            Question(
+                pk=record['id'] if self.keep_ids else None,
+                title=record['title'], text=record['text'], excerpt=make_excerpt(record['text']),
+                body_html=render_body(record['text']),
+                author_id=authors[record['author']],
+                created_date=parse_datetime(record['created_date']),
+                views=record.get('views', 0),
+            )
+            for record in records
+        ])
+        self.ids['question'].update({
+            record['id']: question.pk for record, question in zip(records, questions)
+        })
+        return len(questions)
+
+    def _load_question_tags(self, records):
+        through = Question.tags.through
+        return _create_missing(through, ('question_id', 'tag_id'), [
+            through(question_id=self.ids['question'][record['question']],
+                    tag_id=self.ids['tag'][record['tag']])
+            for record in records
+        ])
+
+    def _load_answers(self, records):
+        self._check_free_ids('answer', Answer, [record['id'] for record in records])
+        answers = Answer.objects.bulk_create([
+            Answer(
+                pk=record['id'] if self.keep_ids else None,
+                text=record['text'], body_html=render_body(record['text']), is_correct=record['is_correct'],
+                author_id=self.ids['profile'][record['author']],
+                question_id=self.ids['question'][record['question']],
+                created_date=parse_datetime(record['created_date']),
+            )
+            for record in records
+        ])
+        self.ids['answer'].update({
+            record['id']: answer.pk for record, answer in zip(records, answers)
+        })
+        return len(answers)
+
+    def _load_question_likes(self, records):
+        return _create_missing(QuestionLike, ('question_id', 'user_id'), [
+            QuestionLike(user_id=self.ids['profile'][record['user']],
+                         question_id=self.ids['question'][record['question']],
+                         value=record['value'])
+            for record in records
+        ])
+
+    def _load_answer_likes(self, records):
+        return _create_missing(AnswerLike, ('answer_id', 'user_id'), [
+            AnswerLike(user_id=self.ids['profile'][record['user']],
+                       answer_id=self.ids['answer'][record['answer']],
+                       value=record['value'])
+            for record in records
+        ])
+
+    def _reset_sequences(self):
+        statements = connection.ops.sequence_reset_sql(no_style(), [Profile, Tag, Question, Answer])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+
+def rebuild_derived(batch_size=1000):
+    """Пересчет всего, что массовая загрузка обходит: счетчики, рейтинги, индексы, кэши"""
+    counters.recount_answers(batch_size)
+    counters.recount_tags(batch_size)
+    for kind in voting.KINDS:
+        voting.check_ratings(kind, batch_size, fix=True)
+    ranking.update_hot_scores(batch_size)
+    reputation.rebuild_ledger(batch_size)
+    tag_index.rebuild(batch_size)
+    tag_index.invalidate_names()
+    search.rebuild()
+    sidebar.bump_version()
@@ -0,0 +1,136 @@
+"""
+Живые обновления страницы вопроса через server-sent events: новые ответы
+и изменения рейтинга вопроса и его ответов.
+
+Брокер живет в памяти процесса. Подписчик - очередь asyncio в цикле событий
+ASGI-воркера; publish() вызывается из любого потока (сигналы, голосование)
+после фиксации транзакции и передает событие в цикл подписчика через
+call_soon_threadsafe. Ждущий зритель не занимает ни потока, ни соединения
+с БД - только корутину над пустой очередью и раз в LIVE_KEEPALIVE_SECONDS
+отправляет комментарий, чтобы прокси не закрыли соединение.
+
+Зритель, который не успевает читать (очередь длиннее LIVE_QUEUE_SIZE),
+отключается; браузер переподключится сам через LIVE_RETRY_MS. События
+доходят до зрителей, подключенных к тому же процессу, в котором была запись.
+"""
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+
+class Subscription:
+    __slots__ = ('question_id', 'loop', 'queue', 'closed')
+
+    def __init__(self, question_id, loop, size):
+        self.question_id = question_id
+        self.loop = loop
+        self.queue = asyncio.Queue(size)
+        self.closed = False
+
+    def deliver(self, message):
+        """Выполняется в цикле событий подписчика"""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.closed = True
+
+
+_subscribers = {}
+_lock = threading.Lock()
+
+
+def subscribe(question_id):
+    subscription = Subscription(question_id, asyncio.get_running_loop(), getattr(settings, 'LIVE_QUEUE_SIZE', 100))
+    with _lock:
+        _subscribers.setdefault(question_id, set()).add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription):
+    with _lock:
+        subscriptions = _subscribers.get(subscription.question_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del _subscribers[subscription.question_id]
+
+
+def format_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)}\n\n'
+
+
+def publish(question_id, event, data):
+    """Событие всем зрителям вопроса в этом процессе; возвращает число зрителей"""
+    with _lock:
+        subscriptions = list(_subscribers.get(question_id, ()))
+    if not subscriptions:
+        return 0
+    message = format_event(event, data)
+    for subscription in subscriptions:
+        try:
+            subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+        except RuntimeError:
+            # Цикл событий уже закрыт
+            unsubscribe(subscription)
+    return len(subscriptions)
+
+
+def publish_on_commit(question_id, event, data):
+    transaction.on_commit(lambda: publish(question_id, event, data))
+
+
+def watching():
+    """Есть ли в процессе зрители; без них события не собираются"""
+    return bool(_subscribers)
+
+
+def answer_created(answer):
+    if not watching():
+        return
+    publish_on_commit(answer.question_id, 'answer', {
+        'id': answer.pk,
+        'author': answer.author.user.username,
+        'avatar': answer.author.avatar_small,
+        'body_html': answer.body_html,
+        'rating': answer.rating,
+        'created_date': answer.created_date,
+    })
+
+
+def ratings_changed(kind, deltas, question_ids):
+    """deltas - {id цели: изменение рейтинга}, question_ids - {id цели: id вопроса}"""
+    if not watching():
+        return
+    for target_id, delta in deltas.items():
+        if delta and target_id in question_ids:
+            publish_on_commit(question_ids[target_id], 'rating', {'kind': kind, 'id': target_id, 'delta': delta})
+
+
+async def stream(question_id):
+    """Тело ответа text/event-stream; подписка снимается при отключении клиента"""
+    subscription = subscribe(question_id)
+    keepalive = getattr(settings, 'LIVE_KEEPALIVE_SECONDS', 15)
+    try:
+        yield f'retry: {getattr(settings, "LIVE_RETRY_MS", 5000)}\n\n'
+        while not subscription.closed:
+            try:
+                yield await asyncio.wait_for(subscription.queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+    finally:
+        unsubscribe(subscription)
+
+
+def stats():
+    """Число вопросов со зрителями и зрителей в этом процессе для /perf/"""
+    with _lock:
+        return {
+            'questions': len(_subscribers),
+            'subscribers': sum(len(subscriptions) for subscriptions in _subscribers.values()),
+        }
@@ -0,0 +1,88 @@
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, update_last_login
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+
+from app import profiles
+from app.benchmark import QueryCounter
+from app.models import Profile
+
+
+def legacy_save_user_profile(sender, instance, **kwargs):
+    """Прежний обработчик: пересохранял профиль при каждом сохранении пользователя"""
+    if hasattr(instance, 'profile'):
+        instance.profile.save()
+    else:
+        Profile.objects.get_or_create(user=instance)
+
+
+@contextmanager
+def legacy_receiver():
+    post_save.connect(legacy_save_user_profile, sender=User, dispatch_uid='bench_legacy_profile')
+    try:
+        yield
+    finally:
+        post_save.disconnect(sender=User, dispatch_uid='bench_legacy_profile')
+
+
+class Command(BaseCommand):
+    help = ('Замер создания пользователей с профилями и обновления last_login при входе: '
+            'операций в секунду и SQL на операцию. Все изменения откатываются')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500,
+                            help='Сколько пользователей создавать в каждом замере')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Размер пачки для массового создания')
+        parser.add_argument('--legacy', action='store_true',
+                            help='Также замерить с прежним обработчиком, пересохранявшим профиль')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--users и --batch-size должны быть не меньше 1')
+        scenarios = [('текущий', nullcontext)]
+        if options['legacy']:
+            scenarios.append(('прежний', legacy_receiver))
+        # Хэширование пароля не относится к профилям и заглушило бы разницу
+        self.password = make_password(None)
+
+        for label, receivers in scenarios:
+            with receivers(), transaction.atomic():
+                users = self.measure(label, 'save()', options['users'], self.create_one_by_one)
+                self.measure(label, 'last_login', len(users), lambda n: self.login(users))
+                if label == 'текущий':
+                    self.measure(label, 'пачкой', options['users'],
+                                 lambda n: self.create_bulk(n, options['batch_size']))
+                transaction.set_rollback(True)
+
+    def measure(self, label, stage, total, func):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            result = func(total)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{label:<8} {stage:<11} {total:>6} за {elapsed:6.2f} с '
+            f'({total / elapsed if elapsed else 0:>8.0f}/с)  SQL на операцию {counter.count / total:.2f}'
+        )
+        return result
+
+    def usernames(self, total):
+        prefix = uuid.uuid4().hex[:8]
+        return [f'bench_{prefix}_{i}' for i in range(total)]
+
+    def create_one_by_one(self, total):
+        return [User.objects.create(username=name, password=self.password) for name in self.usernames(total)]
+
+    def login(self, users):
+        for user in users:
+            update_last_login(None, user)
+
+    def create_bulk(self, total, batch_size):
+        users = [User(username=name, password=self.password) for name in self.usernames(total)]
+        return profiles.create_users(users, batch_size)
@@ -0,0 +1,149 @@
+import platform
+from contextlib import nullcontext
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from app import benchmark
+from app.backends.postgresql_pool import pool as db_pool
+
+# Режим -> (функция прогона, корневой URLconf)
+MODES = {
+    'wsgi': (benchmark.run_route, 'ask_pupkin.urls'),
+    'asgi': (benchmark.arun_route, 'ask_pupkin.urls_async'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный прогон всех маршрутов: пропускная способность, задержки, SQL на запрос'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ratio', type=int, default=None,
+                            help='Перед прогоном заполнить базу через fill_db с этим коэффициентом')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Seed для fill_db')
+        parser.add_argument('--isolated', action='store_true',
+                            help='Прогон на отдельной тестовой базе, которая удаляется после')
+        parser.add_argument('--routes', default='',
+                            help='Маршруты через запятую (по умолчанию все)')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Запросов на маршрут')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Число параллельных клиентов')
+        parser.add_argument('--mode', choices=['wsgi', 'asgi', 'both'], default='wsgi',
+                            help='Синхронные представления через потоки (wsgi), асинхронные '
+                                 'через ASGI-обработчик (asgi) или оба режима для сравнения')
+        parser.add_argument('--connections', choices=['current', 'direct', 'pooled', 'both'],
+                            default='current',
+                            help='Соединения из настроек (current), новое подключение на каждый '
+                                 'запрос (direct), пул (pooled) или оба для сравнения; '
+                                 'кроме current - только PostgreSQL')
+        parser.add_argument('--output', help='Сохранить результаты в JSON')
+        parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Допустимый рост p95 относительно baseline (доля)')
+
+    def handle(self, *args, **options):
+        if options['isolated']:
+            if options['ratio'] is None:
+                raise CommandError('--isolated требует --ratio для заполнения тестовой базы')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+            try:
+                return self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        return self.run(options)
+
+    def connection_mode(self, mode):
+        return nullcontext() if mode == 'current' else benchmark.connection_mode(mode)
+
+    def run(self, options):
+        if options['ratio'] is not None:
+            call_command('fill_db', options['ratio'], seed=options['seed'], stdout=self.stdout)
+
+        urls = benchmark.route_urls()
+        if options['routes']:
+            wanted = options['routes'].split(',')
+            unknown = set(wanted) - set(urls)
+            if unknown:
+                raise CommandError(f'Неизвестные маршруты: {", ".join(sorted(unknown))}')
+            urls = {name: urls[name] for name in wanted}
+
+        results = {
+            'meta': {
+                'started': timezone.now().isoformat(),
+                'vendor': connection.vendor,
+                'python': platform.python_version(),
+                'ratio': options['ratio'],
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'mode': options['mode'],
+                'connections': options['connections'],
+            },
+            'routes': {},
+        }
+        modes = ['wsgi', 'asgi'] if options['mode'] == 'both' else [options['mode']]
+        connection_modes = (['direct', 'pooled'] if options['connections'] == 'both'
+                            else [options['connections']])
+        if connection_modes != ['current'] and connection.vendor != 'postgresql':
+            raise CommandError('Сравнение соединений возможно только на PostgreSQL')
+        for connection_mode in connection_modes:
+            for mode in modes:
+                run_route, urlconf = MODES[mode]
+                suffix = ([mode] if len(modes) > 1 else []) + (
+                    [connection_mode] if len(connection_modes) > 1 else [])
+                with self.connection_mode(connection_mode), \
+                        override_settings(ALLOWED_HOSTS=['testserver'], ROOT_URLCONF=urlconf):
+                    for name, url in urls.items():
+                        stats = run_route(url, options['requests'], options['concurrency'])
+                        key = ':'.join([name] + suffix)
+                        results['routes'][key] = stats
+                        latency = stats['latency_ms']
+                        self.stdout.write(
+                            f'{key:<15} {stats["throughput_rps"]:>8.1f} rps  '
+                            f'p50 {latency["p50"]:>7.2f} мс  p95 {latency["p95"]:>7.2f} мс  '
+                            f'p99 {latency["p99"]:>7.2f} мс  SQL {stats["queries_per_request"]:>5.1f}  '
+                            f'ошибок {stats["errors"]}'
+                        )
+
+        if len(modes) > 1 and len(connection_modes) == 1:
+            self.stdout.write('ASGI относительно WSGI (пропускная способность, p95):')
+            for name in urls:
+                wsgi, asgi = results['routes'][f'{name}:wsgi'], results['routes'][f'{name}:asgi']
+                ratio = asgi['throughput_rps'] / wsgi['throughput_rps'] if wsgi['throughput_rps'] else 0
+                self.stdout.write(
+                    f'{name:<10} x{ratio:.2f}  '
+                    f'{wsgi["latency_ms"]["p95"]:.2f} -> {asgi["latency_ms"]["p95"]:.2f} мс'
+                )
+
+        if len(connection_modes) > 1:
+            self.stdout.write('Пул относительно нового подключения на каждый запрос (p50, p95):')
+            for key, direct in list(results['routes'].items()):
+                if not key.endswith(':direct'):
+                    continue
+                name = key[:-len(':direct')]
+                pooled = results['routes'][f'{name}:pooled']
+                before, after = direct['latency_ms'], pooled['latency_ms']
+                self.stdout.write(
+                    f'{name:<15} {before["p50"]:.2f} -> {after["p50"]:.2f} мс  '
+                    f'{before["p95"]:.2f} -> {after["p95"]:.2f} мс  '
+                    f'({after["p50"] - before["p50"]:+.2f} мс на запрос)'
+                )
+            self.stdout.write(f'Пул соединений: {db_pool.stats()}')
+
+        if options['output']:
+            benchmark.save_results(options['output'], results)
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
+
+        if options['baseline']:
+            regressions = benchmark.compare(
+                results, benchmark.load_results(options['baseline']), options['threshold']
+            )
+            for route, before, after in regressions:
+                self.stdout.write(self.style.ERROR(f'{route}: {before} -> {after}'))
+            if regressions:
+                raise CommandError(f'Регрессия производительности в {len(regressions)} маршрутах')
+            self.stdout.write(self.style.SUCCESS('Регрессий относительно baseline нет'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from app import avatars
+
+
+class Command(BaseCommand):
+    help = 'Миниатюры для аватаров, загруженных до их появления (иначе строятся при первом показе)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Сколько профилей отдавать пулу за один раз')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Число потоков (по умолчанию AVATAR_WORKERS)')
+
+    def handle(self, *args, **options):
+        processed = avatars.build_all(options['batch_size'], options['workers'])
+        self.stdout.write(self.style.SUCCESS(f'Обработано профилей: {processed}'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from app import voting
+
+
+class Command(BaseCommand):
+    help = 'Сверка рейтингов вопросов и ответов с таблицами оценок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Исправить найденные расхождения')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько строк проверять за один запрос')
+
+    def handle(self, *args, **options):
+        total = 0
+        for kind in voting.KINDS:
+            drifted = voting.check_ratings(kind, options['batch_size'], fix=options['fix'])
+            total += drifted
+            self.stdout.write(f'{kind}: расхождений {drifted}')
+
+        if not total:
+            self.stdout.write(self.style.SUCCESS('Рейтинги согласованы'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'Исправлено рейтингов: {total}'))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'Найдено расхождений: {total}, запустите с --fix для исправления'
+            ))
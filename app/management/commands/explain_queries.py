@@ -0,0 +1,83 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from app import tag_index
+from app.models import Answer, Profile, Question, Tag
+
+# Узлы плана, означающие полный просмотр таблицы
+SEQ_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (\w+)(?! USING)(?!.*\bINDEX\b)'),
+}
+INDEX_PATTERNS = {
+    'postgresql': re.compile(r'(Index Only Scan|Index Scan|Bitmap Index Scan)'),
+    'sqlite': re.compile(r'USING (COVERING )?INDEX|USING INTEGER PRIMARY KEY'),
+}
+SORT_PATTERNS = {
+    'postgresql': re.compile(r'^\s*(->\s*)?Sort\b', re.MULTILINE),
+    'sqlite': re.compile(r'USE TEMP B-TREE FOR ORDER BY'),
+}
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN для запросов менеджеров: индекс или полный просмотр таблицы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true',
+                            help='Печатать планы запросов целиком')
+        parser.add_argument('--strict', action='store_true',
+                            help='Завершиться с ошибкой, если найден полный просмотр')
+
+    def manager_queries(self):
+        """Запросы в том виде, в каком их выполняют представления"""
+        question = Question.objects.order_by('-id').first()
+        tag = Tag.objects.order_by('-question_count').first()
+        now = timezone.now()
+        return [
+            ('Question.new_questions', Question.objects.new_questions()[:20]),
+            ('Question.new_questions (курсор)', Question.objects.new_questions().filter(
+                created_date__lte=now).order_by('-created_date', '-id')[:20]),
+            ('Question.best_questions', Question.objects.best_questions().order_by('-rating', '-id')[:20]),
+            ('Question.hot_questions', Question.objects.hot_questions()[:20]),
+            ('ranking.update_hot_scores', Question.objects.filter(hot_dirty=True).order_by()
+                .values_list('pk', 'rating', 'answers_count', 'created_date')[:1000]),
+            ('tag_index.entries', tag_index.entries(tag.pk if tag else 0)
+                .order_by(*tag_index.FEED_ORDERING)[:21]),
+            ('Question.by_tag', Question.objects.by_tag(tag.name if tag else '')[:20]),
+            ('Answer.for_question', Answer.objects.for_question(question.id if question else 0)[:30]),
+            ('Tag.popular_tags', Tag.objects.popular_tags()),
+            ('Profile.best_profiles', Profile.objects.best_profiles()),
+        ]
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in SEQ_SCAN_PATTERNS:
+            raise CommandError(f'Разбор планов для {vendor} не поддерживается')
+
+        seq_total = 0
+        for label, queryset in self.manager_queries():
+            plan = queryset.explain()
+            seq_tables = sorted(set(SEQ_SCAN_PATTERNS[vendor].findall(plan)))
+            uses_index = bool(INDEX_PATTERNS[vendor].search(plan))
+            sorts = bool(SORT_PATTERNS[vendor].search(plan))
+
+            if seq_tables:
+                seq_total += 1
+                status = self.style.WARNING(f'SEQ SCAN ({", ".join(seq_tables)})')
+            elif uses_index:
+                status = self.style.SUCCESS('INDEX')
+            else:
+                status = 'нет обращений к таблицам'
+            if sorts:
+                status += ' + сортировка'
+            self.stdout.write(f'{label:<36} {status}')
+
+            if options['verbose_plans']:
+                self.stdout.write(plan)
+                self.stdout.write('')
+
+        if seq_total and options['strict']:
+            raise CommandError(f'Полный просмотр таблицы в {seq_total} запросах')
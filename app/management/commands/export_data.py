@@ -0,0 +1,34 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import dataset
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка профилей, тегов, вопросов, ответов и оценок в NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл для записи ("-" - стандартный вывод); .gz включает сжатие')
+        parser.add_argument('--gzip', action='store_true', default=None,
+                            help='Сжимать gzip независимо от имени файла')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Сколько строк читать из базы за раз')
+        parser.add_argument('--with-passwords', action='store_true',
+                            help='Выгрузить хеши паролей (по умолчанию пароли не переносятся)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['path'] == '-':
+            counts = dataset.export(sys.stdout, options['batch_size'], options['with_passwords'])
+        else:
+            with dataset.open_dataset(options['path'], 'w', options['gzip']) as stream:
+                counts = dataset.export(stream, options['batch_size'], options['with_passwords'])
+        elapsed = time.perf_counter() - started
+
+        # При выгрузке в stdout отчет не должен смешиваться с данными
+        report = self.stderr if options['path'] == '-' else self.stdout
+        for name, count in counts.items():
+            report.write(f'{name}: {count}')
+        report.write(self.style.SUCCESS(f'Выгружено строк: {sum(counts.values())} за {elapsed:.1f} с'))
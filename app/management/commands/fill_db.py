@@ -1,270 +1,342 @@
-import os
-import django
-from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
-from app.models import Profile, Tag, Question, Answer, QuestionLike, AnswerLike
-from faker import Faker
+import csv
+import io
 import random
-from django.db import transaction
-from django.db.models import Max
+import time
+from array import array
+from multiprocessing import Pool
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from app.models import (
+    Profile, Tag, Question, Answer, QuestionLike, AnswerLike, SearchEntry, SearchTerm, ReputationEvent,
+    TagFeedEntry,
+)
+from app import dataset, profiles, ranking
+from app.content import make_excerpt, render_body
+
+RUSSIAN_NAMES = [
+    'иван', 'алексей', 'сергей', 'дмитрий', 'михаил', 'андрей', 'максим',
+    'анна', 'елена', 'ольга', 'наталья', 'ирина', 'светлана', 'мария'
+]
+
+DOMAINS = ['gmail.com', 'yandex.ru', 'mail.ru', 'hotmail.com']
+
+QUESTION_TEMPLATES = [
+    "Как настроить {}?",
+    "В чем разница между {} и {}?",
+    "Как оптимизировать {}?",
+    "Лучшие практики работы с {}",
+    "Как работает {}?",
+    "С чего начать изучение {}?",
+    "Как развернуть {} на сервере?",
+    "В чем преимущества {}?",
+    "Как писать {}?",
+    "Какие {} выбрать для {}?",
+    "Как работает {}?",
+    "Что такое {}?",
+    "Как защитить {}?",
+    "Оптимизация {}",
+    "Разработка на {}"
+]
+
+TECH_TERMS = [
+    'python', 'django', 'базы данных', 'алгоритмы', 'html', 'css',
+    'javascript', 'linux', 'git', 'docker', 'машинное обучение',
+    'веб разработка', 'мобильная разработка', 'тестирование', 'sql',
+    'postgresql', 'redis', 'nginx', 'react', 'vue', 'angular',
+    'rest api', 'graphql', 'микросервисы', 'kubernetes', 'aws',
+    'цифровая безопасность', 'нейронные сети', 'блокчейн', 'big data'
+]
+
+ANSWER_TEMPLATES = [
+    "Для решения этой проблемы нужно {}.",
+    "Я рекомендую использовать {}.",
+    "Лучший подход - это {}.",
+    "В данном случае поможет {}.",
+    "Основные шаги: {}.",
+    "Сначала нужно {}, затем {}.",
+    "Это зависит от {}, но обычно {}.",
+    "Я сталкивался с подобным и решил через {}.",
+    "По моему опыту, лучше всего {}.",
+    "Можно использовать {} или {}."
+]
+
+
+def fill_template(rnd, template):
+    return template.format(*(rnd.choice(TECH_TERMS) for _ in range(template.count('{}'))))
+
+
+# Генераторы строк. Работают без обращений к БД, поэтому их можно запускать
+# в отдельных процессах; результат зависит только от seed и номера пачки.
+
+_ids = {}
+
+
+def _init_worker(ids):
+    _ids.clear()
+    _ids.update(ids)
+
+
+def gen_users(rnd, start, size):
+    for i in range(start, start + size):
+        name = rnd.choice(RUSSIAN_NAMES)
+        yield (f'{name}_{i}', f'{name}{i}@{rnd.choice(DOMAINS)}')
+
+
+def gen_questions(rnd, start, size):
+    profile_ids = _ids['profiles']
+    for i in range(start, start + size):
+        title = fill_template(rnd, rnd.choice(QUESTION_TEMPLATES)) + f' ({i})'
+        text = ' '.join(
+            fill_template(rnd, rnd.choice(ANSWER_TEMPLATES)) for _ in range(rnd.randint(2, 5))
+        )
+        yield (title, text, make_excerpt(text), render_body(text), rnd.choice(profile_ids))
+
+
+def gen_question_tags(rnd, start, size):
+    question_ids, tag_ids = _ids['questions'], _ids['tags']
+    for i in range(start, start + size):
+        yield (question_ids[i], rnd.choice(tag_ids))
+
+
+def gen_answers(rnd, start, size):
+    profile_ids, question_ids = _ids['profiles'], _ids['questions']
+    for _ in range(size):
+        text = fill_template(rnd, rnd.choice(ANSWER_TEMPLATES))
+        yield (
+            text,
+            render_body(text),
+            rnd.choice(profile_ids),
+            rnd.choice(question_ids),
+            rnd.random() < 0.1,
+        )
+
+
+def _gen_likes(target):
+    def generate(rnd, start, size):
+        profile_ids, target_ids = _ids['profiles'], _ids[target]
+        for _ in range(size):
+            yield (rnd.choice(profile_ids), rnd.choice(target_ids), rnd.choice((-1, 1)))
+    return generate
+
+
+GENERATORS = {
+    'users': gen_users,
+    'questions': gen_questions,
+    'question_tags': gen_question_tags,
+    'answers': gen_answers,
+    'question_likes': _gen_likes('questions'),
+    'answer_likes': _gen_likes('answers'),
+}
+
+
+def generate_chunk(task):
+    stage, seed, start, size = task
+    rnd = random.Random(f'{seed}:{stage}:{start}')
+    return list(GENERATORS[stage](rnd, start, size))
+
 
 class Command(BaseCommand):
     help = 'Заполнение базы данных тестовыми данными'
-    
+
     def add_arguments(self, parser):
         parser.add_argument('ratio', type=int, help='Коэффициент для генерации данных')
-    
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Сколько строк генерировать и вставлять за раз')
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Seed генератора; при одинаковом seed данные совпадают')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Число процессов для генерации строк')
+        parser.add_argument('--copy', action='store_true',
+                            help='Загружать строки через COPY (только PostgreSQL)')
+
     def handle(self, *args, **options):
         ratio = options['ratio']
-        
-        self.stdout.write(f'Начинаем заполнение базы данных с коэффициентом {ratio}')
+        self.batch_size = options['batch_size']
+        self.seed = options['seed'] if options['seed'] is not None else random.randrange(2 ** 32)
+        self.workers = options['workers']
+        self.use_copy = options['copy']
+        if self.use_copy and connection.vendor != 'postgresql':
+            raise CommandError('--copy поддерживается только для PostgreSQL')
+
+        self.stdout.write(f'Начинаем заполнение базы данных с коэффициентом {ratio} (seed {self.seed})')
         self.stdout.write('Очистка существующих данных...')
-        AnswerLike.objects.all().delete()
-        QuestionLike.objects.all().delete()
-        Answer.objects.all().delete()
-        Question.objects.all().delete()
-        Tag.objects.all().delete()
-        Profile.objects.all().delete()
-        User.objects.exclude(is_superuser=True).delete()
+        self.clear()
 
-        russian_names = [
-            'иван', 'алексей', 'сергей', 'дмитрий', 'михаил', 'андрей', 'максим',
-            'анна', 'елена', 'ольга', 'наталья', 'ирина', 'светлана', 'мария'
-        ]
-        
-        domains = ['gmail.com', 'yandex.ru', 'mail.ru', 'hotmail.com']
-        
-        question_templates = [
-            "Как настроить {}?",
-            "В чем разница между {} и {}?",
-            "Как оптимизировать {}?",
-            "Лучшие практики работы с {}",
-            "Как работает {}?",
-            "С чего начать изучение {}?",
-            "Как развернуть {} на сервере?",
-            "В чем преимущества {}?",
-            "Как писать {}?",
-            "Какие {} выбрать для {}?",
-            "Как работает {}?",
-            "Что такое {}?",
-            "Как защитить {}?",
-            "Оптимизация {}",
-            "Разработка на {}"
-        ]
-        
-        tech_terms = [
-            'python', 'django', 'базы данных', 'алгоритмы', 'html', 'css', 
-            'javascript', 'linux', 'git', 'docker', 'машинное обучение',
-            'веб разработка', 'мобильная разработка', 'тестирование', 'sql',
-            'postgresql', 'redis', 'nginx', 'react', 'vue', 'angular',
-            'rest api', 'graphql', 'микросервисы', 'kubernetes', 'aws',
-            'цифровая безопасность', 'нейронные сети', 'блокчейн', 'big data'
-        ]
-        
-        answer_templates = [
-            "Для решения этой проблемы нужно {}.",
-            "Я рекомендую использовать {}.",
-            "Лучший подход - это {}.",
-            "В данном случае поможет {}.",
-            "Основные шаги: {}.",
-            "Сначала нужно {}, затем {}.",
-            "Это зависит от {}, но обычно {}.",
-            "Я сталкивался с подобным и решил через {}.",
-            "По моему опыту, лучше всего {}.",
-            "Можно использовать {} или {}."
-        ]
+        self.ids = {}
+        self.now = timezone.now()
+        password = make_password('password123')
+        through = Question.tags.through
 
-        self.stdout.write('Создание пользователей...')
-        users = []
-        profiles = []
-
-        user_objs = []
-        for i in range(ratio):
-            name = random.choice(russian_names)
-            username = f'{name}_{i}'
-            email = f'{name}{i}@{random.choice(domains)}'
-            user = User(
-                username=username,
-                email=email,
-                password='password123'
-            )
-            user_objs.append(user)
-
-            if i % 5000 == 0 and i > 0:
-                self.stdout.write(f'Подготовлено {i} пользователей')
-
-        User.objects.bulk_create(user_objs)
-        self.stdout.write(f'Создано {len(user_objs)} пользователей')
-
-        created_users = User.objects.filter(username__startswith=f'{russian_names[0]}_')
-        profile_objs = []
-        for user in created_users:
-            profile = Profile(user=user)
-            profile_objs.append(profile)
-        
-        Profile.objects.bulk_create(profile_objs)
-        self.stdout.write(f'Создано {len(profile_objs)} профилей')
-
-        profiles = list(Profile.objects.all())
-
-        self.stdout.write('Создание тегов...')
-        tag_objs = []
-        for i in range(ratio):
-            if i < len(tech_terms):
-                tag_name = tech_terms[i]
-            else:
-                tag_name = f'технология_{i}'
-            
-            tag = Tag(name=tag_name)
-            tag_objs.append(tag)
-        
-        Tag.objects.bulk_create(tag_objs)
-        tags = list(Tag.objects.all())
-        self.stdout.write(f'Создано {len(tags)} тегов')
-
-        self.stdout.write('Создание вопросов...')
-        question_objs = []
-        for i in range(ratio * 10):
-            author = random.choice(profiles)
-
-            template = random.choice(question_templates)
-            if template.count('{}') == 1:
-                title = template.format(random.choice(tech_terms))
-            elif template.count('{}') == 2:
-                title = template.format(random.choice(tech_terms), random.choice(tech_terms))
-            else:
-                title = f"Вопрос о {random.choice(tech_terms)}"
-
-            text_parts = []
-            for _ in range(random.randint(2, 5)):
-                answer_template = random.choice(answer_templates)
-                if answer_template.count('{}') == 1:
-                    text_parts.append(answer_template.format(random.choice(tech_terms)))
-                elif answer_template.count('{}') == 2:
-                    text_parts.append(answer_template.format(random.choice(tech_terms), random.choice(tech_terms)))
-                else:
-                    text_parts.append(f"Рассмотрим аспект {random.choice(tech_terms)}.")
-            
-            text = ' '.join(text_parts)
-            
-            question = Question(
-                title=title + f" ({i})",
-                text=text,
-                author=author,
-                rating=random.randint(-10, 100),
-                created_date=django.utils.timezone.now()
-            )
-            question_objs.append(question)
-            
-            if i % 10000 == 0 and i > 0:
-                self.stdout.write(f'Подготовлено {i} вопросов')
-        
-        Question.objects.bulk_create(question_objs)
-        questions = list(Question.objects.all())
-        self.stdout.write(f'Создано {len(questions)} вопросов')
-
-        self.stdout.write('Добавление тегов к вопросам...')
-        for i, question in enumerate(questions):
-            question_tags = random.sample(tags, min(1, len(tags)))
-            question.tags.set(question_tags)
-            
-            if i % 10000 == 0 and i > 0:
-                self.stdout.write(f'Добавлены теги к {i} вопросам')
-
-        self.stdout.write('Создание ответов...')
-        answer_objs = []
-        for i in range(ratio * 100):
-            author = random.choice(profiles)
-            question = random.choice(questions)
-
-            answer_template = random.choice(answer_templates)
-            if answer_template.count('{}') == 1:
-                text = answer_template.format(random.choice(tech_terms))
-            elif answer_template.count('{}') == 2:
-                text = answer_template.format(random.choice(tech_terms), random.choice(tech_terms))
-            else:
-                text = f"Решение включает использование {random.choice(tech_terms)}."
-            
-            answer = Answer(
-                text=text,
-                author=author,
-                question=question,
-                is_correct=random.random() < 0.1,
-                rating=random.randint(-5, 50),
-                created_date=django.utils.timezone.now()
-            )
-            answer_objs.append(answer)
-            
-            if i % 100000 == 0 and i > 0:
-                self.stdout.write(f'Подготовлено {i} ответов')
-        
-        Answer.objects.bulk_create(answer_objs)
-        answers = list(Answer.objects.all())
-        self.stdout.write(f'Создано {len(answers)} ответов')
-
-        self.stdout.write('Создание лайков вопросов...')
-        question_like_objs = []
-        existing_likes = set()
-        
-        for i in range(ratio * 100):
-            user = random.choice(profiles)
-            question = random.choice(questions)
-
-            like_key = (user.id, question.id)
-            if like_key in existing_likes:
-                continue
-                
-            existing_likes.add(like_key)
-            
-            question_like = QuestionLike(
-                user=user,
-                question=question,
-                value=random.choice([-1, 1])
-            )
-            question_like_objs.append(question_like)
-            
-            if i % 50000 == 0 and i > 0:
-                self.stdout.write(f'Подготовлено {i} лайков вопросов')
-        
-        QuestionLike.objects.bulk_create(question_like_objs)
-        self.stdout.write(f'Создано {len(question_like_objs)} лайков вопросов')
-
-        self.stdout.write('Создание лайков ответов...')
-        answer_like_objs = []
-        existing_answer_likes = set()
-        
-        for i in range(ratio * 100):
-            user = random.choice(profiles)
-            answer = random.choice(answers)
-            
-            like_key = (user.id, answer.id)
-            if like_key in existing_answer_likes:
-                continue
-                
-            existing_answer_likes.add(like_key)
-            
-            answer_like = AnswerLike(
-                user=user,
-                answer=answer,
-                value=random.choice([-1, 1])
-            )
-            answer_like_objs.append(answer_like)
-            
-            if i % 50000 == 0 and i > 0:
-                self.stdout.write(f'Подготовлено {i} лайков ответов')
-        
-        AnswerLike.objects.bulk_create(answer_like_objs)
-        self.stdout.write(f'Создано {len(answer_like_objs)} лайков ответов')
+        user_fields = {'password': password, 'is_superuser': False, 'is_staff': False,
+                       'is_active': True, 'first_name': '', 'last_name': '', 'date_joined': self.now}
+        if self.use_copy:
+            self.run_stage('users', ratio, User, ['username', 'email'], extra=user_fields)
+            self.timed('profiles', lambda: profiles.provision_missing(self.batch_size))
+            self.ids['profiles'] = self.load_ids(Profile.objects.all())
+        else:
+            self.timed('users', lambda: self.create_users(ratio, user_fields))
+
+        tag_names = [TECH_TERMS[i] if i < len(TECH_TERMS) else f'технология_{i}' for i in range(ratio)]
+        self.timed('tags', lambda: self.insert_rows(
+            Tag, ['name'], ((name,) for name in tag_names)
+        ))
+        self.ids['tags'] = self.load_ids(Tag.objects.all())
+
+        self.run_stage('questions', ratio * 10, Question, ['title', 'text', 'excerpt', 'body_html', 'author_id'],
+                       extra={'rating': 0, 'answers_count': 0, 'created_date': self.now,
+                              'hot_score': ranking.hot_score(0, 0, self.now), 'hot_dirty': True, 'views': 0})
+        self.ids['questions'] = self.load_ids(Question.objects.all())
+
+        self.run_stage('question_tags', len(self.ids['questions']), through, ['question_id', 'tag_id'])
+
+        self.run_stage('answers', ratio * 100, Answer, ['text', 'body_html', 'author_id', 'question_id', 'is_correct'],
+                       extra={'rating': 0, 'created_date': self.now})
+        self.ids['answers'] = self.load_ids(Answer.objects.all())
+
+        self.run_stage('question_likes', ratio * 100, QuestionLike,
+                       ['user_id', 'question_id', 'value'], ignore_conflicts=True)
+        self.run_stage('answer_likes', ratio * 100, AnswerLike,
+                       ['user_id', 'answer_id', 'value'], ignore_conflicts=True)
+
+        self.stdout.write('Пересчет счетчиков...')
+        self.timed('counters', self.rebuild_derived)
 
         self.stdout.write(
             self.style.SUCCESS(
                 f'База данных успешно заполнена:\n'
-                f'Пользователей: {len(profiles)}\n'
-                f'Тегов: {len(tags)}\n'
-                f'Вопросов: {len(questions)}\n'
-                f'Ответов: {len(answers)}\n'
-                f'Лайков вопросов: {len(question_like_objs)}\n'
-                f'Лайков ответов: {len(answer_like_objs)}\n'
-                f'Всего оценок: {len(question_like_objs) + len(answer_like_objs)}'
+                f'Пользователей: {len(self.ids["profiles"])}\n'
+                f'Тегов: {len(self.ids["tags"])}\n'
+                f'Вопросов: {len(self.ids["questions"])}\n'
+                f'Ответов: {len(self.ids["answers"])}\n'
+                f'Лайков вопросов: {QuestionLike.objects.count()}\n'
+                f'Лайков ответов: {AnswerLike.objects.count()}'
             )
         )
+
+    def clear(self):
+        """Очистка без загрузки объектов и сигналов на каждую строку"""
+        models = [AnswerLike, QuestionLike, SearchEntry, SearchTerm, ReputationEvent, TagFeedEntry, Answer,
+                  Question.tags.through, Question, Tag, Profile]
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model in models:
+                cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)}')
+        User.objects.exclude(is_superuser=True).delete()
+
+    def load_ids(self, queryset):
+        ids = array('q')
+        ids.extend(queryset.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=self.batch_size))
+        return ids
+
+    def timed(self, stage, func):
+        started = time.perf_counter()
+        rows = func()
+        elapsed = time.perf_counter() - started
+        rate = rows / elapsed if elapsed else 0
+        self.stdout.write(f'{stage}: {rows} строк за {elapsed:.1f} с ({rate:.0f} строк/с)')
+        return rows
+
+    def chunks(self, stage, total):
+        """Пачки строк по порядку; при --workers > 1 генерируются параллельно"""
+        tasks = [
+            (stage, self.seed, start, min(self.batch_size, total - start))
+            for start in range(0, total, self.batch_size)
+        ]
+        if self.workers <= 1:
+            _init_worker(self.ids)
+            for task in tasks:
+                yield generate_chunk(task)
+            return
+        with Pool(self.workers, initializer=_init_worker, initargs=(self.ids,)) as pool:
+            yield from pool.imap(generate_chunk, tasks)
+
+    def run_stage(self, stage, total, model, columns, extra=None, ignore_conflicts=False):
+        def load():
+            before = model.objects.count() if ignore_conflicts else 0
+            rows = (row for chunk in self.chunks(stage, total) for row in chunk)
+            written = self.insert_rows(model, columns, rows, extra, ignore_conflicts)
+            if ignore_conflicts:
+                # Пропущенные дубли bulk_create и COPY не сообщают: считаем записанное
+                written = model.objects.count() - before
+            return written
+        return self.timed(stage, load)
+
+    def insert_rows(self, model, columns, rows, extra=None, ignore_conflicts=False):
+        extra = extra or {}
+        if self.use_copy:
+            return self.copy_rows(model, columns, rows, extra, ignore_conflicts)
+
+        inserted = 0
+        batch = []
+        for row in rows:
+            batch.append(model(**dict(zip(columns, row)), **extra))
+            if len(batch) >= self.batch_size:
+                model.objects.bulk_create(batch, ignore_conflicts=ignore_conflicts)
+                inserted += len(batch)
+                batch = []
+        model.objects.bulk_create(batch, ignore_conflicts=ignore_conflicts)
+        return inserted + len(batch)
+
+    def create_users(self, total, user_fields):
+        """Пользователи вместе с профилями; id профилей приходят из вставки, без повторного чтения"""
+        self.ids['profiles'] = array('q')
+        for chunk in self.chunks('users', total):
+            created = profiles.create_users([
+                User(username=username, email=email, **user_fields) for username, email in chunk
+            ], self.batch_size)
+            self.ids['profiles'].extend(profile.pk for profile in created)
+        return len(self.ids['profiles'])
+
+    def copy_rows(self, model, columns, rows, extra, ignore_conflicts):
+        """COPY пачками; при возможных дублях - через временную таблицу и ON CONFLICT"""
+        quote = connection.ops.quote_name
+        table = quote(model._meta.db_table)
+        names = [model._meta.get_field(name).column for name in columns] + list(extra)
+        column_sql = ', '.join(quote(name) for name in names)
+        extra_values = list(extra.values())
+
+        inserted = 0
+        pending = 0
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        with transaction.atomic(), connection.cursor() as cursor:
+            target = table
+            if ignore_conflicts:
+                target = quote(f'fill_db_{model._meta.db_table}')
+                cursor.execute(
+                    f'CREATE TEMP TABLE {target} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP'
+                )
+
+            def flush():
+                buffer.seek(0)
+                cursor.cursor.copy_expert(
+                    f'COPY {target} ({column_sql}) FROM STDIN WITH (FORMAT csv)', buffer
+                )
+                buffer.seek(0)
+                buffer.truncate()
+
+            for row in rows:
+                writer.writerow([*row, *extra_values])
+                pending += 1
+                if pending >= self.batch_size:
+                    flush()
+                    inserted += pending
+                    pending = 0
+            if pending:
+                flush()
+                inserted += pending
+
+            if ignore_conflicts:
+                cursor.execute(
+                    f'INSERT INTO {table} ({column_sql}) SELECT {column_sql} FROM {target} '
+                    f'ON CONFLICT DO NOTHING'
+                )
+        return inserted
+
+    def rebuild_derived(self):
+        dataset.rebuild_derived(self.batch_size)
+        return len(self.ids['questions'])
@@ -0,0 +1,43 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import dataset
+
+
+class Command(BaseCommand):
+    help = 'Загрузка набора данных из NDJSON (export_data) с пересчетом производных данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл с данными ("-" - стандартный ввод); .gz распаковывается')
+        parser.add_argument('--gzip', action='store_true', default=None,
+                            help='Файл сжат gzip независимо от имени')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Сколько записей вставлять одним bulk_create')
+        parser.add_argument('--keep-ids', action='store_true',
+                            help='Сохранить id из файла (для пустой базы): отображение id не держится в памяти; '
+                                 'иначе id назначает база')
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='Не пересчитывать счетчики, рейтинги и индексы после загрузки')
+
+    def handle(self, *args, **options):
+        importer = dataset.Importer(options['batch_size'], options['keep_ids'])
+        started = time.perf_counter()
+        try:
+            if options['path'] == '-':
+                counts = importer.load(sys.stdin)
+            else:
+                with dataset.open_dataset(options['path'], 'r', options['gzip']) as stream:
+                    counts = importer.load(stream)
+        except ValueError as error:
+            raise CommandError(error)
+        for name, count in counts.items():
+            self.stdout.write(f'{name}: {count}')
+        self.stdout.write(f'Загрузка: {time.perf_counter() - started:.1f} с')
+
+        if not options['skip_derived']:
+            started = time.perf_counter()
+            dataset.rebuild_derived(options['batch_size'])
+            self.stdout.write(f'Пересчет производных данных: {time.perf_counter() - started:.1f} с')
+        self.stdout.write(self.style.SUCCESS('Данные загружены'))
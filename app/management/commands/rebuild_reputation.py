@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from app import reputation, sidebar
+
+
+class Command(BaseCommand):
+    help = 'Сверка репутации с журналом событий, сжатие журнала или его полная перестройка'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compact', action='store_true',
+                            help='Свернуть события по одному объекту в одну запись')
+        parser.add_argument('--from-source', action='store_true',
+                            help='Построить журнал заново по вопросам, ответам и оценкам')
+        parser.add_argument('--check', action='store_true',
+                            help='Только найти расхождения, не исправляя их')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько профилей обрабатывать за одну транзакцию')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['from_source']:
+            written = reputation.rebuild_ledger(batch_size)
+            self.stdout.write(f'Записано событий: {written}')
+        elif options['compact']:
+            removed = reputation.compact(batch_size)
+            self.stdout.write(f'Удалено событий при сжатии: {removed}')
+
+        drifted = reputation.rebuild(batch_size, fix=not options['check'])
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('Репутация согласована с журналом'))
+        elif options['check']:
+            self.stdout.write(self.style.WARNING(
+                f'Найдено расхождений: {drifted}, запустите без --check для исправления'
+            ))
+        else:
+            sidebar.bump_version()
+            self.stdout.write(self.style.SUCCESS(f'Исправлено профилей: {drifted}'))
+        if options['from_source']:
+            sidebar.bump_version()
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from app import search
+
+
+class Command(BaseCommand):
+    help = 'Полная перестройка поискового индекса вопросов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Сколько вопросов индексировать за один проход')
+
+    def handle(self, *args, **options):
+        indexed = search.rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано вопросов: {indexed}'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from app import tag_index
+
+
+class Command(BaseCommand):
+    help = 'Полная перестройка лент вопросов по тегам и сброс кэша имен тегов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько вопросов обрабатывать за один проход')
+
+    def handle(self, *args, **options):
+        written = tag_index.rebuild(options['batch_size'])
+        tag_index.invalidate_names()
+        self.stdout.write(self.style.SUCCESS(f'Записей в лентах тегов: {written}'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from app import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчет денормализованных счетчиков ответов и вопросов по тегам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько строк проверять за один запрос')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        answers = counters.recount_answers(batch_size)
+        self.stdout.write(f'Исправлено счетчиков ответов: {answers}')
+        tags = counters.recount_tags(batch_size)
+        self.stdout.write(f'Исправлено счетчиков тегов: {tags}')
+        self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from app import sidebar
+
+
+class Command(BaseCommand):
+    help = 'Пересчет блоков сайдбара (популярные теги, лучшие пользователи)'
+
+    def handle(self, *args, **options):
+        for name in sidebar.BLOCKS:
+            value = sidebar.refresh(name)
+            self.stdout.write(f'{name}: {len(value)} записей')
+        self.stdout.write(self.style.SUCCESS('Сайдбар обновлен'))
@@ -0,0 +1,23 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from app import content
+
+
+class Command(BaseCommand):
+    help = 'Расчет excerpt и body_html для вопросов и ответов, сохраненных без них'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько записей обрабатывать за одну пачку')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Число процессов для обработки текста')
+        parser.add_argument('--all', action='store_true', dest='everything',
+                            help='Перестроить все записи, например после изменения правил разметки')
+
+    def handle(self, *args, **options):
+        written = content.rebuild(options['batch_size'], options['workers'], options['everything'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано вопросов: {written["question"]}, ответов: {written["answer"]}'
+        ))
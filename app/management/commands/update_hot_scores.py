@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import ranking
+
+
+class Command(BaseCommand):
+    help = 'Пересчет оценок ленты "Hot" для вопросов, измененных с прошлого запуска'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько вопросов пересчитывать в одной транзакции')
+        parser.add_argument('--all', action='store_true',
+                            help='Пересчитать все вопросы, а не только измененные')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Работать в фоне, повторяя пересчет каждые N секунд')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            marked = ranking.mark_all_dirty()
+            self.stdout.write(f'Помечено для пересчета: {marked}')
+
+        while True:
+            updated = ranking.update_hot_scores(options['batch_size'])
+            self.stdout.write(f'Пересчитано оценок: {updated}')
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Оценки обновлены'))
@@ -0,0 +1,176 @@
+"""Замер времени запросов: SQL, шаблоны, заголовок Server-Timing и гистограммы по URL"""
+import functools
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template as DjangoTemplate
+
+from .utils import percentile
+
+_current = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.queries = Counter()
+        # Асинхронные представления выполняют SQL сразу из нескольких потоков
+        self._lock = threading.Lock()
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    @property
+    def duplicate_count(self):
+        return self.query_count - len(self.queries)
+
+    def sql_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.sql_time += elapsed
+                self.queries[(sql, repr(params))] += 1
+
+
+class PerformanceRegistry:
+    """Скользящее окно последних замеров для каждого имени URL"""
+
+    METRICS = ('total', 'db', 'template', 'queries', 'duplicates')
+
+    def __init__(self, size):
+        self.size = size
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, sample):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.size)
+            samples.append(sample)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+    def snapshot(self):
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+        result = {}
+        for name, values in samples.items():
+            stats = {'count': len(values)}
+            for i, metric in enumerate(self.METRICS):
+                column = [sample[i] for sample in values]
+                stats[metric] = {
+                    f'p{percent}': round(percentile(column, percent), 2)
+                    for percent in (50, 95, 99)
+                }
+            result[name] = stats
+        return result
+
+
+registry = PerformanceRegistry(getattr(settings, 'PERFORMANCE_HISTOGRAM_SIZE', 1000))
+
+# При повторной загрузке модуля render уже подменен: берется исходный,
+# иначе время шаблонов считалось бы обертками дважды
+_original_render = getattr(DjangoTemplate.render, '__wrapped__', DjangoTemplate.render)
+
+
+@functools.wraps(_original_render)
+def _timed_render(self, context=None, request=None):
+    stats = _current.get()
+    if stats is None:
+        return _original_render(self, context, request)
+    started = time.perf_counter()
+    try:
+        return _original_render(self, context, request)
+    finally:
+        stats.template_time += time.perf_counter() - started
+
+
+def _install_template_timer():
+    if DjangoTemplate.render is not _timed_render:
+        DjangoTemplate.render = _timed_render
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats.sql_wrapper(execute, sql, params, many, context)
+
+
+def _install_sql_wrapper(connection, **kwargs):
+    # Обертка ставится на соединение каждого потока, а запрос, к которому
+    # относится SQL, берется из контекстной переменной (она передается
+    # и в потоки sync_to_async)
+    if _sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql_wrapper)
+
+
+class PerformanceMiddleware:
+    """
+    Для каждого запроса считает общее время, число и время SQL-запросов,
+    повторяющиеся запросы и время рендеринга шаблонов.
+    Работает и в синхронном, и в асинхронном стеке обработчиков.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        _install_template_timer()
+        connection_created.connect(_install_sql_wrapper, dispatch_uid='performance_sql_wrapper')
+        for connection in connections.all(initialized_only=True):
+            _install_sql_wrapper(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, stats, started)
+
+    def _finish(self, request, response, stats, started):
+        total = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        name = match.view_name if match else 'unresolved'
+        registry.record(name, (
+            total * 1000, stats.sql_time * 1000, stats.template_time * 1000,
+            stats.query_count, stats.duplicate_count,
+        ))
+        response['Server-Timing'] = ', '.join([
+            f'total;dur={total * 1000:.1f}',
+            f'db;desc="SQL x{stats.query_count}, dup {stats.duplicate_count}";dur={stats.sql_time * 1000:.1f}',
+            f'tpl;desc="Templates";dur={stats.template_time * 1000:.1f}',
+        ])
+        return response
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:09
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count_subquery(queryset, group_field):
+    counts = queryset.order_by().values(group_field).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Question = apps.get_model('app', 'Question')
+    Answer = apps.get_model('app', 'Answer')
+    Tag = apps.get_model('app', 'Tag')
+    through = Question.tags.through
+
+    Question.objects.update(answers_count=_count_subquery(
+        Answer.objects.filter(question_id=OuterRef('pk')), 'question_id'
+    ))
+    Tag.objects.update(question_count=_count_subquery(
+        through.objects.filter(tag_id=OuterRef('pk')), 'tag_id'
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='answers_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='question_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
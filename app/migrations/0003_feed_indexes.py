@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['question', '-rating', '-created_date'], name='answer_for_question_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['-created_date', '-id'], name='question_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['-rating', '-id'], name='question_best_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['-question_count'], include=('id', 'name'), name='tag_popular_idx'),
+        ),
+    ]
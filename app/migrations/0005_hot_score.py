@@ -0,0 +1,71 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:22
+
+import math
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+from django.db.models import Case, FloatField, Value, When
+
+# Формула на момент миграции (ranking.py); код приложения может измениться,
+# а миграция должна давать тот же результат
+HOT_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+HOT_DECAY = 45000
+ANSWER_WEIGHT = 2
+
+
+def hot_score(rating, answers_count, created_date):
+    activity = rating + ANSWER_WEIGHT * answers_count
+    order = math.log10(max(abs(activity), 1))
+    sign = (activity > 0) - (activity < 0)
+    seconds = (created_date - HOT_EPOCH).total_seconds()
+    return round(sign * order + seconds / HOT_DECAY, 7)
+
+
+def fill_hot_scores(apps, schema_editor, batch_size=1000):
+    Question = apps.get_model('app', 'Question')
+    last_id = 0
+    while True:
+        rows = list(
+            Question.objects.filter(pk__gt=last_id).order_by('pk')
+            .values_list('pk', 'rating', 'answers_count', 'created_date')[:batch_size]
+        )
+        if not rows:
+            return
+        scores = {pk: hot_score(rating, answers, created) for pk, rating, answers, created in rows}
+        Question.objects.filter(pk__in=list(scores)).update(
+            hot_dirty=False,
+            hot_score=Case(
+                *[When(pk=pk, then=Value(score)) for pk, score in scores.items()],
+                output_field=FloatField(),
+            ),
+        )
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='hot_dirty',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['-hot_score', '-id'], name='question_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(condition=models.Q(('hot_dirty', True)), fields=['id'], name='question_hot_dirty_idx'),
+        ),
+        migrations.RunPython(fill_hot_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+# Баллы на момент миграции (reputation.py)
+QUESTION_POINTS = 1
+ANSWER_POINTS = 1
+VOTE_POINTS = 1
+
+
+def _rows(model, batch_size):
+    """Пачки (pk, author_id) по возрастанию pk"""
+    last_id = 0
+    while True:
+        rows = list(
+            model.objects.filter(pk__gt=last_id).order_by('pk')
+            .values_list('pk', 'author_id')[:batch_size]
+        )
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def fill_ledger(apps, schema_editor, batch_size=1000):
+    Profile = apps.get_model('app', 'Profile')
+    ReputationEvent = apps.get_model('app', 'ReputationEvent')
+    sources = [
+        ('Question', 'QuestionLike', 'question', QUESTION_POINTS),
+        ('Answer', 'AnswerLike', 'answer', ANSWER_POINTS),
+    ]
+    for model_name, like_name, kind, points in sources:
+        model = apps.get_model('app', model_name)
+        like_model = apps.get_model('app', like_name)
+        # События пишутся по пачке объектов: в памяти не больше пачки
+        for rows in _rows(model, batch_size):
+            events = [
+                ReputationEvent(profile_id=author_id, kind=kind, object_id=pk, delta=points)
+                for pk, author_id in rows
+            ]
+            votes = (
+                like_model.objects.filter(**{f'{kind}_id__in': [pk for pk, _ in rows]})
+                .order_by().values(kind).annotate(total=Sum('value'))
+                .values_list(kind, f'{kind}__author_id', 'total')
+            )
+            events.extend(
+                ReputationEvent(profile_id=author_id, kind=f'{kind}_vote', object_id=pk, delta=total * VOTE_POINTS)
+                for pk, author_id, total in votes if total
+            )
+            ReputationEvent.objects.bulk_create(events, batch_size=batch_size)
+
+    totals = (
+        ReputationEvent.objects.filter(profile_id=OuterRef('pk')).order_by()
+        .values('profile_id').annotate(total=Sum('delta')).values('total')
+    )
+    Profile.objects.update(reputation=Coalesce(Subquery(totals, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_hot_score'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReputationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('question', 'Вопрос'), ('answer', 'Ответ'), ('question_vote', 'Оценка вопроса'), ('answer_vote', 'Оценка ответа')], max_length=16)),
+                ('object_id', models.BigIntegerField()),
+                ('delta', models.IntegerField()),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='reputation',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['-reputation', '-id'], name='profile_reputation_idx'),
+        ),
+        migrations.AddField(
+            model_name='reputationevent',
+            name='profile',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reputation_events', to='app.profile'),
+        ),
+        migrations.AddIndex(
+            model_name='reputationevent',
+            index=models.Index(fields=['kind', 'object_id'], name='reputation_object_idx'),
+        ),
+        migrations.RunPython(fill_ledger, migrations.RunPython.noop),
+    ]
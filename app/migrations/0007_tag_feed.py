@@ -0,0 +1,43 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_tag_feeds(apps, schema_editor, batch_size=1000):
+    Question = apps.get_model('app', 'Question')
+    TagFeedEntry = apps.get_model('app', 'TagFeedEntry')
+    rows = Question.tags.through.objects.order_by('pk').values_list(
+        'tag_id', 'question_id', 'question__created_date',
+    )
+    TagFeedEntry.objects.bulk_create(
+        (
+            TagFeedEntry(tag_id=tag_id, question_id=question_id, created_date=created_date)
+            for tag_id, question_id, created_date in rows.iterator(batch_size)
+        ),
+        batch_size=batch_size,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_reputation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagFeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_date', models.DateTimeField()),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_feed_entries', to='app.question')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='app.tag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tag', '-created_date', '-question'], name='tag_feed_idx')],
+                'unique_together': {('tag', 'question')},
+            },
+        ),
+        migrations.RunPython(fill_tag_feeds, migrations.RunPython.noop),
+    ]
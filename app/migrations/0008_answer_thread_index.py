@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_tag_feed'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='answer',
+            name='answer_for_question_idx',
+        ),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['question', '-is_correct', '-rating', '-created_date', '-id'], name='answer_thread_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_answer_thread_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='views',
+            field=models.IntegerField(default=0),
+        ),
+    ]
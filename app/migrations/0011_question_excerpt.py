@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:38
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+# Правило на момент миграции (content.py)
+EXCERPT_WORDS = 30
+EXCERPT_MAX_LENGTH = 300
+
+
+def make_excerpt(text):
+    excerpt = Truncator(' '.join(text.split())).words(EXCERPT_WORDS)
+    if len(excerpt) > EXCERPT_MAX_LENGTH:
+        excerpt = Truncator(excerpt).chars(EXCERPT_MAX_LENGTH)
+    return excerpt
+
+
+def fill_excerpts(apps, schema_editor, batch_size=1000):
+    Question = apps.get_model('app', 'Question')
+    last_id = 0
+    while True:
+        questions = list(
+            Question.objects.filter(pk__gt=last_id).order_by('pk').only('pk', 'text')[:batch_size]
+        )
+        if not questions:
+            return
+        for question in questions:
+            question.excerpt = make_excerpt(question.text)
+        Question.objects.bulk_update(questions, ['excerpt'])
+        last_id = questions[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_profile_avatar_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='excerpt',
+            field=models.CharField(blank=True, default='', max_length=300),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
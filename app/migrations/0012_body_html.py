@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_question_excerpt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='body_html',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='body_html',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -1,10 +1,19 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models import Count, Sum
+from django.db.models import F, Q
+from django.utils import timezone
 
 class QuestionQuerySet(models.QuerySet):
     def with_answers_count(self):
-        return self.annotate(answers_count=Count('answers'))
+        """answers_count хранится в колонке вопроса, пересчет не нужен"""
+        return self
+
+    def cards(self):
+        """Строки-кортежи для карточек списка (см. cards.py): без текста и ORM-объектов"""
+        return self.values_list(
+            'id', 'title', 'excerpt', 'rating', 'answers_count', 'views', 'created_date',
+            'author_id', 'author__user__username', 'author__avatar', 'author__avatar_hash',
+        )
 
 class QuestionManager(models.Manager):
     def get_queryset(self):
@@ -15,6 +24,9 @@ class QuestionManager(models.Manager):
     
     def best_questions(self):
         return self.get_queryset().order_by('-rating')
+
+    def hot_questions(self):
+        return self.get_queryset().order_by('-hot_score', '-id')
     
     def by_tag(self, tag_name):
         return self.get_queryset().filter(tags__name=tag_name)
@@ -22,29 +34,61 @@ class QuestionManager(models.Manager):
     def with_answers_count(self):
         return self.get_queryset().with_answers_count()
 
+    def cards(self):
+        return self.get_queryset().cards()
+
 class ProfileManager(models.Manager):
     def best_profiles(self):
         return self.annotate(
-            total_rating=Count('questions') + Count('answers')
-        ).order_by('-total_rating')[:5]
+            total_rating=F('reputation')
+        ).order_by('-reputation', '-id').select_related('user')[:5]
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
+    # Хэш содержимого аватара, для которого построены миниатюры (см. avatars.py)
+    avatar_hash = models.CharField(max_length=32, blank=True, default='')
+    # Сумма событий ReputationEvent профиля (см. reputation.py)
+    reputation = models.IntegerField(default=0)
     
     objects = ProfileManager()
+
+    class Meta:
+        indexes = [
+            # best_profiles
+            models.Index(fields=['-reputation', '-id'], name='profile_reputation_idx'),
+        ]
     
     def __str__(self):
         return self.user.username
 
+    @property
+    def avatar_small(self):
+        """Миниатюра 32px для карточек и сайдбара"""
+        from .avatars import thumbnail_url
+        return thumbnail_url(self, 32)
+
+    @property
+    def avatar_large(self):
+        """Миниатюра 64px для страницы профиля"""
+        from .avatars import thumbnail_url
+        return thumbnail_url(self, 64)
+
 class TagManager(models.Manager):
     def popular_tags(self):
-        return self.annotate(question_count=Count('question')).order_by('-question_count')[:10]
+        return self.order_by('-question_count')[:10]
 
 class Tag(models.Model):
     name = models.CharField(max_length=50, unique=True)
+    question_count = models.IntegerField(default=0)
     
     objects = TagManager()
+
+    class Meta:
+        indexes = [
+            # popular_tags: покрывающий индекс, таблица тегов не читается
+            models.Index(fields=['-question_count'], include=['id', 'name'], name='tag_popular_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -52,15 +96,46 @@ class Tag(models.Model):
 class Question(models.Model):
     title = models.CharField(max_length=255)
     text = models.TextField()
+    # Начало текста для карточек и HTML тела, считаются при сохранении (content.py)
+    excerpt = models.CharField(max_length=300, blank=True, default='')
+    body_html = models.TextField(blank=True, default='')
     author = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='questions')
     tags = models.ManyToManyField(Tag)
     created_date = models.DateTimeField(auto_now_add=True)
     rating = models.IntegerField(default=0)
+    answers_count = models.IntegerField(default=0)
+    # Оценка для ленты "Hot" (см. ranking.py); hot_dirty - ждет пересчета
+    hot_score = models.FloatField(default=0)
+    hot_dirty = models.BooleanField(default=True)
+    # Пишется пачками из буфера просмотров (см. view_counts.py)
+    views = models.IntegerField(default=0)
     
     objects = QuestionManager()
+
+    class Meta:
+        indexes = [
+            # new_questions и курсорная пагинация по (created_date, id)
+            models.Index(fields=['-created_date', '-id'], name='question_new_idx'),
+            # best_questions и курсорная пагинация по (rating, id)
+            models.Index(fields=['-rating', '-id'], name='question_best_idx'),
+            # hot_questions и курсорная пагинация по (hot_score, id)
+            models.Index(fields=['-hot_score', '-id'], name='question_hot_idx'),
+            # update_hot_scores: частичный индекс только по ждущим пересчета
+            models.Index(fields=['id'], condition=Q(hot_dirty=True), name='question_hot_dirty_idx'),
+        ]
     
     def __str__(self):
         return self.title
+
+    def save(self, *args, **kwargs):
+        from .content import prepare_question
+        from .ranking import hot_score
+        prepare_question(self)
+        if self._state.adding:
+            # Новый вопрос сразу попадает в Hot на место по времени создания;
+            # hot_dirty остается, и update_hot_scores уточнит оценку
+            self.hot_score = hot_score(self.rating, self.answers_count, self.created_date or timezone.now())
+        super().save(*args, **kwargs)
     
     def get_absolute_url(self):
         from django.urls import reverse
@@ -68,10 +143,15 @@ class Question(models.Model):
 
 class AnswerManager(models.Manager):
     def for_question(self, question_id):
-        return self.filter(question_id=question_id).order_by('-rating', '-created_date')
+        """Принятый ответ первым, затем по рейтингу; порядок совпадает с answer_thread_idx"""
+        return self.filter(question_id=question_id).order_by(
+            '-is_correct', '-rating', '-created_date', '-id'
+        )
 
 class Answer(models.Model):
     text = models.TextField()
+    # HTML тела, считается при сохранении (content.py)
+    body_html = models.TextField(blank=True, default='')
     author = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='answers')
     question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='answers')
     is_correct = models.BooleanField(default=False)
@@ -79,38 +159,144 @@ class Answer(models.Model):
     rating = models.IntegerField(default=0)
     
     objects = AnswerManager()
+
+    class Meta:
+        indexes = [
+            # AnswerManager.for_question
+            models.Index(fields=['question', '-is_correct', '-rating', '-created_date', '-id'],
+                         name='answer_thread_idx'),
+        ]
     
     def __str__(self):
         return f"Answer to {self.question.title}"
 
-class QuestionLike(models.Model):
+    def save(self, *args, **kwargs):
+        from .content import prepare_answer
+        prepare_answer(self)
+        # Счетчик ответов обновляется в post_save в той же транзакции
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+class ReputationEvent(models.Model):
+    """
+    Журнал начислений репутации. Записи только добавляются; object_id хранит
+    id вопроса или ответа без внешнего ключа, чтобы история пережила удаление.
+    """
+    QUESTION = 'question'
+    ANSWER = 'answer'
+    QUESTION_VOTE = 'question_vote'
+    ANSWER_VOTE = 'answer_vote'
+    KIND_CHOICES = [
+        (QUESTION, 'Вопрос'),
+        (ANSWER, 'Ответ'),
+        (QUESTION_VOTE, 'Оценка вопроса'),
+        (ANSWER_VOTE, 'Оценка ответа'),
+    ]
+
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='reputation_events')
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    delta = models.IntegerField()
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Отмена начислений при удалении вопроса или ответа
+            models.Index(fields=['kind', 'object_id'], name='reputation_object_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.profile_id}: {self.kind} {self.delta:+d}'
+
+class SearchTerm(models.Model):
+    """Словарь терминов поиска: в скольких вопросах встречается слово"""
+    term = models.CharField(max_length=64, unique=True)
+    question_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.term
+
+class SearchEntry(models.Model):
+    """Обратный индекс: термин -> вопрос с весом (заголовок весит больше текста)"""
+    term = models.CharField(max_length=64)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='search_entries')
+    weight = models.IntegerField()
+
+    class Meta:
+        unique_together = ['term', 'question']
+
+class TagFeedEntry(models.Model):
+    """Копия связи вопрос-тег с датой вопроса: лента тега читается по одному индексу"""
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='feed_entries')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='tag_feed_entries')
+    created_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['tag', 'question']
+        indexes = [
+            # Курсорная пагинация ленты тега по (created_date, question_id)
+            models.Index(fields=['tag', '-created_date', '-question'], name='tag_feed_idx'),
+        ]
+
+class LikeBase(models.Model):
+    """Оценка объекта: при сохранении рейтинг цели меняется на разницу значений"""
+    target_field = None
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_value = instance.__dict__.get('value', 0)
+        return instance
+
+    def _change_target_rating(self, delta, using=None):
+        if delta:
+            target_model = self._meta.get_field(self.target_field).related_model
+            target_id = getattr(self, f'{self.target_field}_id')
+            changes = {'rating': F('rating') + delta}
+            if target_model is Question:
+                changes['hot_dirty'] = True
+            target_model.objects.using(using).filter(pk=target_id).update(**changes)
+            from . import live, reputation
+            reputation.votes_received(target_model, {target_id: delta}, using)
+            if live.watching():
+                question_id = target_id if target_model is Question else (
+                    target_model.objects.using(using).filter(pk=target_id)
+                    .values_list('question_id', flat=True).first()
+                )
+                live.ratings_changed(self.target_field, {target_id: delta}, {target_id: question_id})
+
+    def save(self, *args, **kwargs):
+        old_value = 0 if self._state.adding else getattr(self, '_saved_value', 0)
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            self._change_target_rating(self.value - old_value, self._state.db)
+        self._saved_value = self.value
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            result = super().delete(*args, **kwargs)
+            self._change_target_rating(-getattr(self, '_saved_value', self.value), self._state.db)
+        return result
+
+class QuestionLike(LikeBase):
     user = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='question_likes')
     question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='question_likes')
     value = models.SmallIntegerField()
+
+    target_field = 'question'
     
     class Meta:
         unique_together = ['user', 'question']
-    
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        total_rating = QuestionLike.objects.filter(question=self.question).aggregate(
-            total=Sum('value')
-        )['total'] or 0
-        self.question.rating = total_rating
-        self.question.save()
 
-class AnswerLike(models.Model):
+class AnswerLike(LikeBase):
     user = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='answer_likes')
     answer = models.ForeignKey(Answer, on_delete=models.CASCADE, related_name='answer_likes')
     value = models.SmallIntegerField()
+
+    target_field = 'answer'
     
     class Meta:
         unique_together = ['user', 'answer']
-    
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        total_rating = AnswerLike.objects.filter(answer=self.answer).aggregate(
-            total=Sum('value')
-        )['total'] or 0
-        self.answer.rating = total_rating
-        self.answer.save()
@@ -0,0 +1,175 @@
+"""Курсорная (keyset) пагинация для лент вопросов"""
+import base64
+import binascii
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+FORWARD = 'n'
+BACKWARD = 'p'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _parse_ordering(ordering):
+    return [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+
+
+class PrecountedPaginator(Paginator):
+    """Постраничная пагинация с числом объектов из счетчика вместо COUNT(*)"""
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._precount = max(count, 0)
+
+    @cached_property
+    def count(self):
+        return self._precount
+
+
+class KeysetPage:
+    """Страница курсорной пагинации; в шаблоне отличается по is_keyset"""
+    is_keyset = True
+
+    def __init__(self, object_list, next_cursor, previous_cursor, approximate_count=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.approximate_count = approximate_count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Пагинация по уникальному ключу сортировки, например ('-created_date', '-id').
+    Страница выбирается условием WHERE по индексу, поэтому глубокие страницы
+    стоят столько же, сколько первая, и COUNT(*) не выполняется.
+    """
+
+    def __init__(self, queryset, ordering, per_page, approximate_count=False):
+        self.keys = _parse_ordering(ordering)
+        self.queryset = queryset.order_by(*ordering)
+        self.per_page = per_page
+        self.approximate_count = approximate_count
+        self._fields = [queryset.model._meta.get_field(name) for name, _ in self.keys]
+
+    def encode_cursor(self, direction, obj):
+        values = [field.value_to_string(obj) for field in self._fields]
+        raw = json.dumps([direction, values], separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, values = json.loads(raw)
+            if direction not in (FORWARD, BACKWARD) or len(values) != len(self._fields):
+                raise InvalidCursor(cursor)
+            return direction, [
+                field.to_python(value) for field, value in zip(self._fields, values)
+            ]
+        except (binascii.Error, ValueError, TypeError) as exc:
+            raise InvalidCursor(cursor) from exc
+
+    def _seek_filter(self, values, forward):
+        """(a, b) после (x, y) в порядке сортировки: a < x OR (a = x AND b < y)"""
+        condition = Q()
+        for i, (name, descending) in enumerate(self.keys):
+            lookup = 'lt' if descending == forward else 'gt'
+            branch = Q(**{f'{name}__{lookup}': values[i]})
+            for (prev_name, _), prev_value in zip(self.keys[:i], values):
+                branch &= Q(**{prev_name: prev_value})
+            condition |= branch
+        # Дублирующее условие на первый ключ дает планировщику диапазон по индексу
+        first_name, first_descending = self.keys[0]
+        first_lookup = 'lte' if first_descending == forward else 'gte'
+        return Q(**{f'{first_name}__{first_lookup}': values[0]}) & condition
+
+    def _reversed_ordering(self):
+        return [name if descending else f'-{name}' for name, descending in self.keys]
+
+    def _approximate_count(self):
+        model = self.queryset.model
+        connection = connections[self.queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        return row[0] if row and row[0] >= 0 else None
+
+    def _prepare(self, cursor):
+        direction, values = FORWARD, None
+        if cursor:
+            try:
+                direction, values = self.decode_cursor(cursor)
+            except InvalidCursor:
+                direction, values = FORWARD, None
+
+        queryset = self.queryset
+        forward = direction == FORWARD
+        if values is not None:
+            queryset = queryset.filter(self._seek_filter(values, forward))
+        if not forward:
+            queryset = queryset.order_by(*self._reversed_ordering())
+        return queryset[:self.per_page + 1], values, forward
+
+    def _make_page(self, rows, values, forward, approximate_count):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        if forward:
+            has_next, has_previous = has_more, values is not None
+        else:
+            has_next, has_previous = True, has_more
+
+        next_cursor = self.encode_cursor(FORWARD, rows[-1]) if rows and has_next else None
+        previous_cursor = self.encode_cursor(BACKWARD, rows[0]) if rows and has_previous else None
+        return KeysetPage(rows, next_cursor, previous_cursor, approximate_count)
+
+    def page(self, cursor=None):
+        queryset, values, forward = self._prepare(cursor)
+        rows = list(queryset)
+        if not rows and values is not None:
+            # Курсор указывает за край ленты - показываем первую страницу
+            return self.page()
+        approximate_count = self._approximate_count() if self.approximate_count else None
+        return self._make_page(rows, values, forward, approximate_count)
+
+    async def apage(self, cursor=None):
+        """То же, что page(), через асинхронный ORM"""
+        queryset, values, forward = self._prepare(cursor)
+        rows = [obj async for obj in queryset]
+        if not rows and values is not None:
+            return await self.apage()
+        approximate_count = (
+            await sync_to_async(self._approximate_count)() if self.approximate_count else None
+        )
+        return self._make_page(rows, values, forward, approximate_count)
@@ -0,0 +1,61 @@
+"""
+Профили пользователей: создаются один раз вместе с пользователем, при
+массовой загрузке - пачкой сразу после пачки пользователей. Последующие
+сохранения пользователя (вход, смена last_login) профиль не трогают.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from . import counters
+from .models import Profile
+
+
+def user_created(user):
+    """Профиль для пользователя, только что созданного через save()"""
+    return Profile.objects.create(user=user)
+
+
+def _assign_pks(objects, model, field):
+    """pk после bulk_create на бэкенде без RETURNING - по уникальному полю"""
+    if all(obj.pk is not None for obj in objects):
+        return
+    values = [getattr(obj, field) for obj in objects]
+    pks = dict(model.objects.filter(**{f'{field}__in': values}).values_list(field, 'pk'))
+    for obj, value in zip(objects, values):
+        obj.pk = pks[value]
+
+
+def create_users(users, batch_size=1000):
+    """Сохраняет пачку новых пользователей и их профили; возвращает профили"""
+    with transaction.atomic():
+        User.objects.bulk_create(users, batch_size=batch_size)
+        _assign_pks(users, User, 'username')
+        profiles = Profile.objects.bulk_create(
+            [Profile(user_id=user.pk) for user in users], batch_size=batch_size,
+        )
+        _assign_pks(profiles, Profile, 'user_id')
+    return profiles
+
+
+def ensure_profiles(user_ids, batch_size=1000):
+    """{id пользователя: id профиля}; недостающие профили создаются одной пачкой"""
+    profile_ids = dict(Profile.objects.filter(user_id__in=user_ids).values_list('user_id', 'pk'))
+    missing = [user_id for user_id in user_ids if user_id not in profile_ids]
+    if missing:
+        Profile.objects.bulk_create(
+            [Profile(user_id=user_id) for user_id in missing], batch_size=batch_size, ignore_conflicts=True,
+        )
+        profile_ids.update(Profile.objects.filter(user_id__in=missing).values_list('user_id', 'pk'))
+    return profile_ids
+
+
+def provision_missing(batch_size=1000):
+    """Профили для пользователей, созданных в обход сигналов; возвращает число созданных"""
+    created = 0
+    for ids in counters.id_batches(User, batch_size):
+        without_profile = list(
+            User.objects.filter(pk__in=ids, profile__isnull=True).values_list('pk', flat=True)
+        )
+        if without_profile:
+            created += len(ensure_profiles(without_profile, batch_size))
+    return created
@@ -0,0 +1,51 @@
+"""Бюджет SQL-запросов для представлений и проверка его в тестах"""
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+
+def query_budget(max_queries):
+    """Объявляет максимальное число запросов, которое может сделать представление"""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def _format_queries(queries):
+    return '\n'.join(
+        f'{i}. {query["sql"]}' for i, query in enumerate(queries, start=1)
+    )
+
+
+@contextmanager
+def assert_max_queries(max_queries, using=DEFAULT_DB_ALIAS):
+    """Падает, если блок выполнил больше max_queries запросов"""
+    with CaptureQueriesContext(connections[using]) as context:
+        yield context
+    executed = len(context.captured_queries)
+    if executed > max_queries:
+        raise QueryBudgetExceeded(
+            f'Выполнено {executed} запросов при бюджете {max_queries}:\n'
+            f'{_format_queries(context.captured_queries)}'
+        )
+
+
+class QueryBudgetMixin:
+    """Примесь к TestCase: запрос к URL не должен превышать бюджет его представления"""
+
+    def assertWithinQueryBudget(self, url, **extra):
+        view = resolve(urlsplit(url).path).func
+        budget = getattr(view, 'query_budget', None)
+        if budget is None:
+            self.fail(f'Для представления {view.__name__} не объявлен query_budget')
+        with assert_max_queries(budget):
+            response = self.client.get(url, **extra)
+        return response
@@ -0,0 +1,60 @@
+"""
+Рейтинг "горячих" вопросов: оценки и ответы с поправкой на возраст.
+
+Оценка устроена как у Reddit: log10 активности плюс время создания,
+деленное на HOT_DECAY. Более новый вопрос получает прибавку, которую
+старому нужно отыграть в 10 раз большей активностью каждые HOT_DECAY
+секунд. Оценка не зависит от текущего времени, поэтому пересчитывать
+нужно только вопросы, у которых изменились рейтинг или число ответов
+(они помечены hot_dirty).
+"""
+import math
+from datetime import datetime, timezone
+
+from django.db import transaction
+from django.db.models import Case, FloatField, Value, When
+
+from .models import Question
+
+HOT_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+HOT_DECAY = 45000
+ANSWER_WEIGHT = 2
+
+
+def hot_score(rating, answers_count, created_date):
+    activity = rating + ANSWER_WEIGHT * answers_count
+    order = math.log10(max(abs(activity), 1))
+    sign = (activity > 0) - (activity < 0)
+    seconds = (created_date - HOT_EPOCH).total_seconds()
+    return round(sign * order + seconds / HOT_DECAY, 7)
+
+
+def update_hot_scores(batch_size=1000):
+    """Пересчитывает оценки помеченных вопросов; возвращает число обновленных"""
+    updated = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Question.objects.select_for_update().filter(hot_dirty=True).order_by()
+                .values_list('pk', 'rating', 'answers_count', 'created_date')[:batch_size]
+            )
+            if not rows:
+                return updated
+            scores = {
+                pk: hot_score(rating, answers_count, created_date)
+                for pk, rating, answers_count, created_date in rows
+            }
+            # Строки заблокированы, поэтому флаг не потеряет параллельный голос
+            Question.objects.filter(pk__in=list(scores)).update(
+                hot_dirty=False,
+                hot_score=Case(
+                    *[When(pk=pk, then=Value(score)) for pk, score in scores.items()],
+                    output_field=FloatField(),
+                ),
+            )
+        updated += len(rows)
+
+
+def mark_all_dirty():
+    """Пометить все вопросы для пересчета (например, после смены формулы)"""
+    return Question.objects.filter(hot_dirty=False).update(hot_dirty=True)
@@ -0,0 +1,229 @@
+"""
+Чтение с реплик: роутер отправляет SELECT на случайную исправную реплику
+из DATABASE_REPLICAS, запись - в default.
+
+Чтение идет в default, если:
+- запрос не GET/HEAD/OPTIONS (обработчик формы читает то, что записал);
+- открыта транзакция в default (select_for_update, чтение после записи);
+- пользователь недавно писал: StickyPrimaryMiddleware ставит cookie на
+  REPLICA_STICKY_SECONDS, чтобы он сразу видел свой голос или вопрос;
+- ни одна реплика не прошла проверку.
+
+Реплика проверяется не чаще раза в REPLICA_CHECK_INTERVAL секунд на
+процесс: доступность, наличие схемы (непустая django_migrations - пустая
+или чужая база не проходит) и отставание (на PostgreSQL - время с последней
+примененной транзакции, если реплика не догнала основной сервер).
+Отстающая больше REPLICA_MAX_LAG секунд или недоступная реплика не
+используется до следующей проверки.
+
+Ошибка запроса к реплике между проверками помечает ее неисправной, а
+StickyPrimaryMiddleware повторяет такой (безопасный) запрос целиком на default.
+"""
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.backends.signals import connection_created
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+STICKY_COOKIE = 'primary_until'
+
+# Реплика с примененными миграциями, а не пустая база по тому же адресу
+SCHEMA_SQL = 'SELECT COUNT(*) FROM django_migrations'
+
+# Запрос отставания: 0, если сервер не реплика или применил все полученное
+POSTGRES_LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+'''
+
+
+class _Routing:
+    __slots__ = ('primary', 'wrote', 'replica_failed')
+
+    def __init__(self, primary):
+        self.primary = primary
+        self.wrote = False
+        self.replica_failed = False
+
+
+_routing = ContextVar('replica_routing', default=None)
+
+
+class _Health:
+    __slots__ = ('healthy', 'lag', 'checked')
+
+    def __init__(self, healthy, lag, checked):
+        self.healthy = healthy
+        self.lag = lag
+        self.checked = checked
+
+
+_health = {}
+_check_locks = {}
+_health_lock = threading.Lock()
+
+
+def check(alias):
+    """Проверяет реплику и запоминает результат"""
+    connection = connections[alias]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(SCHEMA_SQL)
+            migrated = cursor.fetchone()[0] > 0
+            lag = 0.0
+            if connection.vendor == 'postgresql':
+                cursor.execute(POSTGRES_LAG_SQL)
+                lag = float(cursor.fetchone()[0])
+        healthy = migrated and lag <= getattr(settings, 'REPLICA_MAX_LAG', 10)
+    except DatabaseError:
+        connection.close()
+        healthy, lag = False, None
+    _health[alias] = _Health(healthy, lag, time.monotonic())
+    return _health[alias]
+
+
+def _mark_failed(execute, sql, params, many, context):
+    """Обертка запросов реплики: ошибка выключает реплику до следующей проверки"""
+    try:
+        return execute(sql, params, many, context)
+    except DatabaseError:
+        alias = context['connection'].alias
+        _health[alias] = _Health(False, None, time.monotonic())
+        routing = _routing.get()
+        if routing is not None:
+            routing.replica_failed = True
+        raise
+
+
+def _watch_replica(connection, **kwargs):
+    if connection.alias in getattr(settings, 'DATABASE_REPLICAS', []) and _mark_failed not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_mark_failed)
+
+
+connection_created.connect(_watch_replica, dispatch_uid='replica_failures')
+
+
+def _current_health(alias):
+    state = _health.get(alias)
+    if state is not None and time.monotonic() - state.checked < getattr(settings, 'REPLICA_CHECK_INTERVAL', 5):
+        return state
+    with _health_lock:
+        lock = _check_locks.setdefault(alias, threading.Lock())
+    # Проверяет один поток, остальные пользуются прошлым результатом
+    if not lock.acquire(blocking=False):
+        return state
+    try:
+        return check(alias)
+    finally:
+        lock.release()
+
+
+def healthy_replicas():
+    replicas = []
+    for alias in getattr(settings, 'DATABASE_REPLICAS', []):
+        state = _current_health(alias)
+        if state is not None and state.healthy:
+            replicas.append(alias)
+    return replicas
+
+
+def status():
+    """Последние результаты проверок {реплика: {healthy, lag, age}} для /perf/"""
+    now = time.monotonic()
+    return {
+        alias: {'healthy': state.healthy, 'lag': state.lag, 'age': round(now - state.checked, 1)}
+        for alias, state in list(_health.items())
+    }
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None and routing.primary:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = healthy_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики - копии default, объекты из разных баз ссылаются на одни строки
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return True
+
+
+class StickyPrimaryMiddleware:
+    """
+    Закрепляет чтение за default для изменяющих запросов и на
+    REPLICA_STICKY_SECONDS после записи (cookie primary_until).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'DATABASE_REPLICAS', []):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing = self._routing(request)
+        token = _routing.set(routing)
+        try:
+            response = self.get_response(request)
+            if self._retry(routing):
+                response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self._finish(routing, response)
+
+    async def __acall__(self, request):
+        routing = self._routing(request)
+        token = _routing.set(routing)
+        try:
+            response = await self.get_response(request)
+            if self._retry(routing):
+                response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self._finish(routing, response)
+
+    def _routing(self, request):
+        try:
+            sticky = float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            sticky = False
+        return _Routing(primary=sticky or request.method not in SAFE_METHODS)
+
+    def _retry(self, routing):
+        """Запрос упал на реплике: повторить его на default (повторяются только чтения)"""
+        if routing.replica_failed and not routing.primary and not routing.wrote:
+            routing.primary = True
+            return True
+        return False
+
+    def _finish(self, routing, response):
+        if routing.wrote:
+            seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 15)
+            response.set_cookie(STICKY_COOKIE, f'{time.time() + seconds:.0f}', max_age=seconds,
+                                httponly=True, samesite='Lax')
+        return response
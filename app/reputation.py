@@ -0,0 +1,166 @@
+"""
+Репутация профилей: журнал ReputationEvent и сумма по нему в Profile.reputation.
+Колонка обновляется вместе с записью события, rebuild() сверяет ее с журналом.
+"""
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Case, Count, F, IntegerField, QuerySet, Sum, Value, When
+
+from . import counters, sidebar
+from .models import Answer, AnswerLike, Profile, Question, QuestionLike, ReputationEvent
+
+QUESTION_POINTS = 1
+ANSWER_POINTS = 1
+VOTE_POINTS = 1
+
+# Модель -> (событие за создание, событие за оценки, баллы за создание)
+KINDS = {
+    Question: (ReputationEvent.QUESTION, ReputationEvent.QUESTION_VOTE, QUESTION_POINTS),
+    Answer: (ReputationEvent.ANSWER, ReputationEvent.ANSWER_VOTE, ANSWER_POINTS),
+}
+
+
+def record(events, using=None):
+    """Записывает события (profile_id, kind, object_id, delta) и меняет репутацию"""
+    events = [event for event in events if event[3]]
+    if not events:
+        return
+    totals = defaultdict(int)
+    for profile_id, _, _, delta in events:
+        totals[profile_id] += delta
+    with transaction.atomic(using=using):
+        # Сначала UPDATE: блокировка строки профиля упорядочивает запись с compact()
+        Profile.objects.using(using).filter(pk__in=list(totals)).update(
+            reputation=F('reputation') + Case(
+                *[When(pk=pk, then=Value(total)) for pk, total in totals.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        )
+        ReputationEvent.objects.using(using).bulk_create([
+            ReputationEvent(profile_id=profile_id, kind=kind, object_id=object_id, delta=delta)
+            for profile_id, kind, object_id, delta in events
+        ])
+
+
+def post_created(instance):
+    """Начисление автору нового вопроса или ответа"""
+    kind, _, points = KINDS[type(instance)]
+    record([(instance.author_id, kind, instance.pk, points)], instance._state.db)
+
+
+def post_deleted(instance):
+    """Отмена всего, что автор получил за удаленный вопрос или ответ"""
+    kind, vote_kind, _ = KINDS[type(instance)]
+    earned = ReputationEvent.objects.filter(
+        kind__in=[kind, vote_kind], object_id=instance.pk, profile_id=instance.author_id,
+    ).aggregate(total=Sum('delta'))['total']
+    record([(instance.author_id, kind, instance.pk, -(earned or 0))], instance._state.db)
+
+
+def deleting_profile(origin):
+    """Удаление началось с пользователя или профиля - его журнал удалится каскадом"""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model in (Profile, User)
+
+
+def votes_received(target_model, deltas, using=None):
+    """Изменения рейтинга {id цели: delta} начисляются авторам вопросов или ответов"""
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    _, vote_kind, _ = KINDS[target_model]
+    authors = target_model.objects.using(using).filter(pk__in=list(deltas)).values_list('pk', 'author_id')
+    record([
+        (author_id, vote_kind, pk, deltas[pk] * VOTE_POINTS) for pk, author_id in authors
+    ], using)
+    # Репутация меняется через QuerySet.update() без сигналов Profile,
+    # поэтому блок лучших пользователей сбрасывается здесь
+    sidebar.invalidate(using)
+
+
+def compact(batch_size=1000):
+    """
+    Сворачивает журнал: события профиля по одному объекту и типу (например,
+    многократная смена голоса) заменяются одной записью с суммой, нулевые
+    суммы удаляются. Сумма по профилю не меняется. Возвращает число удаленных записей.
+    """
+    removed = 0
+    for ids in counters.id_batches(Profile, batch_size):
+        with transaction.atomic():
+            list(Profile.objects.select_for_update().filter(pk__in=ids).values_list('pk'))
+            events = ReputationEvent.objects.filter(profile_id__in=ids)
+            groups = list(
+                events.order_by().values('profile_id', 'kind', 'object_id')
+                .annotate(total=Sum('delta'), rows=Count('pk'))
+            )
+            if all(group['rows'] == 1 and group['total'] for group in groups):
+                continue
+            before = sum(group['rows'] for group in groups)
+            events.delete()
+            compacted = ReputationEvent.objects.bulk_create([
+                ReputationEvent(
+                    profile_id=group['profile_id'], kind=group['kind'],
+                    object_id=group['object_id'], delta=group['total'],
+                )
+                for group in groups if group['total']
+            ], batch_size=batch_size)
+            removed += before - len(compacted)
+    return removed
+
+
+def rebuild(batch_size=1000, fix=True):
+    """Сверяет Profile.reputation с суммой журнала; возвращает число расхождений"""
+    def count(ids):
+        return (
+            ReputationEvent.objects.using(DEFAULT_DB_ALIAS).filter(profile_id__in=ids).order_by()
+            .values('profile_id').annotate(total=Sum('delta'))
+            .values_list('profile_id', 'total')
+        )
+
+    return sum(
+        counters.repair_column(Profile, 'reputation', ids, count, batch_size, fix=fix)
+        for ids in counters.id_batches(Profile, batch_size)
+    )
+
+
+def _source_events(batch_size):
+    for model, like_model, field in ((Question, QuestionLike, 'question'), (Answer, AnswerLike, 'answer')):
+        kind, vote_kind, points = KINDS[model]
+        for ids in counters.id_batches(model, batch_size):
+            authors = dict(model.objects.filter(pk__in=ids).values_list('pk', 'author_id'))
+            for pk, author_id in authors.items():
+                yield author_id, kind, pk, points
+            votes = (
+                like_model.objects.filter(**{f'{field}_id__in': ids}).order_by()
+                .values(f'{field}_id').annotate(total=Sum('value'))
+                .values_list(f'{field}_id', 'total')
+            )
+            for pk, total in votes:
+                yield authors[pk], vote_kind, pk, total * VOTE_POINTS
+
+
+def rebuild_ledger(batch_size=1000):
+    """
+    Заново строит журнал по вопросам, ответам и оценкам (по одному событию
+    на объект) и пересчитывает репутацию. Нужно после массовой загрузки
+    данных в обход сигналов. Возвращает число записанных событий.
+    """
+    written = 0
+    with transaction.atomic():
+        ReputationEvent.objects.all().delete()
+        batch = []
+        for profile_id, kind, object_id, delta in _source_events(batch_size):
+            if not delta:
+                continue
+            batch.append(ReputationEvent(profile_id=profile_id, kind=kind, object_id=object_id, delta=delta))
+            if len(batch) >= batch_size:
+                ReputationEvent.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        ReputationEvent.objects.bulk_create(batch)
+        written += len(batch)
+        rebuild(batch_size)
+    return written
@@ -0,0 +1,129 @@
+"""Полнотекстовый поиск по вопросам на обратном индексе (работает на любой СУБД)"""
+import re
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .counters import id_batches
+from .models import Question, SearchEntry, SearchTerm
+
+TITLE_WEIGHT = 3
+TEXT_WEIGHT = 1
+MAX_WEIGHT = 100
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+
+SUGGEST_LIMIT = 8
+SUGGEST_CACHE_TIMEOUT = 60
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Слова текста в нижнем регистре, ё приводится к е"""
+    for token in TOKEN_RE.findall(text.lower().replace('ё', 'е')):
+        if MIN_TERM_LENGTH <= len(token) <= MAX_TERM_LENGTH:
+            yield token
+
+
+def question_weights(title, text):
+    weights = Counter()
+    for token in tokenize(title):
+        weights[token] += TITLE_WEIGHT
+    for token in tokenize(text):
+        weights[token] += TEXT_WEIGHT
+    return {term: min(weight, MAX_WEIGHT) for term, weight in weights.items()}
+
+
+def _change_term_counts(terms, delta):
+    if not terms:
+        return
+    if delta > 0:
+        SearchTerm.objects.bulk_create(
+            [SearchTerm(term=term) for term in terms], ignore_conflicts=True
+        )
+    SearchTerm.objects.filter(term__in=terms).update(question_count=F('question_count') + delta)
+
+
+def index_question(question):
+    """Перестраивает записи индекса одного вопроса"""
+    weights = question_weights(question.title, question.text)
+    with transaction.atomic():
+        old_terms = set(
+            SearchEntry.objects.filter(question=question).values_list('term', flat=True)
+        )
+        SearchEntry.objects.filter(question=question).delete()
+        SearchEntry.objects.bulk_create([
+            SearchEntry(term=term, question=question, weight=weight)
+            for term, weight in weights.items()
+        ])
+        _change_term_counts(list(weights.keys() - old_terms), 1)
+        _change_term_counts(list(old_terms - weights.keys()), -1)
+
+
+def unindex_question(question):
+    terms = list(SearchEntry.objects.filter(question=question).values_list('term', flat=True))
+    _change_term_counts(terms, -1)
+
+
+def rebuild(batch_size=500):
+    """Полная перестройка индекса пачками; возвращает число проиндексированных вопросов"""
+    SearchEntry.objects.all().delete()
+    indexed = 0
+    for ids in id_batches(Question, batch_size):
+        rows = Question.objects.filter(pk__in=ids).values_list('pk', 'title', 'text')
+        SearchEntry.objects.bulk_create([
+            SearchEntry(term=term, question_id=pk, weight=weight)
+            for pk, title, text in rows
+            for term, weight in question_weights(title, text).items()
+        ], batch_size=5000)
+        indexed += len(ids)
+
+    SearchTerm.objects.all().delete()
+    counts = (
+        SearchEntry.objects.order_by().values('term')
+        .annotate(total=Count('question_id')).values_list('term', 'total')
+        .iterator(chunk_size=5000)
+    )
+    batch = []
+    for term, total in counts:
+        batch.append(SearchTerm(term=term, question_count=total))
+        if len(batch) >= 5000:
+            SearchTerm.objects.bulk_create(batch)
+            batch = []
+    SearchTerm.objects.bulk_create(batch)
+    return indexed
+
+
+def search(query):
+    """
+    Вопросы, отсортированные по релевантности: сначала по числу совпавших слов,
+    затем по сумме весов. Возвращает queryset словарей {'question', 'score', 'matched'}.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    return (
+        SearchEntry.objects.filter(term__in=terms).order_by()
+        .values('question')
+        .annotate(matched=Count('term'), score=Sum('weight'))
+        .order_by('-matched', '-score', '-question')
+    )
+
+
+def suggest(prefix, limit=SUGGEST_LIMIT):
+    """Подсказки для строки поиска: частые термины, начинающиеся с prefix"""
+    tokens = list(tokenize(prefix))
+    if not tokens:
+        return []
+    start = tokens[-1]
+    key = f'search:suggest:{start}'
+    result = cache.get(key)
+    if result is None:
+        # Диапазон по уникальному индексу term вместо LIKE
+        result = list(
+            SearchTerm.objects.filter(term__gte=start, term__lt=start + '\uffff', question_count__gt=0)
+            .order_by('-question_count', 'term').values_list('term', flat=True)[:limit]
+        )
+        cache.set(key, result, SUGGEST_CACHE_TIMEOUT)
+    return result
@@ -0,0 +1,135 @@
+"""Сайдбар: популярные теги и лучшие пользователи из версионированного кэша"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+
+from .models import Profile, Tag
+
+VERSION_KEY = 'sidebar:version'
+
+BLOCKS = {
+    'popular_tags': lambda: list(Tag.objects.popular_tags()),
+    'best_users': lambda: list(Profile.objects.best_profiles()),
+}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def current_version():
+    """Текущая версия данных сайдбара (увеличивается при записи)"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Начальное значение от времени, чтобы после вытеснения ключа
+        # не совпасть со старыми записями
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    """Помечает все блоки сайдбара устаревшими"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+
+
+def invalidate(using=None):
+    """Сброс сайдбара после фиксации текущей транзакции"""
+    transaction.on_commit(bump_version, using=using)
+
+
+def _entry_key(name):
+    return f'sidebar:{name}'
+
+
+def refresh(name, version=None):
+    """Пересчитывает блок и кладет его в кэш"""
+    if version is None:
+        version = current_version()
+    value = BLOCKS[name]()
+    cache.set(_entry_key(name), {
+        'version': version,
+        'computed': time.time(),
+        'value': value,
+    }, None)
+    return value
+
+
+def _refresh_locked(name, version, lock_key):
+    try:
+        return refresh(name, version)
+    finally:
+        cache.delete(lock_key)
+
+
+def _refresh_in_background(name, version, lock_key):
+    def run():
+        try:
+            _refresh_locked(name, version, lock_key)
+        finally:
+            close_old_connections()
+
+    threading.Thread(target=run, name=f'sidebar-{name}', daemon=True).start()
+
+
+def _is_fresh(entry, version, now):
+    age = now - entry['computed']
+    if age >= _setting('SIDEBAR_CACHE_TTL', 300):
+        return False
+    # При частых записях не пересчитываем чаще, чем раз в SIDEBAR_MIN_REFRESH секунд
+    return entry['version'] == version or age < _setting('SIDEBAR_MIN_REFRESH', 5)
+
+
+def get_block(name):
+    """Возвращает блок сайдбара, пересчитывая его не более чем в одном процессе"""
+    version = current_version()
+    key = _entry_key(name)
+    entry = cache.get(key)
+    now = time.time()
+
+    if entry is not None and _is_fresh(entry, version, now):
+        return entry['value']
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, _setting('SIDEBAR_LOCK_TIMEOUT', 30)):
+        if entry is not None and _setting('SIDEBAR_BACKGROUND_REFRESH', True):
+            _refresh_in_background(name, version, lock_key)
+            return entry['value']
+        return _refresh_locked(name, version, lock_key)
+
+    # Блок уже пересчитывает кто-то другой - отдаем устаревшие данные
+    if entry is not None:
+        return entry['value']
+
+    # Данных еще нет совсем: немного ждем чужой пересчет, затем считаем сами
+    deadline = now + _setting('SIDEBAR_LOCK_WAIT', 1.0)
+    while time.time() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['value']
+    return BLOCKS[name]()
+
+
+def popular_tags():
+    return get_block('popular_tags')
+
+
+def best_users():
+    return get_block('best_users')
+
+
+def stamp():
+    """Метка текущего содержимого сайдбара для ключа кэша его фрагмента"""
+    for name in BLOCKS:
+        get_block(name)
+    entries = cache.get_many([_entry_key(name) for name in BLOCKS])
+    return '-'.join(
+        str(entries.get(_entry_key(name), {}).get('computed', 0)) for name in BLOCKS
+    )
@@ -1,18 +1,162 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Profile
+from .models import Profile, Question, Answer, Tag, QuestionLike, AnswerLike
+from . import avatars, counters, live, profiles, reputation, search, sidebar, tag_index, versions
 
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    """Создание профиля при создании пользователя"""
+def create_user_profile(sender, instance, created, raw=False, **kwargs):
+    """
+    Создание профиля при создании пользователя. Обновления пользователя
+    (вход, last_login) профиль не пересохраняют; пользователям, созданным
+    в обход сигналов, профили создает profiles.provision_missing().
+    """
+    if created and not raw:
+        profiles.user_created(instance)
+
+@receiver(pre_save, sender=Profile)
+def reset_avatar_thumbnails(sender, instance, **kwargs):
+    """Новый загруженный файл аватара еще не сохранен - старые миниатюры к нему не относятся"""
+    if instance.avatar and not instance.avatar._committed:
+        instance.avatar_hash = ''
+        instance._avatar_uploaded = True
+
+@receiver(post_save, sender=Profile)
+def build_avatar_thumbnails(sender, instance, **kwargs):
+    """Миниатюры нового аватара строятся в фоне после фиксации транзакции"""
+    if instance.__dict__.pop('_avatar_uploaded', False):
+        avatars.schedule(instance.pk)
+
+@receiver([post_save, post_delete], sender=Question)
+@receiver([post_save, post_delete], sender=Answer)
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=Profile)
+def invalidate_sidebar(sender, **kwargs):
+    """Сброс кэша сайдбара при изменении данных, из которых он строится"""
+    sidebar.invalidate()
+
+@receiver(m2m_changed, sender=Question.tags.through)
+def invalidate_sidebar_on_tags(sender, action, **kwargs):
+    """Сброс популярных тегов при изменении тегов вопроса"""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        sidebar.invalidate()
+
+@receiver(post_save, sender=Answer)
+def increment_answers_count(sender, instance, created, **kwargs):
+    """Новый ответ увеличивает счетчик ответов вопроса"""
     if created:
-        Profile.objects.get_or_create(user=instance)
+        counters.change_answers_count(instance.question_id, 1)
 
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    """Сохранение профиля при сохранении пользователя"""
-    if hasattr(instance, 'profile'):
-        instance.profile.save()
+@receiver(post_delete, sender=Answer)
+def decrement_answers_count(sender, instance, **kwargs):
+    """Удаленный ответ уменьшает счетчик ответов вопроса"""
+    counters.change_answers_count(instance.question_id, -1)
+
+@receiver(m2m_changed, sender=Question.tags.through)
+def update_tag_question_count(sender, instance, action, reverse, pk_set, **kwargs):
+    """Поддержка Tag.question_count при добавлении и снятии тегов с вопросов"""
+    if action == 'pre_clear':
+        # После очистки связей уже не узнать, какие теги были затронуты
+        if reverse:
+            instance._cleared_count = instance.question_set.count()
+        else:
+            instance._cleared_tag_ids = list(instance.tags.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    delta = 1 if action == 'post_add' else -1
+    if reverse:
+        # instance - тег, pk_set - вопросы
+        count = instance.__dict__.pop('_cleared_count', 0) if action == 'post_clear' else len(pk_set)
+        if count:
+            counters.change_question_count([instance.pk], delta * count)
     else:
-        Profile.objects.get_or_create(user=instance)
+        tag_ids = instance.__dict__.pop('_cleared_tag_ids', []) if action == 'post_clear' else pk_set
+        counters.change_question_count(tag_ids, delta)
+
+@receiver(m2m_changed, sender=Question.tags.through)
+def update_tag_feeds(sender, instance, action, reverse, pk_set, **kwargs):
+    """Поддержка лент TagFeedEntry; при удалении вопроса записи удаляются каскадом"""
+    if action == 'post_add':
+        if reverse:
+            tag_index.attach_questions(instance.pk, pk_set)
+        else:
+            tag_index.attach(pk_set, {instance.pk: instance.created_date})
+    elif action == 'post_remove':
+        if reverse:
+            tag_index.detach([instance.pk], pk_set)
+        else:
+            tag_index.detach(pk_set, [instance.pk])
+    elif action == 'post_clear':
+        if reverse:
+            tag_index.detach(tag_ids=[instance.pk])
+        else:
+            tag_index.detach(question_ids=[instance.pk])
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tag_names(sender, **kwargs):
+    """Сброс кэша имен тегов во всех процессах"""
+    tag_index.invalidate_names()
+
+@receiver(pre_delete, sender=Question)
+def release_question_tags(sender, instance, **kwargs):
+    """Связи удаляемого вопроса с тегами удаляются каскадом без m2m_changed"""
+    counters.change_question_count(list(instance.tags.values_list('pk', flat=True)), -1)
+
+@receiver(post_save, sender=Question)
+def index_question_for_search(sender, instance, update_fields=None, **kwargs):
+    """Обновление поискового индекса при изменении заголовка или текста"""
+    if update_fields is None or {'title', 'text'} & set(update_fields):
+        search.index_question(instance)
+
+@receiver(pre_delete, sender=Question)
+def unindex_question_for_search(sender, instance, **kwargs):
+    """Записи индекса удалятся каскадом, словарю терминов нужно уменьшить счетчики"""
+    search.unindex_question(instance)
+
+@receiver([post_save, post_delete], sender=Question)
+def bump_question_version(sender, instance, **kwargs):
+    """Сброс закэшированных фрагментов вопроса"""
+    versions.bump('question', [instance.pk])
+
+@receiver([post_save, post_delete], sender=Answer)
+@receiver([post_save, post_delete], sender=QuestionLike)
+def bump_parent_question_version(sender, instance, **kwargs):
+    """Ответы и оценки вопроса меняют его карточку и список ответов"""
+    versions.bump('question', [instance.question_id])
+
+@receiver([post_save, post_delete], sender=AnswerLike)
+def bump_answer_question_version(sender, instance, **kwargs):
+    """Оценка ответа меняет порядок и рейтинг в списке ответов вопроса"""
+    versions.bump('question', Answer.objects.filter(pk=instance.answer_id).values_list('question_id', flat=True))
+
+@receiver(m2m_changed, sender=Question.tags.through)
+def bump_question_version_on_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    """Теги выводятся в карточке вопроса"""
+    if action == 'pre_clear' and reverse:
+        instance._cleared_question_ids = list(instance.question_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        versions.bump('question', pk_set if reverse else [instance.pk])
+    elif action == 'post_clear':
+        versions.bump('question', instance.__dict__.pop('_cleared_question_ids', []) if reverse else [instance.pk])
+
+@receiver(post_save, sender=Answer)
+def publish_new_answer(sender, instance, created, raw=False, **kwargs):
+    """Новый ответ зрителям страницы вопроса (live.py)"""
+    if created and not raw:
+        live.answer_created(instance)
+
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=Answer)
+def credit_author_reputation(sender, instance, created, **kwargs):
+    """Репутация за новый вопрос или ответ"""
+    if created:
+        reputation.post_created(instance)
+
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=Answer)
+def revoke_author_reputation(sender, instance, origin=None, **kwargs):
+    """Удаленный вопрос или ответ забирает все начисленное за него"""
+    if origin is None or not reputation.deleting_profile(origin):
+        reputation.post_deleted(instance)
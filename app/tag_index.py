@@ -0,0 +1,109 @@
+"""
+Лента вопросов по тегу без соединения тег -> связи -> вопросы:
+кэш имя -> id в памяти процесса, списки TagFeedEntry (новые первыми)
+и загрузка вопросов страницы по id.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import counters
+from .models import Question, Tag, TagFeedEntry
+
+NAMES_VERSION_KEY = 'tag_index:names:version'
+FEED_ORDERING = ('-created_date', '-question_id')
+
+_names = {}
+_names_version = None
+_names_lock = threading.Lock()
+
+
+def _current_names_version():
+    version = cache.get(NAMES_VERSION_KEY)
+    if version is None:
+        cache.add(NAMES_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(NAMES_VERSION_KEY)
+    return version
+
+
+def resolve(name):
+    """
+    id тега по имени или None. Ответ (в том числе "тега нет") запоминается
+    в процессе до смены версии в общем кэше, то есть до изменения тегов.
+    """
+    global _names_version
+    version = _current_names_version()
+    with _names_lock:
+        if version != _names_version:
+            _names.clear()
+            _names_version = version
+        if name in _names:
+            return _names[name]
+
+    tag_id = Tag.objects.filter(name=name).values_list('pk', flat=True).first()
+    with _names_lock:
+        if _names_version == version:
+            if len(_names) >= getattr(settings, 'TAG_NAME_CACHE_SIZE', 10000):
+                _names.clear()
+            _names[name] = tag_id
+    return tag_id
+
+
+def invalidate_names():
+    """Сброс кэша имен во всех процессах после фиксации транзакции"""
+    transaction.on_commit(lambda: cache.set(NAMES_VERSION_KEY, time.time_ns(), None))
+
+
+def attach(tag_ids, created_dates):
+    """Добавляет вопросы {id: created_date} в ленты тегов tag_ids"""
+    TagFeedEntry.objects.bulk_create([
+        TagFeedEntry(tag_id=tag_id, question_id=question_id, created_date=created_date)
+        for tag_id in tag_ids
+        for question_id, created_date in created_dates.items()
+    ], ignore_conflicts=True)
+
+
+def attach_questions(tag_id, question_ids):
+    """Добавление вопросов к тегу со стороны тега: даты читаются из вопросов"""
+    attach([tag_id], dict(
+        Question.objects.filter(pk__in=question_ids).values_list('pk', 'created_date')
+    ))
+
+
+def detach(tag_ids=None, question_ids=None):
+    """Удаляет записи лент; None означает "все" с этой стороны связи"""
+    entries = TagFeedEntry.objects.all()
+    if tag_ids is not None:
+        entries = entries.filter(tag_id__in=tag_ids)
+    if question_ids is not None:
+        entries = entries.filter(question_id__in=question_ids)
+    entries.delete()
+
+
+def entries(tag_id):
+    """Записи ленты тега для пагинации в порядке FEED_ORDERING"""
+    return TagFeedEntry.objects.filter(tag_id=tag_id).only('question_id', 'created_date')
+
+
+def question_count(tag_id):
+    return Tag.objects.filter(pk=tag_id).values_list('question_count', flat=True).first() or 0
+
+
+def rebuild(batch_size=1000):
+    """Заново строит все ленты по связям вопросов с тегами; возвращает число записей"""
+    through = Question.tags.through
+    written = 0
+    with transaction.atomic():
+        TagFeedEntry.objects.all().delete()
+        for ids in counters.id_batches(Question, batch_size):
+            rows = through.objects.filter(question_id__in=ids).values_list(
+                'tag_id', 'question_id', 'question__created_date',
+            )
+            written += len(TagFeedEntry.objects.bulk_create([
+                TagFeedEntry(tag_id=tag_id, question_id=question_id, created_date=created_date)
+                for tag_id, question_id, created_date in rows
+            ], batch_size=batch_size))
+    return written
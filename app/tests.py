@@ -1,3 +1,1525 @@
-from django.test import TestCase
+import asyncio
+import importlib.util
+import io
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from PIL import Image
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.paginator import Paginator
+from django.http import HttpResponse
+from django.template import engines
+from django.template.backends.django import Template as DjangoTemplate
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, connections, transaction
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+
+from . import (
+    avatars, benchmark, cards, content, counters, dataset, live, middleware, profiles, ranking, replicas,
+    reputation, search, sidebar, versions, view_counts, views, voting,
+)
+from .backends.postgresql_pool import pool as db_pool
+from .management.commands import explain_queries
+from .models import (
+    Answer, AnswerLike, Profile, Question, QuestionLike, ReputationEvent, SearchEntry, SearchTerm, Tag,
+)
+from .pagination import KeysetPaginator
+from .query_budget import QueryBudgetMixin
+
+
+def tearDownModule():
+    # Просмотры из запросов к страницам вопросов пишутся, пока тестовая база
+    # существует, а не из atexit после ее удаления
+    view_counts.flush()
+
+
+def make_profiles(count, prefix='user'):
+    return profiles.create_users([User(username=f'{prefix}{i}') for i in range(count)])
+
+
+def make_question(author, title='Как настроить python?', text='Текст вопроса про python и django'):
+    return Question.objects.create(title=title, text=text, author=author)
+
+
+def make_site(questions=25, answers=3):
+    """Профили, теги и вопросы с ответами и оценками: больше страницы каждой ленты"""
+    authors = make_profiles(3, prefix='author')
+    tags = [Tag.objects.create(name=name) for name in ('python', 'django', 'sql')]
+    created = []
+    for i in range(questions):
+        question = make_question(authors[i % 3], title=f'Как настроить python {i}?')
+        question.tags.add(tags[i % 3], tags[(i + 1) % 3])
+        for j in range(answers):
+            answer = Answer.objects.create(text=f'Ответ {j} про python', author=authors[j % 3], question=question)
+            AnswerLike.objects.create(user=authors[(j + 1) % 3], answer=answer, value=1)
+        QuestionLike.objects.create(user=authors[(i + 1) % 3], question=question, value=1)
+        created.append(question)
+    return authors, tags, created
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    """Бюджет представления проверяется на холодном кэше (фрагменты, карточки, сайдбар) и на теплом"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors, cls.tags, cls.questions = make_site()
+
+    def assertBudgetColdAndWarm(self, url, login=False):
+        if login:
+            self.client.force_login(self.authors[0].user)
+        cache.clear()
+        cold = self.assertWithinQueryBudget(url)
+        self.assertEqual(cold.status_code, 200)
+        warm = self.assertWithinQueryBudget(url)
+        self.assertEqual(warm.status_code, 200)
+        return cold
+
+
+class NewQuestionsBudgetTests(QueryBudgetTestCase):
+    def test_first_page(self):
+        response = self.assertBudgetColdAndWarm('/')
+        self.assertContains(response, self.questions[-1].title)
+
+    def test_page_number_link(self):
+        self.assertBudgetColdAndWarm('/?page=2')
+
+    def test_logged_in(self):
+        self.assertBudgetColdAndWarm('/', login=True)
+
+
+class HotQuestionsBudgetTests(QueryBudgetTestCase):
+    def test_first_page(self):
+        self.assertBudgetColdAndWarm('/hot/')
+
+    def test_page_number_link(self):
+        self.assertBudgetColdAndWarm('/hot/?page=2')
+
+    def test_logged_in(self):
+        self.assertBudgetColdAndWarm('/hot/', login=True)
+
+
+class TagBudgetTests(QueryBudgetTestCase):
+    """
+    Холодный кэш: id тега по имени (кэш имен сбрасывается вместе с общим
+    кэшем), записи ленты, две выборки карточек и сайдбар; ссылки ?page=
+    еще читают Tag.question_count
+    """
+
+    def test_feed(self):
+        response = self.assertBudgetColdAndWarm('/tag/python/')
+        self.assertContains(response, 'Как настроить python')
+
+    def test_page_number_link(self):
+        self.assertBudgetColdAndWarm('/tag/python/?page=2')
+
+    def test_unknown_tag(self):
+        self.assertBudgetColdAndWarm('/tag/nope/')
+
+    def test_name_resolution_is_cached(self):
+        self.client.get('/tag/python/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/tag/django/')
+            self.client.get('/tag/django/')
+        self.assertEqual(sum('"app_tag"."name" =' in query['sql'] for query in queries.captured_queries), 1)
+
+
+class QuestionPageBudgetTests(QueryBudgetTestCase):
+    """Вопрос, его теги (один раз), ответы и сайдбар; у вошедшего еще сессия, пользователь и его голоса"""
+
+    def test_anonymous(self):
+        question = self.questions[0]
+        response = self.assertBudgetColdAndWarm(f'/question/{question.pk}/')
+        self.assertContains(response, question.title)
+        self.assertContains(response, 'href="/tag/python/"')
+
+    def test_logged_in(self):
+        self.assertBudgetColdAndWarm(f'/question/{self.questions[0].pk}/', login=True)
+
+    def test_tags_are_read_once(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f'/question/{self.questions[0].pk}/')
+        tag_queries = [query for query in queries.captured_queries if 'INNER JOIN "app_question_tags"' in query['sql']]
+        self.assertEqual(len(tag_queries), 1)
+
+
+class QuestionPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author, self.viewer = make_profiles(2)
+        self.question = make_question(self.author)
+        self.best = self.answer('Лучший ответ', 5)
+        self.good = self.answer('Хороший ответ', 3)
+        self.accepted = self.answer('Принятый ответ', -2, is_correct=True)
+
+    def answer(self, text, rating, **fields):
+        return Answer.objects.create(text=text, author=self.author, question=self.question, rating=rating, **fields)
+
+    def page(self):
+        cache.clear()
+        return self.client.get(f'/question/{self.question.pk}/')
+
+    def test_accepted_answer_is_pinned_first(self):
+        self.assertEqual(
+            list(Answer.objects.for_question(self.question.pk)), [self.accepted, self.best, self.good],
+        )
+        html = self.page().content.decode()
+        self.assertLess(html.index('Принятый ответ'), html.index('Лучший ответ'))
+        self.assertLess(html.index('Лучший ответ'), html.index('Хороший ответ'))
+
+    def test_viewer_votes_are_shown(self):
+        voting.record_vote(self.viewer, self.best, 1)
+        voting.record_vote(self.viewer, self.good, -1)
+        voting.record_vote(self.author, self.accepted, 1)
+        self.client.force_login(self.viewer.user)
+        response = self.page()
+        self.assertContains(response, 'ваш голос: +1', count=1)
+        self.assertContains(response, 'ваш голос: -1', count=1)
+
+    def test_queries_do_not_grow_with_votes(self):
+        self.client.force_login(self.viewer.user)
+        voting.record_vote(self.viewer, self.best, 1)
+        with CaptureQueriesContext(connection) as few:
+            self.page()
+        for answer in [self.answer(f'Ответ {i}', 0) for i in range(10)]:
+            voting.record_vote(self.viewer, answer, 1)
+            for voter in make_profiles(3, prefix=f'voter{answer.pk}-'):
+                voting.record_vote(voter, answer, -1)
+        with CaptureQueriesContext(connection) as many:
+            response = self.page()
+        self.assertContains(response, 'ваш голос: +1', count=11)
+        self.assertEqual(len(many), len(few))
+
+
+class SearchBudgetTests(QueryBudgetTestCase):
+    def test_results(self):
+        response = self.assertBudgetColdAndWarm('/search/?q=python')
+        self.assertContains(response, 'Как настроить python')
+
+    def test_logged_in(self):
+        self.assertBudgetColdAndWarm('/search/?q=django', login=True)
+
+
+@override_settings(ROOT_URLCONF='ask_pupkin.urls_async')
+class AsyncQueryBudgetTests(TransactionTestCase):
+    """
+    Асинхронные представления читают в нескольких потоках со своими
+    соединениями, поэтому запросы считаются по Server-Timing от
+    PerformanceMiddleware (он учитывает все потоки запроса), а данные
+    фиксируются, чтобы их видели эти соединения
+    """
+
+    def setUp(self):
+        self.authors, self.tags, self.questions = make_site(questions=21, answers=2)
+
+    def assertBudgetColdAndWarm(self, url):
+        budget = resolve(url.split('?')[0], urlconf='ask_pupkin.urls_async').func.query_budget
+        cache.clear()
+        for state in ('холодный', 'теплый'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            executed = int(re.search(r'SQL x(\d+)', response['Server-Timing']).group(1))
+            self.assertLessEqual(executed, budget, f'{url}, {state} кэш')
+
+    def test_new_questions(self):
+        self.assertBudgetColdAndWarm('/')
+        self.assertBudgetColdAndWarm('/?page=2')
+
+    def test_hot_questions(self):
+        self.assertBudgetColdAndWarm('/hot/')
+
+    def test_cursor_pages(self):
+        first = self.client.get('/').content.decode()
+        cursor = re.search(r'\?cursor=([\w-]+)" title="Следующая', first).group(1)
+        self.assertBudgetColdAndWarm(f'/?cursor={cursor}')
+        second = self.client.get('/', {'cursor': cursor})
+        # 21 вопрос по 20 на страницу: на второй странице самый старый
+        self.assertContains(second, self.questions[0].title)
+        self.assertNotContains(second, self.questions[1].title)
+        back = re.search(r'\?cursor=([\w-]+)" title="Предыдущая', second.content.decode()).group(1)
+        self.assertContains(self.client.get('/', {'cursor': back}), self.questions[1].title)
+
+    def test_tag_feed(self):
+        self.assertBudgetColdAndWarm('/tag/python/')
+
+    def test_question_page(self):
+        self.assertBudgetColdAndWarm(f'/question/{self.questions[0].pk}/')
+        self.client.force_login(self.authors[0].user)
+        self.assertBudgetColdAndWarm(f'/question/{self.questions[0].pk}/')
+
+    def test_live_events_only_under_asgi(self):
+        url = f'/question/{self.questions[0].pk}/'
+        # Тестовый Client создает WSGIRequest, AsyncClient - ASGIRequest
+        self.assertNotContains(self.client.get(url), 'EventSource')
+        response = async_to_sync(self.async_client.get)(url)
+        self.assertContains(response, f"new EventSource('{url}events/')")
+
+
+class CountersTests(TestCase):
+    def setUp(self):
+        self.author = make_profiles(1)[0]
+        self.question = make_question(self.author)
+        self.python, self.django = Tag.objects.create(name='python'), Tag.objects.create(name='django')
+
+    def assertCounts(self, answers, python, django):
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.answers_count, answers)
+        self.assertEqual(
+            dict(Tag.objects.values_list('name', 'question_count')), {'python': python, 'django': django},
+        )
+
+    def test_answers(self):
+        Question.objects.filter(pk=self.question.pk).update(hot_dirty=False)
+        first = Answer.objects.create(text='Первый', author=self.author, question=self.question)
+        Answer.objects.create(text='Второй', author=self.author, question=self.question)
+        self.assertCounts(2, 0, 0)
+        self.assertTrue(self.question.hot_dirty)
+        first.delete()
+        self.assertCounts(1, 0, 0)
+
+    def test_tags_from_question_side(self):
+        self.question.tags.add(self.python, self.django)
+        # Уже привязанный тег не считается второй раз
+        self.question.tags.add(self.python)
+        self.assertCounts(0, 1, 1)
+        self.question.tags.remove(self.django)
+        self.assertCounts(0, 1, 0)
+        self.question.tags.set([self.django])
+        self.assertCounts(0, 0, 1)
+        self.question.tags.clear()
+        self.assertCounts(0, 0, 0)
+
+    def test_tags_from_tag_side(self):
+        other = make_question(self.author, title='Другой вопрос')
+        self.python.question_set.add(self.question, other)
+        self.assertCounts(0, 2, 0)
+        self.python.question_set.remove(other)
+        self.assertCounts(0, 1, 0)
+        self.python.question_set.add(other)
+        self.python.question_set.clear()
+        self.assertCounts(0, 0, 0)
+
+    def test_question_delete_releases_tags(self):
+        self.question.tags.add(self.python, self.django)
+        make_question(self.author, title='Другой вопрос').tags.add(self.python)
+        self.question.delete()
+        self.assertEqual(dict(Tag.objects.values_list('name', 'question_count')), {'python': 1, 'django': 0})
+
+    def test_recount_repairs_drift(self):
+        self.question.tags.add(self.python)
+        Answer.objects.create(text='Ответ', author=self.author, question=self.question)
+        Question.objects.update(answers_count=5)
+        Tag.objects.update(question_count=7)
+        self.assertEqual(counters.recount_answers(), 1)
+        self.assertEqual(counters.recount_tags(), 2)
+        self.assertCounts(1, 1, 0)
+        self.assertEqual(counters.recount_answers(), 0)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = make_profiles(1)[0]
+
+    def found(self, query):
+        return [row['question'] for row in search.search(query)]
+
+    def term_counts(self):
+        return dict(SearchTerm.objects.filter(question_count__gt=0).values_list('term', 'question_count'))
+
+    def test_title_outweighs_text_and_more_terms_win(self):
+        in_text = make_question(self.author, title='Настройка сервера', text='Поставил nginx перед django')
+        in_title = make_question(self.author, title='Nginx не стартует', text='Ошибка при запуске')
+        both = make_question(self.author, title='Django за nginx', text='Статика не отдается')
+        # Равный вес у совпадений в заголовке: новее - выше
+        self.assertEqual(self.found('nginx'), [both.pk, in_title.pk, in_text.pk])
+        self.assertEqual(self.found('django nginx'), [both.pk, in_text.pk, in_title.pk])
+        self.assertEqual(self.found('Ёлка'), [])
+
+    def test_yo_is_folded(self):
+        question = make_question(self.author, title='Ещё один вопрос', text='Текст')
+        self.assertEqual(self.found('еще'), [question.pk])
+        self.assertEqual(self.found('ЕЩЁ'), [question.pk])
+
+    def test_edit_and_delete_update_index(self):
+        question = make_question(self.author, title='Python и redis', text='Кэш')
+        other = make_question(self.author, title='Python', text='Очереди')
+        self.assertEqual(self.term_counts()['python'], 2)
+
+        question.title = 'Python и memcached'
+        question.save()
+        self.assertEqual(self.found('redis'), [])
+        self.assertEqual(self.found('memcached'), [question.pk])
+        self.assertNotIn('redis', self.term_counts())
+
+        question.delete()
+        self.assertEqual(self.found('python'), [other.pk])
+        self.assertEqual(self.term_counts()['python'], 1)
+        self.assertNotIn('memcached', self.term_counts())
+
+    def test_rebuild_matches_incremental_index(self):
+        make_question(self.author, title='Python и redis', text='Кэш и очереди')
+        make_question(self.author, title='Django', text='Кэш шаблонов')
+        entries = set(SearchEntry.objects.values_list('term', 'question_id', 'weight'))
+        terms = self.term_counts()
+        self.assertEqual(search.rebuild(), 2)
+        self.assertEqual(set(SearchEntry.objects.values_list('term', 'question_id', 'weight')), entries)
+        self.assertEqual(self.term_counts(), terms)
+
+    def test_suggest_by_last_word(self):
+        make_question(self.author, title='Postfix', text='Почта')
+        make_question(self.author, title='Postgres', text='Репликация')
+        make_question(self.author, title='Postgres', text='Индексы')
+        self.assertEqual(search.suggest('настройка po'), ['postgres', 'postfix'])
+        self.assertEqual(search.suggest('настройка postg'), ['postgres'])
+        self.assertEqual(search.suggest('!'), [])
+
+    def test_search_page(self):
+        question = make_question(self.author, title='Как настроить nginx?', text='Текст')
+        response = self.client.get('/search/', {'q': 'nginx'})
+        self.assertContains(response, question.title)
+
+
+class RecordVoteTests(TestCase):
+    def setUp(self):
+        self.author, self.voter = make_profiles(2)
+        self.question = make_question(self.author)
+        self.answer = Answer.objects.create(text='Ответ', author=self.author, question=self.question)
+
+    def state(self, target):
+        target.refresh_from_db()
+        self.author.refresh_from_db()
+        like_model = QuestionLike if isinstance(target, Question) else AnswerLike
+        votes = list(like_model.objects.filter(user=self.voter).values_list('value', flat=True))
+        return target.rating, votes, self.author.reputation
+
+    def test_vote_flip_and_retract(self):
+        for target in (self.question, self.answer):
+            with self.subTest(target=type(target).__name__):
+                _, _, reputation = self.state(target)
+                self.assertEqual(voting.record_vote(self.voter, target, 1), 1)
+                self.assertEqual(self.state(target), (1, [1], reputation + 1))
+                self.assertEqual(voting.record_vote(self.voter, target, 1), 0)
+                self.assertEqual(voting.record_vote(self.voter, target, -1), -2)
+                self.assertEqual(self.state(target), (-1, [-1], reputation - 1))
+                self.assertEqual(voting.record_vote(self.voter, target, 0), 1)
+                self.assertEqual(self.state(target), (0, [], reputation))
+                self.assertEqual(voting.record_vote(self.voter, target, 0), 0)
+
+    def test_invalid_value(self):
+        with self.assertRaises(ValueError):
+            voting.record_vote(self.voter, self.question, 2)
+        self.assertEqual(self.state(self.question), (0, [], 2))
+
+    def test_vote_marks_question_for_hot_recount(self):
+        Question.objects.filter(pk=self.question.pk).update(hot_dirty=False)
+        voting.record_vote(self.voter, self.question, 1)
+        self.question.refresh_from_db()
+        self.assertTrue(self.question.hot_dirty)
+
+
+class CacheVersionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author, self.voter = make_profiles(2)
+        self.question = make_question(self.author)
+
+    def card(self):
+        return cards.for_ids([self.question.pk])[0]
+
+    def test_card_is_cached_until_vote(self):
+        self.card()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.card().rating, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            voting.record_vote(self.voter, self.question, 1)
+        self.assertEqual(self.card().rating, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            voting.record_vote(self.voter, self.question, 0)
+        self.assertEqual(self.card().rating, 0)
+
+    def test_card_follows_answers_and_tags(self):
+        self.card()
+        with self.captureOnCommitCallbacks(execute=True):
+            Answer.objects.create(text='Ответ', author=self.author, question=self.question)
+            self.question.tags.add(Tag.objects.create(name='python'))
+        card = self.card()
+        self.assertEqual((card.answers_count, card.tag_names), (1, ('python',)))
+
+    def test_question_page_shows_new_answer_and_edit(self):
+        url = f'/question/{self.question.pk}/'
+        self.assertContains(self.client.get(url), self.question.title)
+        with self.captureOnCommitCallbacks(execute=True):
+            Answer.objects.create(text='Свежий ответ', author=self.author, question=self.question)
+        self.assertContains(self.client.get(url), 'Свежий ответ')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.question.refresh_from_db()
+            self.question.text = 'Исправленный текст'
+            self.question.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'Свежий ответ')
+        self.assertContains(response, 'Исправленный текст')
+
+    def test_write_while_page_renders_is_not_cached_as_current(self):
+        url = f'/question/{self.question.pk}/'
+        read_question = views.get_object_or_404
+
+        def read_then_write(*args, **kwargs):
+            question = read_question(*args, **kwargs)
+            with self.captureOnCommitCallbacks(execute=True):
+                Question.objects.filter(pk=question.pk).update(title='Заголовок после правки')
+                versions.bump('question', [question.pk])
+            return question
+
+        with mock.patch.object(views, 'get_object_or_404', side_effect=read_then_write):
+            self.assertContains(self.client.get(url), f'<h1>{self.question.title}</h1>')
+        # Заголовок в <title> вне фрагмента; в кэшированном фрагменте - <h1>
+        self.assertContains(self.client.get(url), '<h1>Заголовок после правки</h1>')
+
+    def test_version_is_kept_without_changes(self):
+        first = self.card().cache_version
+        self.assertEqual(self.card().cache_version, first)
+        with self.captureOnCommitCallbacks(execute=True):
+            voting.record_vote(self.voter, self.question, 1)
+        self.assertNotEqual(self.card().cache_version, first)
+
+
+class CardsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = make_profiles(1)[0]
+        self.questions = [make_question(self.author, title=f'Вопрос {i}') for i in range(4)]
+        self.questions[0].tags.add(Tag.objects.create(name='sql'), Tag.objects.create(name='django'))
+
+    def test_card_fields(self):
+        card = cards.for_ids([self.questions[0].pk])[0]
+        self.assertEqual((card.pk, card.title, card.tag_names), (self.questions[0].pk, 'Вопрос 0', ('django', 'sql')))
+        self.assertEqual(card.author_username, self.author.user.username)
+        self.assertEqual(cards.QuestionCard(*card.pack()).pack(), card.pack())
+
+    def test_version_bump_refreshes_card(self):
+        question = self.questions[1]
+        old = cards.for_ids([question.pk])[0]
+        # Запись в обход сигналов версию не меняет: карточка берется из кэша
+        Question.objects.filter(pk=question.pk).update(title='Новый заголовок')
+        with self.assertNumQueries(0):
+            self.assertEqual(cards.for_ids([question.pk])[0].title, 'Вопрос 1')
+        with self.captureOnCommitCallbacks(execute=True):
+            versions.bump('question', [question.pk])
+        card = cards.for_ids([question.pk])[0]
+        self.assertEqual(card.title, 'Новый заголовок')
+        self.assertNotEqual(card.cache_version, old.cache_version)
+
+    def test_fill_page_keeps_order_with_partly_cached_cards(self):
+        first, second, third, fourth = self.questions
+        cards.for_ids([second.pk, fourth.pk])
+        page = Paginator([fourth, first, third, second], 10).page(1)
+        # Из БД читаются только две карточки не из кэша: строки и теги
+        with CaptureQueriesContext(connection) as queries:
+            cards.fill_page(page)
+        self.assertEqual(len(queries), 2)
+        self.assertIn(f'IN ({first.pk}, {third.pk})', queries.captured_queries[-1]['sql'])
+        self.assertEqual([card.pk for card in page.object_list], [fourth.pk, first.pk, third.pk, second.pk])
+        self.assertTrue(all(isinstance(card, cards.QuestionCard) for card in page.object_list))
+
+    def test_deleted_question_is_skipped(self):
+        gone = self.questions[2]
+        Question.objects.filter(pk=gone.pk).delete()
+        ids = [question.pk for question in self.questions]
+        self.assertEqual([card.pk for card in cards.for_ids(ids)], [pk for pk in ids if pk != gone.pk])
+
+
+class KeysetPaginationTests(TestCase):
+    ORDERING = ('-created_date', '-id')
+
+    @classmethod
+    def setUpTestData(cls):
+        author = make_profiles(1)[0]
+        questions = [make_question(author, title=f'Вопрос {i}') for i in range(8)]
+        # Одинаковое время у части вопросов: порядок внутри решает id
+        moment = timezone.now() - timedelta(hours=1)
+        Question.objects.filter(pk__in=[question.pk for question in questions[2:6]]).update(created_date=moment)
+        cls.expected = list(Question.objects.order_by(*cls.ORDERING).values_list('pk', flat=True))
+
+    def paginator(self):
+        return KeysetPaginator(Question.objects.only('id', 'created_date'), self.ORDERING, 3)
+
+    def walk(self, page_for):
+        """Страницы вперед по next_cursor, затем назад по previous_cursor"""
+        pages = [page_for(None)]
+        while pages[-1].has_next():
+            pages.append(page_for(pages[-1].next_cursor))
+        backward = [pages[-1]]
+        while backward[-1].has_previous():
+            backward.append(page_for(backward[-1].previous_cursor))
+        ids = lambda page: [obj.pk for obj in page]
+        return [ids(page) for page in pages], [ids(page) for page in reversed(backward)]
+
+    def test_forward_and_back(self):
+        forward, back = self.walk(self.paginator().page)
+        self.assertEqual(forward, [self.expected[i:i + 3] for i in range(0, 8, 3)])
+        self.assertEqual(back, forward)
+
+    def test_async_pages_match(self):
+        paginator = self.paginator()
+        self.assertEqual(self.walk(async_to_sync(paginator.apage)), self.walk(paginator.page))
+
+    def test_first_page_has_no_previous(self):
+        page = self.paginator().page()
+        self.assertFalse(page.has_previous())
+        back = self.paginator().page(page.next_cursor)
+        self.assertTrue(back.has_previous())
+        self.assertFalse(self.paginator().page(back.previous_cursor).has_previous())
+
+    def test_bad_or_stale_cursor_gives_first_page(self):
+        paginator = self.paginator()
+        last = Question.objects.get(pk=self.expected[-1])
+        for cursor in ('не курсор', 'WyJ4IiwgW11d', paginator.encode_cursor('n', last)):
+            with self.subTest(cursor=cursor):
+                self.assertEqual([obj.pk for obj in paginator.page(cursor)], self.expected[:3])
+
+    def test_feed_links(self):
+        author = Question.objects.first().author
+        for i in range(20):
+            make_question(author, title=f'Еще вопрос {i}')
+        response = self.client.get('/')
+        cursor = re.search(r'href="\?cursor=([\w-]+)" title="Следующая', response.content.decode()).group(1)
+        self.assertContains(self.client.get('/', {'cursor': cursor}), 'title="Предыдущая страница"')
+
+
+class ApplyVotesTests(TestCase):
+    def test_more_votes_than_sqlite_expression_depth(self):
+        voters = make_profiles(50)
+        questions = [make_question(voters[0], title=f'Вопрос {i}') for i in range(30)]
+        votes = [
+            voting.Vote(voter.pk, 'question', question.pk, 1)
+            for voter in voters for question in questions
+        ]
+        self.assertGreater(len(votes), 1000)
+
+        result = voting.apply_votes(votes, batch_size=400)
+
+        self.assertEqual(result['question'], {question.pk: 50 for question in questions})
+        self.assertEqual(set(Question.objects.values_list('rating', flat=True)), {50})
+        # Повторная пачка с отзывом голосов находит все 1500 оценок
+        voting.apply_votes([vote._replace(value=0) for vote in votes], batch_size=400)
+        self.assertEqual(set(Question.objects.values_list('rating', flat=True)), {0})
+
+
+class ReputationTests(TestCase):
+    def setUp(self):
+        self.author, self.answerer, self.voter = make_profiles(3)
+        self.question = make_question(self.author)
+        self.answer = Answer.objects.create(text='Ответ', author=self.answerer, question=self.question)
+
+    def reputations(self):
+        return list(
+            Profile.objects.filter(pk__in=[self.author.pk, self.answerer.pk, self.voter.pk])
+            .order_by('pk').values_list('reputation', flat=True)
+        )
+
+    def ledger(self, profile):
+        return sorted(
+            ReputationEvent.objects.filter(profile=profile).values_list('kind', 'object_id', 'delta')
+        )
+
+    def test_posts_and_votes_are_credited(self):
+        voting.record_vote(self.voter, self.question, 1)
+        voting.record_vote(self.voter, self.answer, -1)
+        self.assertEqual(self.reputations(), [
+            reputation.QUESTION_POINTS + reputation.VOTE_POINTS,
+            reputation.ANSWER_POINTS - reputation.VOTE_POINTS,
+            0,
+        ])
+
+    def test_compact_merges_events_and_keeps_totals(self):
+        for value in (1, -1, 1, 0, -1):
+            voting.record_vote(self.voter, self.question, value)
+        voting.record_vote(self.voter, self.answer, 1)
+        voting.record_vote(self.voter, self.answer, 0)
+        before = self.reputations()
+        self.assertEqual(ReputationEvent.objects.filter(profile=self.author).count(), 6)
+
+        self.assertEqual(reputation.compact(batch_size=1), 6)
+        self.assertEqual(self.reputations(), before)
+        self.assertEqual(self.ledger(self.author), [
+            ('question', self.question.pk, reputation.QUESTION_POINTS),
+            ('question_vote', self.question.pk, -reputation.VOTE_POINTS),
+        ])
+        # Отмененный голос за ответ дал ноль - события не осталось
+        self.assertEqual(self.ledger(self.answerer), [('answer', self.answer.pk, reputation.ANSWER_POINTS)])
+        self.assertEqual(reputation.compact(), 0)
+        self.assertEqual(reputation.rebuild(fix=False), 0)
+
+    def test_rebuild_ledger_restores_reputation(self):
+        for value in (1, -1, 1):
+            voting.record_vote(self.voter, self.question, value)
+        voting.record_vote(self.voter, self.answer, 1)
+        expected = self.reputations()
+        ReputationEvent.objects.all().delete()
+        Profile.objects.update(reputation=100)
+
+        self.assertEqual(reputation.rebuild_ledger(batch_size=1), 4)
+        self.assertEqual(self.reputations(), expected)
+        self.assertEqual(self.ledger(self.author), [
+            ('question', self.question.pk, reputation.QUESTION_POINTS),
+            ('question_vote', self.question.pk, reputation.VOTE_POINTS),
+        ])
+
+    def test_deleting_posts_revokes_what_they_earned(self):
+        voting.record_vote(self.voter, self.question, 1)
+        voting.record_vote(self.voter, self.answer, 1)
+        self.answer.delete()
+        self.assertEqual(self.reputations(), [reputation.QUESTION_POINTS + reputation.VOTE_POINTS, 0, 0])
+
+        answer = Answer.objects.create(text='Второй ответ', author=self.answerer, question=self.question)
+        voting.record_vote(self.voter, answer, 1)
+        # Ответы удаляются каскадом вместе с вопросом и тоже отзываются
+        self.question.delete()
+        self.assertEqual(self.reputations(), [0, 0, 0])
+        self.assertEqual(reputation.rebuild(fix=False), 0)
+
+    def test_deleting_profile_skips_revocation(self):
+        voting.record_vote(self.voter, self.question, 1)
+        self.author.user.delete()
+        self.assertFalse(ReputationEvent.objects.filter(profile_id=self.author.pk).exists())
+        self.assertEqual(self.reputations(), [reputation.ANSWER_POINTS, 0])
+
+
+@override_settings(SIDEBAR_MIN_REFRESH=0, SIDEBAR_BACKGROUND_REFRESH=False)
+class SidebarTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_new_tag_reaches_popular_tags(self):
+        question = make_question(make_profiles(1)[0])
+        self.assertEqual(list(sidebar.popular_tags()), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            question.tags.add(Tag.objects.create(name='rust'))
+        self.assertEqual([tag.name for tag in sidebar.popular_tags()], ['rust'])
+
+    def test_cached_blocks_need_no_queries(self):
+        sidebar.best_users()
+        sidebar.popular_tags()
+        with self.assertNumQueries(0):
+            sidebar.best_users()
+            sidebar.popular_tags()
+
+    @override_settings(SIDEBAR_MIN_REFRESH=60)
+    def test_recent_block_is_reused_after_write(self):
+        sidebar.best_users()
+        sidebar.bump_version()
+        with self.assertNumQueries(0):
+            sidebar.best_users()
+
+    def test_page_fragment_follows_version(self):
+        question = make_question(make_profiles(1)[0])
+        self.assertNotContains(self.client.get('/'), 'href="/tag/rust/" class="tag"')
+        with self.captureOnCommitCallbacks(execute=True):
+            question.tags.add(Tag.objects.create(name='rust'))
+        # Ссылка в карточке вопроса и в сайдбаре
+        self.assertContains(self.client.get('/'), 'href="/tag/rust/" class="tag"', count=2)
+
+    def test_vote_reaches_best_users(self):
+        authors = make_profiles(2, prefix='author')
+        voters = make_profiles(3, prefix='voter')
+        question = make_question(authors[1])
+        make_question(authors[0])
+        make_question(authors[0])
+        cache.clear()
+        self.assertEqual(sidebar.best_users()[0], authors[0])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for voter in voters:
+                voting.record_vote(voter, question, 1)
+        self.assertEqual(sidebar.best_users()[0], authors[1])
+
+
+class ImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_site(questions=3, answers=2)
+        cls.exported = io.StringIO()
+        dataset.export(cls.exported)
+
+    def load(self, importer):
+        """Загрузка с запоминанием, какие отображения id живут во время каждой записи"""
+        alive = {}
+
+        def lines():
+            model = None
+            for line in self.exported.getvalue().splitlines(True):
+                if model is not None:
+                    alive[model] = set(importer.ids)
+                model = json.loads(line)['model']
+                yield line
+
+        return importer.load(lines()), alive
+
+    def test_id_maps_are_dropped_after_last_use(self):
+        counts, alive = self.load(dataset.Importer(batch_size=2))
+        self.assertEqual(alive['question_tag'], {'profile', 'tag', 'question', 'answer'})
+        self.assertEqual(alive['answer'], {'profile', 'question', 'answer'})
+        self.assertEqual(alive['answer_like'], {'profile', 'answer'})
+        self.assertEqual(counts['question'], 3)
+        self.assertEqual(counts['answer_like'], 6)
+        self.assertEqual(Question.objects.count(), 6)
+        self.assertEqual(Question.tags.through.objects.count(), 12)
+
+    def test_keep_ids_keeps_file_ids(self):
+        questions = list(Question.objects.order_by('pk').values_list('pk', 'title'))
+        User.objects.all().delete()
+        Tag.objects.all().delete()
+        importer = dataset.Importer(keep_ids=True)
+        _, alive = self.load(importer)
+        self.assertEqual(list(Question.objects.order_by('pk').values_list('pk', 'title')), questions)
+        self.assertEqual(AnswerLike.objects.count(), 6)
+        self.assertEqual(alive['answer_like'], {'profile', 'answer'})
+
+    def test_counts_are_rows_written(self):
+        lines = self.exported.getvalue().splitlines(True)
+        like = next(i for i, line in enumerate(lines) if json.loads(line)['model'] == 'question_like')
+        lines.insert(like, lines[like])
+        counts = dataset.Importer().load(lines)
+        # Пользователи и теги уже есть: сопоставлены по имени, а не записаны
+        self.assertEqual(counts['profile'], 0)
+        self.assertEqual(counts['tag'], 0)
+        self.assertEqual(counts['question'], 3)
+        self.assertEqual(counts['question_tag'], 6)
+        self.assertEqual(counts['question_like'], 3)
+        self.assertEqual(QuestionLike.objects.count(), 6)
+
+    def test_keep_ids_rejects_taken_ids(self):
+        before = Question.objects.count()
+        out = io.StringIO()
+        path = os.path.join(tempfile.mkdtemp(), 'data.ndjson')
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write(self.exported.getvalue())
+        with self.assertRaisesMessage(CommandError, "Записи 'question' с id"):
+            call_command('import_data', path, keep_ids=True, skip_derived=True, stdout=out)
+        self.assertEqual(Question.objects.count(), before)
+
+    def test_records_out_of_order_are_rejected(self):
+        lines = self.exported.getvalue().splitlines(True)
+        with self.assertRaisesMessage(ValueError, "запись 'tag' после записей 'answer_like'"):
+            dataset.Importer().load(lines + [json.dumps({'model': 'tag', 'id': 99, 'name': 'rust'}) + '\n'])
+
+
+@override_settings(VIEW_COUNT_MAX_PENDING=10000)
+class ViewCountTests(TestCase):
+    def setUp(self):
+        view_counts.flush()
+        cache.clear()
+        author = make_profiles(1)[0]
+        self.first, self.second = make_question(author), make_question(author, title='Второй')
+
+    def views(self):
+        return dict(Question.objects.values_list('pk', 'views'))
+
+    def test_views_are_buffered_and_flushed(self):
+        for _ in range(3):
+            view_counts.record(self.first.pk)
+        view_counts.record(self.second.pk)
+        self.assertEqual(view_counts.pending(), {self.first.pk: 3, self.second.pk: 1})
+        self.assertEqual(self.views(), {self.first.pk: 0, self.second.pk: 0})
+
+        with self.assertNumQueries(2):
+            self.assertEqual(view_counts.flush(batch_size=1), 2)
+        self.assertEqual(self.views(), {self.first.pk: 3, self.second.pk: 1})
+        self.assertEqual(view_counts.pending(), {})
+        with self.assertNumQueries(0):
+            self.assertEqual(view_counts.flush(), 0)
+
+    def test_repeat_view_from_session_is_skipped(self):
+        self.assertTrue(view_counts.record(self.first.pk, 'session-a'))
+        self.assertFalse(view_counts.record(self.first.pk, 'session-a'))
+        self.assertTrue(view_counts.record(self.first.pk, 'session-b'))
+        self.assertTrue(view_counts.record(self.second.pk, 'session-a'))
+        self.assertEqual(view_counts.pending(), {self.first.pk: 2, self.second.pk: 1})
+
+    @override_settings(VIEW_COUNT_DEDUPE_TTL=None)
+    def test_dedupe_can_be_disabled(self):
+        view_counts.record(self.first.pk, 'session-a')
+        view_counts.record(self.first.pk, 'session-a')
+        self.assertEqual(view_counts.pending(), {self.first.pk: 2})
+
+    def test_failed_flush_keeps_views(self):
+        view_counts.record(self.first.pk)
+        with mock.patch.object(Question.objects, 'filter', side_effect=DatabaseError('нет связи')):
+            with self.assertRaises(DatabaseError):
+                view_counts.flush()
+        view_counts.record(self.first.pk)
+        self.assertEqual(view_counts.pending(), {self.first.pk: 2})
+        view_counts.flush()
+        self.assertEqual(self.views()[self.first.pk], 2)
+
+    def test_question_page_records_view(self):
+        url = f'/question/{self.first.pk}/'
+        self.client.get(url)
+        self.client.get(url)
+        self.client.force_login(User.objects.first())
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual(view_counts.pending(), {self.first.pk: 2})
+        view_counts.flush()
+        self.assertEqual(self.views()[self.first.pk], 2)
+
+    def test_anonymous_viewer_is_recognized_without_session(self):
+        url = f'/question/{self.first.pk}/'
+        for _ in range(2):
+            self.client.get(url, HTTP_USER_AGENT='firefox')
+            self.client.get(url, HTTP_USER_AGENT='curl')
+            self.client.get(url, HTTP_USER_AGENT='firefox', REMOTE_ADDR='10.0.0.2')
+        self.assertFalse(self.client.cookies.get('sessionid'))
+        self.assertEqual(view_counts.pending(), {self.first.pk: 3})
+
+
+class LiveTests(TestCase):
+    """Подписчики живут в цикле событий теста, события приходят после фиксации"""
+
+    def setUp(self):
+        self.author, self.voter = make_profiles(2)
+        self.question = make_question(self.author)
+        self.answer = Answer.objects.create(text='Первый ответ', author=self.author, question=self.question)
+
+    def tearDown(self):
+        live._subscribers.clear()
+
+    async def receive(self, subscription):
+        return await asyncio.wait_for(subscription.queue.get(), 1)
+
+    def committed(self, write):
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+
+    async def test_publish_reaches_only_watchers_of_question(self):
+        watcher = live.subscribe(self.question.pk)
+        other = live.subscribe(self.question.pk + 1)
+        self.assertEqual(live.publish(self.question.pk, 'rating', {'id': 1, 'delta': 1}), 1)
+        self.assertEqual(await self.receive(watcher), 'event: rating\ndata: {"id": 1, "delta": 1}\n\n')
+        self.assertTrue(other.queue.empty())
+        self.assertEqual(live.stats(), {'questions': 2, 'subscribers': 2})
+        live.unsubscribe(watcher)
+        live.unsubscribe(other)
+        self.assertEqual(live.publish(self.question.pk, 'rating', {}), 0)
+        self.assertFalse(live.watching())
+
+    async def test_new_answer_event(self):
+        watcher = live.subscribe(self.question.pk)
+        await sync_to_async(self.committed)(lambda: Answer.objects.create(
+            text='Новый `ответ`', author=self.voter, question=self.question,
+        ))
+        event, data = (await self.receive(watcher)).split('\n', 2)[:2]
+        self.assertEqual(event, 'event: answer')
+        data = json.loads(data.removeprefix('data: '))
+        self.assertEqual((data['author'], data['body_html']), ('user1', '<p>Новый <code>ответ</code></p>'))
+
+    async def test_vote_events(self):
+        watcher = live.subscribe(self.question.pk)
+        await sync_to_async(self.committed)(lambda: voting.record_vote(self.voter, self.question, 1))
+        await sync_to_async(self.committed)(lambda: voting.record_vote(self.voter, self.answer, -1))
+        await sync_to_async(self.committed)(lambda: voting.apply_votes([
+            voting.Vote(self.voter.pk, 'answer', self.answer.pk, 1),
+        ]))
+        events = [json.loads((await self.receive(watcher)).split('data: ')[1]) for _ in range(3)]
+        self.assertEqual(events, [
+            {'kind': 'question', 'id': self.question.pk, 'delta': 1},
+            {'kind': 'answer', 'id': self.answer.pk, 'delta': -1},
+            {'kind': 'answer', 'id': self.answer.pk, 'delta': 2},
+        ])
+
+    async def test_rolled_back_write_is_not_published(self):
+        watcher = live.subscribe(self.question.pk)
+
+        def rolled_back():
+            # Колбэки фиксации не выполняются - как при откате транзакции
+            with self.captureOnCommitCallbacks(execute=False):
+                voting.record_vote(self.voter, self.question, 1)
+
+        await sync_to_async(rolled_back)()
+        await asyncio.sleep(0)
+        self.assertTrue(watcher.queue.empty())
+
+    @override_settings(LIVE_QUEUE_SIZE=1, LIVE_KEEPALIVE_SECONDS=0.01, LIVE_RETRY_MS=100)
+    async def test_stream_keepalive_and_slow_reader(self):
+        stream = live.stream(self.question.pk)
+        self.assertEqual(await anext(stream), 'retry: 100\n\n')
+        self.assertEqual(await anext(stream), ': keepalive\n\n')
+        live.publish(self.question.pk, 'rating', {'delta': 1})
+        live.publish(self.question.pk, 'rating', {'delta': 2})
+        # Второе событие не влезло в очередь: зритель отключается после первого
+        self.assertEqual(await anext(stream), 'event: rating\ndata: {"delta": 1}\n\n')
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+        self.assertFalse(live.watching())
+
+    @override_settings(ROOT_URLCONF='ask_pupkin.urls_async')
+    async def test_events_endpoint(self):
+        response = await self.async_client.get(f'/question/{self.question.pk + 100}/events/')
+        self.assertEqual(response.status_code, 404)
+
+        response = await self.async_client.get(f'/question/{self.question.pk}/events/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'retry: 5000\n\n')
+        live.publish(self.question.pk, 'rating', {'delta': 1})
+        self.assertEqual(await asyncio.wait_for(anext(chunks), 1), b'event: rating\ndata: {"delta": 1}\n\n')
+
+    @override_settings(ROOT_URLCONF='ask_pupkin.urls_async')
+    def test_events_are_off_under_wsgi(self):
+        response = self.client.get(f'/question/{self.question.pk}/events/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(response.streaming)
+
+
+class ExplainQueriesTests(TestCase):
+    def test_every_query_uses_an_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('На маленьких таблицах PostgreSQL выбирает полный просмотр')
+        make_site(questions=3, answers=2)
+        out = io.StringIO()
+        call_command('explain_queries', strict=True, stdout=out, no_color=True)
+        labels = [label for label, _ in explain_queries.Command().manager_queries()]
+        report = dict(line.rsplit(None, 1) for line in out.getvalue().splitlines())
+        self.assertEqual({label: report.get(label) for label in labels}, dict.fromkeys(labels, 'INDEX'))
+
+
+class BenchProfilesTests(TestCase):
+    def test_runs_and_rolls_back(self):
+        out = io.StringIO()
+        call_command('bench_profiles', users=2, batch_size=1, legacy=True, stdout=out)
+        self.assertEqual(len(re.findall(r'SQL на операцию', out.getvalue())), 5)
+        self.assertFalse(User.objects.exists())
+
+    def test_rejects_empty_runs(self):
+        for options in ({'users': 0}, {'batch_size': 0}):
+            with self.subTest(**options), self.assertRaisesMessage(CommandError, 'не меньше 1'):
+                call_command('bench_profiles', stdout=io.StringIO(), **options)
+
+
+class FillDbTests(TestCase):
+    def test_stages_report_rows_written(self):
+        out = io.StringIO()
+        call_command('fill_db', 3, seed=1, stdout=out)
+        reported = dict(re.findall(r'^(\w+): (\d+) строк', out.getvalue(), re.M))
+        # Оценки выбираются случайно, повторы пропускаются ignore_conflicts
+        self.assertEqual(int(reported['question_likes']), QuestionLike.objects.count())
+        self.assertEqual(int(reported['answer_likes']), AnswerLike.objects.count())
+        self.assertLess(QuestionLike.objects.count(), 300)
+
+
+class HotScoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_new_question_ranks_by_created_date_before_recount(self):
+        author = make_profiles(1)[0]
+        old = [make_question(author, title=f'Старый вопрос {i}') for i in range(3)]
+        Question.objects.filter(pk__in=[question.pk for question in old]).update(
+            rating=10, hot_dirty=True, created_date=timezone.now() - timedelta(days=2),
+        )
+        ranking.update_hot_scores()
+
+        question = make_question(author, title='Новый вопрос')
+        self.assertNotEqual(question.hot_score, 0)
+        self.assertTrue(question.hot_dirty)
+        self.assertEqual(Question.objects.hot_questions().first(), question)
+
+        ranking.update_hot_scores()
+        question.refresh_from_db()
+        self.assertAlmostEqual(
+            question.hot_score, ranking.hot_score(0, 0, question.created_date), places=5,
+        )
+
+    def test_recount_touches_only_dirty_questions(self):
+        author, voter = make_profiles(2)
+        quiet, voted = make_question(author, title='Тихий'), make_question(author, title='Оцененный')
+        self.assertEqual(ranking.update_hot_scores(), 2)
+        self.assertEqual(ranking.update_hot_scores(), 0)
+
+        voting.record_vote(voter, voted, 1)
+        Answer.objects.create(text='Ответ', author=author, question=voted)
+        Question.objects.filter(pk=quiet.pk).update(hot_score=-1)
+        self.assertEqual(ranking.update_hot_scores(batch_size=1), 1)
+        quiet.refresh_from_db()
+        voted.refresh_from_db()
+        self.assertEqual(quiet.hot_score, -1)
+        self.assertFalse(voted.hot_dirty)
+        self.assertAlmostEqual(voted.hot_score, ranking.hot_score(1, 1, voted.created_date), places=5)
+
+        self.assertEqual(ranking.mark_all_dirty(), 2)
+        self.assertEqual(ranking.update_hot_scores(), 2)
+        quiet.refresh_from_db()
+        self.assertNotEqual(quiet.hot_score, -1)
+
+    def test_formula(self):
+        created = ranking.HOT_EPOCH + timedelta(seconds=ranking.HOT_DECAY)
+        self.assertEqual(ranking.hot_score(0, 0, created), 1)
+        # Десятикратная активность стоит HOT_DECAY секунд возраста
+        self.assertEqual(ranking.hot_score(10, 0, created), 2)
+        self.assertEqual(ranking.hot_score(0, 5, created), 2)
+        self.assertEqual(ranking.hot_score(-10, 0, created), 0)
+
+    def test_hot_feed_pages(self):
+        author = make_profiles(1)[0]
+        for i in range(25):
+            make_question(author, title=f'Горячий вопрос {i}')
+        # Одинаковая оценка у всех: порядок по id
+        Question.objects.update(hot_score=1, hot_dirty=False)
+        first = self.client.get('/hot/')
+        self.assertContains(first, 'Горячий вопрос 24<')
+        cursor = re.search(r'\?cursor=([\w-]+)" title="Следующая', first.content.decode()).group(1)
+        second = self.client.get('/hot/', {'cursor': cursor})
+        self.assertContains(second, 'Горячий вопрос 0<')
+        self.assertNotContains(second, 'Горячий вопрос 24')
+
+    def test_score_is_kept_on_update(self):
+        question = make_question(make_profiles(1)[0])
+        Question.objects.filter(pk=question.pk).update(hot_score=42)
+        question.refresh_from_db()
+        question.title = 'Другой заголовок'
+        question.save()
+        question.refresh_from_db()
+        self.assertEqual(question.hot_score, 42)
+
+
+class PerformanceTests(TestCase):
+    def setUp(self):
+        middleware.registry.reset()
+
+    def timed(self, view, path='/perf-test/'):
+        request = RequestFactory().get(path)
+        request.resolver_match = mock.Mock(view_name='perf-test')
+        return middleware.PerformanceMiddleware(view)(request)
+
+    def test_server_timing_counts_duplicate_queries(self):
+        def view(request):
+            Question.objects.count()
+            Question.objects.count()
+            list(Tag.objects.all())
+            return HttpResponse()
+
+        timing = self.timed(view)['Server-Timing']
+        self.assertRegex(timing, r'^total;dur=[\d.]+, db;desc="SQL x3, dup 1";dur=[\d.]+, tpl;desc="Templates";dur=[\d.]+$')
+        self.assertEqual(middleware.registry.snapshot()['perf-test']['duplicates']['p50'], 1)
+
+    def test_template_time_is_recorded(self):
+        template = engines['django'].from_string('{% for i in items %}{{ i }}{% endfor %}')
+
+        def view(request):
+            return HttpResponse(template.render({'items': range(20000)}))
+
+        self.timed(view)
+        stats = middleware.registry.snapshot()['perf-test']
+        self.assertGreater(stats['template']['p50'], 0)
+        self.assertLessEqual(stats['template']['p50'], stats['total']['p50'])
+
+    def test_template_timer_is_installed_once(self):
+        self.addCleanup(setattr, DjangoTemplate, 'render', DjangoTemplate.render)
+        middleware.PerformanceMiddleware(HttpResponse)
+        middleware.PerformanceMiddleware(HttpResponse)
+        self.assertIs(DjangoTemplate.render, middleware._timed_render)
+        # Повторная загрузка модуля оборачивает исходный render, а не прежнюю обертку
+        spec = importlib.util.spec_from_file_location('app._middleware_reloaded', middleware.__file__)
+        reloaded = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(reloaded)
+        reloaded._install_template_timer()
+        self.assertIs(DjangoTemplate.render.__wrapped__, middleware._original_render)
+        self.assertFalse(hasattr(middleware._original_render, '__wrapped__'))
+
+    def test_histogram_percentiles(self):
+        registry = middleware.PerformanceRegistry(size=100)
+        for value in range(1, 201):
+            registry.record('index', (value, 0, 0, value, 0))
+        stats = registry.snapshot()['index']
+        # В окне последние 100 замеров: 101..200
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual(stats['total'], {'p50': 151, 'p95': 195, 'p99': 199})
+        self.assertEqual(stats['queries'], stats['total'])
+
+    def test_stats_endpoint_is_staff_only(self):
+        self.assertEqual(self.client.get('/perf/').status_code, 302)
+        user = make_profiles(1)[0].user
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/perf/').status_code, 302)
+        User.objects.filter(pk=user.pk).update(is_staff=True)
+        self.client.get('/')
+        response = self.client.get('/perf/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('app:index', response.json())
+        self.assertEqual(self.client.get('/perf/', {'reset': 1}).json().get('app:index'), None)
+
+
+class AvatarTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.profile = make_profiles(1)[0]
+
+    def upload(self, color='red'):
+        buffer = io.BytesIO()
+        Image.new('RGB', (120, 80), color).save(buffer, 'PNG')
+        self.profile.avatar = SimpleUploadedFile('avatar.png', buffer.getvalue(), content_type='image/png')
+        # Миниатюры строятся в пуле потоков; здесь - сразу при фиксации
+        worker = mock.Mock(submit=lambda func, profile_id: avatars.process(profile_id))
+        with mock.patch.object(avatars, '_get_executor', return_value=worker), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.profile.save()
+        self.profile.refresh_from_db()
+
+    def test_upload_writes_content_addressed_thumbnails(self):
+        self.upload()
+        digest = self.profile.avatar_hash
+        self.assertEqual(len(digest), 32)
+        for size in avatars.SIZES:
+            name = avatars.thumbnail_name(digest, size)
+            self.assertEqual(name, f'avatars/thumbs/{digest[:2]}/{digest}-{size}.webp')
+            with default_storage.open(name) as file, Image.open(file) as thumb:
+                self.assertEqual((thumb.format, thumb.size), ('WEBP', (size, size)))
+        self.assertEqual(avatars.thumbnail_url(self.profile, 32), f'/uploads/{avatars.thumbnail_name(digest, 32)}')
+
+        self.upload(color='blue')
+        self.assertNotEqual(self.profile.avatar_hash, digest)
+
+    def test_url_falls_back_to_view_without_thumbnails(self):
+        self.assertEqual(avatars.thumbnail_url(self.profile, 32), '')
+        with self.captureOnCommitCallbacks():
+            self.profile.avatar = SimpleUploadedFile('avatar.png', b'', content_type='image/png')
+            self.profile.save()
+        fallback = f'/avatar/{self.profile.pk}/64/'
+        self.assertEqual(self.profile.avatar_hash, '')
+        self.assertEqual(avatars.thumbnail_url(self.profile, 64), fallback)
+
+    def test_view_builds_missing_thumbnails(self):
+        self.upload()
+        digest = self.profile.avatar_hash
+        Profile.objects.filter(pk=self.profile.pk).update(avatar_hash='')
+        for size in avatars.SIZES:
+            default_storage.delete(avatars.thumbnail_name(digest, size))
+
+        response = self.client.get(f'/avatar/{self.profile.pk}/64/')
+        self.assertRedirects(response, avatars.stored_url(digest, 64), fetch_redirect_response=False)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_hash, digest)
+        self.assertTrue(default_storage.exists(avatars.thumbnail_name(digest, 32)))
+        self.assertEqual(self.client.get(f'/avatar/{self.profile.pk}/48/').status_code, 404)
+
+
+class ContentTests(TestCase):
+    def test_markup_in_text_is_escaped(self):
+        html = content.render_body('<script>alert(1)</script>\n<img src=x onerror="alert(2)">')
+        self.assertNotIn('<script>', html)
+        self.assertNotIn('<img', html)
+        self.assertIn('&lt;script&gt;alert(1)&lt;/script&gt;', html)
+        self.assertIn('onerror=&quot;alert(2)&quot;', html)
+
+    def test_code_is_escaped(self):
+        html = content.render_body('`<b>` и\n```\n<script>"x" & y</script>\n```')
+        self.assertIn('<code>&lt;b&gt;</code>', html)
+        self.assertIn('<pre class="code-block"><code>&lt;script&gt;&quot;x&quot; &amp; y&lt;/script&gt;</code></pre>', html)
+
+    def test_paragraphs_and_code(self):
+        text = 'Первая строка\nвызов `foo()`\n\n```\ndef f():\n    return 1\n```\nПосле кода'
+        self.assertEqual(content.render_body(text), '\n'.join([
+            '<p>Первая строка<br>вызов <code>foo()</code></p>',
+            '<pre class="code-block"><code>def f():\n    return 1</code></pre>',
+            '<p>После кода</p>',
+        ]))
+
+    def test_unclosed_fence_runs_to_the_end(self):
+        self.assertEqual(content.render_body('Текст\n```\nx = 1'),
+                         '<p>Текст</p>\n<pre class="code-block"><code>x = 1</code></pre>')
+
+    def test_excerpt(self):
+        self.assertEqual(content.make_excerpt('Коротко  и\nясно'), 'Коротко и ясно')
+        words = content.make_excerpt(' '.join(f'слово{i}' for i in range(50)))
+        self.assertEqual(words.split()[-1], 'слово29…')
+        long = content.make_excerpt(' '.join(['а' * 40] * 20))
+        self.assertEqual(len(long), content.EXCERPT_MAX_LENGTH)
+        self.assertTrue(long.endswith('…'))
+
+    def test_fields_are_filled_on_save(self):
+        question = make_question(make_profiles(1)[0], text='Вопрос про `<b>`')
+        self.assertEqual(question.excerpt, 'Вопрос про `<b>`')
+        self.assertEqual(question.body_html, '<p>Вопрос про <code>&lt;b&gt;</code></p>')
+
+    def test_question_page_escapes_bodies(self):
+        author = make_profiles(1)[0]
+        question = make_question(author, text='<script>alert(1)</script>')
+        Answer.objects.create(text='<img src=x onerror=alert(2)>', author=author, question=question)
+        cache.clear()
+        response = self.client.get(f'/question/{question.pk}/')
+        self.assertNotContains(response, '<script>alert(1)')
+        self.assertNotContains(response, '<img src=x')
+        self.assertContains(response, '&lt;script&gt;alert(1)&lt;/script&gt;')
+
+    def test_rebuild_fills_only_empty_rows(self):
+        author = make_profiles(1)[0]
+        stale, rendered = make_question(author, text='Старый текст'), make_question(author, text='Готовый текст')
+        answer = Answer.objects.create(text='Ответ <i>', author=author, question=stale)
+        Question.objects.filter(pk=stale.pk).update(excerpt='', body_html='')
+        Question.objects.filter(pk=rendered.pk).update(body_html='<p>не трогать</p>')
+        Answer.objects.filter(pk=answer.pk).update(body_html='')
+        self.assertEqual(content.rebuild(batch_size=1), {'question': 1, 'answer': 1})
+        stale.refresh_from_db()
+        rendered.refresh_from_db()
+        answer.refresh_from_db()
+        self.assertEqual((stale.excerpt, stale.body_html), ('Старый текст', '<p>Старый текст</p>'))
+        self.assertEqual(rendered.body_html, '<p>не трогать</p>')
+        self.assertEqual(answer.body_html, '<p>Ответ &lt;i&gt;</p>')
+        self.assertEqual(content.rebuild(everything=True), {'question': 2, 'answer': 1})
+        rendered.refresh_from_db()
+        self.assertEqual(rendered.body_html, '<p>Готовый текст</p>')
+
+
+class BenchmarkCompareTests(SimpleTestCase):
+    def results(self, path, routes):
+        benchmark.save_results(path, {'routes': {
+            name: {'latency_ms': {'p50': p95 / 2, 'p95': p95}, 'queries_per_request': queries}
+            for name, (p95, queries) in routes.items()
+        }})
+        return benchmark.load_results(path)
+
+    def test_threshold(self):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = self.results(os.path.join(directory, 'baseline.json'), {
+                'index': (100, 5), 'hot': (100, 5), 'tag': (100, 5), 'search': (0, 3),
+            })
+            current = self.results(os.path.join(directory, 'current.json'), {
+                'index': (119, 5), 'hot': (121, 5), 'tag': (80, 6), 'search': (50, 3), 'new_route': (500, 9),
+            })
+        # Рост p95 на 19% допустим, на 21% - регрессия; нулевой baseline и новые маршруты не сравниваются
+        self.assertEqual(benchmark.compare(current, baseline, 0.2), [('hot', 100, 121), ('tag (SQL)', 5, 6)])
+        self.assertEqual(benchmark.compare(current, baseline, 0.25), [('tag (SQL)', 5, 6)])
+        self.assertEqual(
+            benchmark.compare(current, baseline, 0.1), [('index', 100, 119), ('hot', 100, 121), ('tag (SQL)', 5, 6)],
+        )
+        self.assertEqual(benchmark.compare(baseline, baseline, 0), [])
+
+
+class FakeConnection:
+    def __init__(self, params):
+        self.params = params
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """Пул без драйвера: соединения - заглушки, которые помнят параметры"""
+    PARAMS = {'dbname': 'ask_pupkin_db', 'host': 'localhost', 'port': '5432'}
+
+    def setUp(self):
+        db_pool.close_all()
+        self.addCleanup(db_pool.close_all)
+
+    def checkout(self, params):
+        pool = db_pool.get_pool('default', params, {'MAX_SIZE': 2})
+        return pool, pool.checkout(lambda: FakeConnection(params), lambda connection: True)
+
+    def test_connection_is_reused_for_same_params(self):
+        pool, connection = self.checkout(self.PARAMS)
+        pool.checkin(connection)
+        same_pool, again = self.checkout(dict(self.PARAMS))
+        self.assertIs(same_pool, pool)
+        self.assertIs(again, connection)
+
+    def test_changed_params_do_not_get_old_connections(self):
+        old_pool, idle = self.checkout(self.PARAMS)
+        _, in_use = self.checkout(self.PARAMS)
+        old_pool.checkin(idle)
+
+        test_params = dict(self.PARAMS, dbname='test_ask_pupkin_db')
+        new_pool, connection = self.checkout(test_params)
+        self.assertIsNot(new_pool, old_pool)
+        self.assertEqual(connection.params['dbname'], 'test_ask_pupkin_db')
+        self.assertTrue(idle.closed)
+        # Соединение, взятое до смены параметров, при возврате закрывается
+        old_pool.checkin(in_use)
+        self.assertTrue(in_use.closed)
+        self.assertEqual(list(db_pool.stats()), ['default'])
+
+    def test_close_all_closes_idle_and_returned_connections(self):
+        pool, idle = self.checkout(self.PARAMS)
+        _, in_use = self.checkout(self.PARAMS)
+        pool.checkin(idle)
+
+        db_pool.close_all()
+        self.assertTrue(idle.closed)
+        self.assertFalse(in_use.closed)
+        pool.checkin(in_use)
+        self.assertTrue(in_use.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+        self.assertEqual(db_pool.stats(), {})
+
+
+REPLICA = 'replica_test'
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA], DATABASE_ROUTERS=['app.replicas.ReplicaRouter'])
+class ReplicaTests(TransactionTestCase):
+    """Основная база - тестовая SQLite, реплика - второй файл, открытый только для чтения"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Алиас заводится после проверок раннера: зеркало default, как в
+        # settings.py, поэтому тесты его не создают и не очищают
+        connections.settings[REPLICA] = dict(
+            connections.settings[DEFAULT_DB_ALIAS],
+            TEST=dict(connections.settings[DEFAULT_DB_ALIAS]['TEST'], MIRROR=DEFAULT_DB_ALIAS),
+        )
+        cls.databases = cls.databases | {REPLICA}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.databases = cls.databases - {REPLICA}
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        super().tearDownClass()
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Реплика на SQLite-файле')
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'replica.sqlite3')
+        connections[REPLICA].settings_dict['NAME'] = f'file:{self.path}?mode=ro'
+        replicas._health.clear()
+        self.author = make_profiles(1)[0]
+        self.question = make_question(self.author)
+
+    def tearDown(self):
+        connections[REPLICA].close()
+        replicas._health.clear()
+        self.tempdir.cleanup()
+
+    def copy_primary(self):
+        connection.ensure_connection()
+        with sqlite3.connect(self.path) as target:
+            connection.connection.backup(target)
+        target.close()
+
+    def test_missing_file_is_not_created_and_reads_stay_on_primary(self):
+        self.assertFalse(replicas.check(REPLICA).healthy)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(replicas.ReplicaRouter().db_for_read(Question), DEFAULT_DB_ALIAS)
+
+    def test_empty_database_is_unhealthy(self):
+        sqlite3.connect(self.path).close()
+        self.assertFalse(replicas.check(REPLICA).healthy)
+        self.assertEqual(replicas.ReplicaRouter().db_for_read(Question), DEFAULT_DB_ALIAS)
+
+    def test_copy_serves_reads(self):
+        self.copy_primary()
+        self.assertTrue(replicas.check(REPLICA).healthy)
+        self.assertEqual(replicas.ReplicaRouter().db_for_read(Question), REPLICA)
+        self.assertEqual(list(Question.objects.values_list('pk', flat=True)), [self.question.pk])
+        # Запись идет в default: реплика открыта только для чтения
+        make_question(self.author, title='Второй вопрос')
+        self.assertEqual(Question.objects.using(DEFAULT_DB_ALIAS).count(), 2)
+
+    def test_failed_replica_query_is_retried_on_primary(self):
+        self.copy_primary()
+        self.assertTrue(replicas.check(REPLICA).healthy)
+        with sqlite3.connect(self.path) as broken:
+            broken.execute('DROP TABLE app_question')
+        broken.close()
+
+        # Первая попытка на реплике падает и пишется в лог, повтор идет в default
+        with self.assertLogs('django.request', 'ERROR'):
+            response = Client(raise_request_exception=False).get('/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.question.title)
+        self.assertFalse(replicas.status()[REPLICA]['healthy'])
+        self.assertEqual(replicas.ReplicaRouter().db_for_read(Question), DEFAULT_DB_ALIAS)
+
+    def test_repairs_read_from_primary(self):
+        self.copy_primary()
+        self.assertTrue(replicas.check(REPLICA).healthy)
+        voting.record_vote(self.author, self.question, 1)
+        Answer.objects.create(text='Ответ', author=self.author, question=self.question)
+        Question.objects.filter(pk=self.question.pk).update(rating=5, answers_count=7)
+        # Реплика отстала: там ни оценки, ни ответа, и столбцы с ними сходятся
+        self.assertEqual(replicas.ReplicaRouter().db_for_read(Question), REPLICA)
+        self.assertEqual(voting.check_ratings('question', fix=True), 1)
+        self.assertEqual(counters.recount_answers(), 1)
+        self.assertEqual(
+            Question.objects.using(DEFAULT_DB_ALIAS).values_list('rating', 'answers_count').get(),
+            (1, 1),
+        )
+
+    def route(self, request, write=False):
+        """Куда роутер отправит чтение внутри запроса, и ответ middleware"""
+        reads = []
+
+        def view(request):
+            router = replicas.ReplicaRouter()
+            reads.append(router.db_for_read(Question))
+            if write:
+                router.db_for_write(Question)
+            return HttpResponse()
+
+        response = replicas.StickyPrimaryMiddleware(view)(request)
+        return reads[0], response
+
+    def test_reads_after_write_stay_on_primary(self):
+        self.copy_primary()
+        factory = RequestFactory()
+        self.assertEqual(self.route(factory.get('/'))[0], REPLICA)
+
+        read, response = self.route(factory.post('/ask/'), write=True)
+        self.assertEqual(read, DEFAULT_DB_ALIAS)
+        cookie = response.cookies[replicas.STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], 15)
+
+        sticky = factory.get('/')
+        sticky.COOKIES[replicas.STICKY_COOKIE] = cookie.value
+        read, response = self.route(sticky)
+        self.assertEqual(read, DEFAULT_DB_ALIAS)
+        self.assertNotIn(replicas.STICKY_COOKIE, response.cookies)
+
+        for value in (f'{time.time() - 1:.0f}', 'мусор'):
+            with self.subTest(cookie=value):
+                expired = factory.get('/')
+                expired.COOKIES[replicas.STICKY_COOKIE] = value
+                self.assertEqual(self.route(expired)[0], REPLICA)
+
+    def test_post_without_write_sets_no_cookie(self):
+        self.copy_primary()
+        read, response = self.route(RequestFactory().post('/search/'))
+        self.assertEqual(read, DEFAULT_DB_ALIAS)
+        self.assertNotIn(replicas.STICKY_COOKIE, response.cookies)
+
+    def test_transaction_reads_primary(self):
+        self.copy_primary()
+        with transaction.atomic():
+            self.assertEqual(replicas.ReplicaRouter().db_for_read(Question), DEFAULT_DB_ALIAS)
+        self.assertEqual(replicas.ReplicaRouter().db_for_read(Question), REPLICA)
+
+    @override_settings(REPLICA_CHECK_INTERVAL=60)
+    def test_check_result_is_reused_within_interval(self):
+        self.copy_primary()
+        self.assertEqual(replicas.healthy_replicas(), [REPLICA])
+        connections[REPLICA].close()
+        os.remove(self.path)
+        self.assertEqual(replicas.healthy_replicas(), [REPLICA])
+        with override_settings(REPLICA_CHECK_INTERVAL=0):
+            self.assertEqual(replicas.healthy_replicas(), [])
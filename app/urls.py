@@ -8,9 +8,13 @@ urlpatterns = [
     path('hot/', views.hot_questions, name='hot'),
     path('tag/<str:tag_name>/', views.questions_by_tag, name='tag'),
     path('question/<int:question_id>/', views.question_page, name='question'),
+    path('search/', views.search_view, name='search'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
     path('login/', views.login_view, name='login'),
     path('signup/', views.signup_view, name='signup'),
     path('ask/', views.ask_view, name='ask'),
     path('settings/', views.settings_view, name='settings'),
+    path('avatar/<int:profile_id>/<int:size>/', views.avatar_thumbnail, name='avatar'),
     path('logout/', views.logout_view, name='logout'), 
+    path('perf/', views.performance_stats, name='performance_stats'),
 ]
\ No newline at end of file
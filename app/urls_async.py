@@ -0,0 +1,21 @@
+"""Маршруты app.urls, где страницы для чтения заменены асинхронными вариантами"""
+from django.urls import path
+from . import async_views
+from .urls import app_name, urlpatterns as sync_urlpatterns
+
+ASYNC_VIEWS = {
+    'index': async_views.new_questions,
+    'hot': async_views.hot_questions,
+    'tag': async_views.questions_by_tag,
+    'question': async_views.question_page,
+}
+
+urlpatterns = [
+    path(str(pattern.pattern), ASYNC_VIEWS[pattern.name], name=pattern.name)
+    if pattern.name in ASYNC_VIEWS else pattern
+    for pattern in sync_urlpatterns
+] + [
+    # Поток событий держит соединение открытым и работает только под ASGI:
+    # под WSGI представление отвечает 204
+    path('question/<int:question_id>/events/', async_views.question_events, name='question_events'),
+]
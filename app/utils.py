@@ -0,0 +1,7 @@
+"""Общие вспомогательные функции без зависимостей от моделей и тестового клиента"""
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
@@ -0,0 +1,39 @@
+"""Версии объектов для ключей кэша шаблонных фрагментов"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _key(kind, pk):
+    return f'version:{kind}:{pk}'
+
+
+def get_versions(kind, ids):
+    """{id: версия}; для объектов без версии заводится новая"""
+    keys = {_key(kind, pk): pk for pk in ids}
+    found = cache.get_many(list(keys))
+    missing = {key: time.time_ns() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return {keys[key]: version for key, version in found.items()}
+
+
+def attach(objects, kind='question'):
+    """Проставляет объектам атрибут cache_version одним обращением к кэшу"""
+    objects = list(objects)
+    versions = get_versions(kind, [obj.pk for obj in objects])
+    for obj in objects:
+        obj.cache_version = versions[obj.pk]
+    return objects
+
+
+def bump(kind, ids):
+    """
+    Сбрасывает версии после фиксации транзакции. Следующее чтение заведет
+    новую версию по текущему времени, поэтому старые фрагменты не совпадут.
+    """
+    keys = [_key(kind, pk) for pk in ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
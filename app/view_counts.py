@@ -0,0 +1,133 @@
+"""
+Счетчик просмотров вопросов без записи в БД на каждый просмотр.
+
+Просмотры копятся в памяти процесса и раз в VIEW_COUNT_FLUSH_INTERVAL
+секунд (или при VIEW_COUNT_MAX_PENDING накопленных) записываются в
+Question.views одним UPDATE с CASE на пачку вопросов. Запись идет в
+фоновом потоке, а при остановке процесса - из atexit, поэтому при
+аварийном завершении теряется не больше одного интервала просмотров.
+
+Повторный просмотр из той же сессии в течение VIEW_COUNT_DEDUPE_TTL
+секунд не учитывается (метка в общем кэше); None отключает проверку.
+Анонимный зритель без сессии узнается по IP и User-Agent (viewer_key):
+создавать ради счетчика сессию - лишняя запись в БД на каждого гостя.
+Число просмотров в закэшированных карточках обновляется вместе с
+фрагментом, версии объектов ради просмотров не сбрасываются.
+"""
+import atexit
+import hashlib
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import Question
+
+logger = logging.getLogger(__name__)
+
+_pending = Counter()
+_pending_total = 0
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker = None
+
+
+def viewer_key(request):
+    """Ключ зрителя для отсева повторных просмотров: сессия или хэш IP и User-Agent"""
+    if request.session.session_key:
+        return request.session.session_key
+    client = f'{request.META.get("REMOTE_ADDR", "")}|{request.META.get("HTTP_USER_AGENT", "")}'
+    return 'anon-' + hashlib.blake2b(client.encode(), digest_size=16).hexdigest()
+
+
+def _seen_before(question_id, session_key):
+    ttl = getattr(settings, 'VIEW_COUNT_DEDUPE_TTL', 3600)
+    if ttl is None or not session_key:
+        return False
+    return not cache.add(f'views:seen:{session_key}:{question_id}', 1, ttl)
+
+
+def record(question_id, session_key=None):
+    """Учитывает просмотр вопроса; в БД он попадет при следующей записи"""
+    global _pending_total
+    if _seen_before(question_id, session_key):
+        return False
+    with _lock:
+        _pending[question_id] += 1
+        _pending_total += 1
+        total = _pending_total
+    _ensure_worker()
+    if total >= getattr(settings, 'VIEW_COUNT_MAX_PENDING', 1000):
+        _wakeup.set()
+    return True
+
+
+def pending():
+    """Копия еще не записанных просмотров {id вопроса: число}"""
+    with _lock:
+        return dict(_pending)
+
+
+def flush(batch_size=500):
+    """Записывает накопленные просмотры; возвращает число обновленных вопросов"""
+    global _pending_total
+    with _lock:
+        counts = dict(_pending)
+        _pending.clear()
+        _pending_total = 0
+    items = list(counts.items())
+    written = 0
+    try:
+        while items:
+            batch, items = dict(items[:batch_size]), items[batch_size:]
+            written += Question.objects.filter(pk__in=list(batch)).update(
+                views=F('views') + Case(
+                    *[When(pk=pk, then=Value(delta)) for pk, delta in batch.items()],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+            )
+            for pk in batch:
+                del counts[pk]
+    except Exception:
+        # Незаписанное возвращается в буфер и уйдет со следующей попыткой
+        with _lock:
+            _pending.update(counts)
+            _pending_total += sum(counts.values())
+        raise
+    return written
+
+
+def _run():
+    interval = getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 10)
+    while True:
+        _wakeup.wait(interval)
+        _wakeup.clear()
+        try:
+            flush()
+        except Exception:
+            logger.exception('Не удалось записать просмотры вопросов')
+        finally:
+            close_old_connections()
+
+
+def _ensure_worker():
+    global _worker
+    if _worker is not None:
+        return
+    with _lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_run, name='view-counts', daemon=True)
+            _worker.start()
+            atexit.register(_flush_at_exit)
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception('Просмотры вопросов потеряны при остановке процесса')
@@ -1,13 +1,27 @@
+import os
+
 from django.shortcuts import render, get_object_or_404
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, JsonResponse
 from django.urls import reverse
-from django.db.models import Count
-from .models import Question, Tag, Profile
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+from .models import Answer, Profile, Question
+from . import avatars, cards, live, replicas, search, tag_index, versions, view_counts, voting
+from .backends.postgresql_pool import pool as db_pool
+from .context_processors import user_context
+from .middleware import registry
+from .pagination import KeysetPaginator, PrecountedPaginator
+from .query_budget import query_budget
 
-def paginate(objects_list, request, per_page=10):
-    """Функция пагинации для всех списков"""
-    paginator = Paginator(objects_list, per_page)
+def paginate(objects_list, request, per_page=10, count=None):
+    """Функция пагинации для всех списков; count - известное заранее число объектов"""
+    if count is None:
+        paginator = Paginator(objects_list, per_page)
+    else:
+        paginator = PrecountedPaginator(objects_list, per_page, count)
     page = request.GET.get('page', 1)
     
     try:
@@ -19,117 +33,183 @@ def paginate(objects_list, request, per_page=10):
         
     return result_page
 
+def paginate_feed(queryset, request, ordering, per_page=20):
+    """Курсорная пагинация ленты; старые ссылки ?page= обслуживает paginate()"""
+    if 'page' in request.GET:
+        return paginate(queryset.order_by(*ordering), request, per_page)
+    paginator = KeysetPaginator(
+        queryset, ordering, per_page,
+        approximate_count=getattr(settings, 'FEED_APPROXIMATE_COUNT', False),
+    )
+    return paginator.page(request.GET.get('cursor'))
+
+def paginate_tag_feed(tag_name, request, per_page=20):
+    """
+    Лента тега по TagFeedEntry: курсорная или (для ссылок ?page=) постраничная
+    с числом вопросов из Tag.question_count; карточки страницы берутся по id
+    """
+    tag_id = tag_index.resolve(tag_name)
+    if tag_id is None:
+        return paginate(Question.objects.none(), request, per_page, count=0)
+    entries = tag_index.entries(tag_id)
+    if 'page' in request.GET:
+        page = paginate(
+            entries.order_by(*tag_index.FEED_ORDERING).values_list('question_id', flat=True),
+            request, per_page, count=tag_index.question_count(tag_id),
+        )
+        question_ids = list(page.object_list)
+    else:
+        paginator = KeysetPaginator(entries, tag_index.FEED_ORDERING, per_page)
+        page = paginator.page(request.GET.get('cursor'))
+        question_ids = [entry.question_id for entry in page.object_list]
+    return cards.fill_page(page, question_ids)
+
+@query_budget(6)
 def new_questions(request):
     """Главная страница - новые вопросы"""
-    questions = Question.objects.new_questions().with_answers_count()
-    page = paginate(questions, request, 20)
-    
-    popular_tags = Tag.objects.popular_tags()
-    best_users = Profile.objects.best_profiles()
+    questions = Question.objects.new_questions().only('id', 'created_date')
+    page = cards.fill_page(paginate_feed(questions, request, ('-created_date', '-id')))
     
     return render(request, 'index.html', {
         'questions': page,
         'title': 'New Questions',
-        'popular_tags': popular_tags,
-        'best_users': best_users,
     })
 
+@query_budget(6)
 def hot_questions(request):
     """Страница популярных вопросов"""
-    questions = Question.objects.best_questions().with_answers_count()
-    page = paginate(questions, request, 20)
-    
-    popular_tags = Tag.objects.popular_tags()
-    best_users = Profile.objects.best_profiles()
+    questions = Question.objects.hot_questions().only('id', 'hot_score')
+    page = cards.fill_page(paginate_feed(questions, request, ('-hot_score', '-id')))
     
     return render(request, 'index.html', {
         'questions': page,
         'title': 'Hot Questions',
-        'popular_tags': popular_tags,
-        'best_users': best_users,
     })
 
+@query_budget(7)
 def questions_by_tag(request, tag_name):
     """Вопросы по определенному тегу"""
-    questions = Question.objects.by_tag(tag_name).with_answers_count()
-    page = paginate(questions, request, 20)
-    
-    popular_tags = Tag.objects.popular_tags()
-    best_users = Profile.objects.best_profiles()
+    page = paginate_tag_feed(tag_name, request)
     
     return render(request, 'tag.html', {
         'questions': page,
         'tag_name': tag_name,
-        'popular_tags': popular_tags,
-        'best_users': best_users,
     })
 
+def load_answer_thread(question, request, per_page=30, user=None):
+    """
+    Страница ответов в порядке for_question с авторами и голосами текущего
+    пользователя (answer.viewer_vote): не больше двух запросов на страницу,
+    число ответов берется из question.answers_count вместо COUNT(*)
+    """
+    user = user if user is not None else request.user
+    answers = Answer.objects.for_question(question.pk).select_related('author__user')
+    page = paginate(answers, request, per_page, count=question.answers_count)
+    if user.is_authenticated:
+        # Для анонимов страница остается ленивой: при попадании в кэш фрагмента
+        # ответы не читаются вовсе
+        page.object_list = list(page.object_list)
+        votes = voting.viewer_votes(user, 'answer', [answer.pk for answer in page.object_list])
+        for answer in page.object_list:
+            answer.viewer_vote = votes.get(answer.pk, 0)
+    return page
+
+@query_budget(8)
 def question_page(request, question_id):
     """Страница одного вопроса с ответами"""
-    question = get_object_or_404(Question.objects.with_answers_count(), id=question_id)
-    answers = question.answers.all()
-    page = paginate(answers, request, 30)
-    
-    popular_tags = Tag.objects.popular_tags()
-    best_users = Profile.objects.best_profiles()
+    # Версия читается раньше данных, как в cards.for_ids: запись между ними
+    # сменит версию, и устаревший фрагмент останется под прежним ключом
+    version = versions.get_versions('question', [question_id])[question_id]
+    question = get_object_or_404(
+        Question.objects.with_answers_count().select_related('author__user'), id=question_id
+    )
+    question.cache_version = version
+    view_counts.record(question.pk, view_counts.viewer_key(request))
+    page = load_answer_thread(question, request)
     
     return render(request, 'question.html', {
         'question': question,
         'answers': page,
-        'popular_tags': popular_tags,
-        'best_users': best_users,
+        'viewer_id': request.user.pk or 0,
+    })
+
+@query_budget(6)
+def search_view(request):
+    """Поиск вопросов по заголовку и тексту"""
+    query = request.GET.get('q', '').strip()
+    page = paginate(search.search(query), request, 20)
+    cards.fill_page(page, [row['question'] for row in page.object_list])
+
+    return render(request, 'search.html', {
+        'questions': page,
+        'query': query,
     })
 
+def search_suggest(request):
+    """Подсказки для строки поиска"""
+    return JsonResponse({'suggestions': search.suggest(request.GET.get('q', ''))})
+
 def login_view(request):
     """Страница входа (заглушка)"""
-    popular_tags = Tag.objects.popular_tags()
-    best_users = Profile.objects.best_profiles()
-    
-    return render(request, 'login.html', {
-        'popular_tags': popular_tags,
-        'best_users': best_users,
-    })
+    return render(request, 'login.html')
 
 def signup_view(request):
     """Страница регистрации (заглушка)"""
-    popular_tags = Tag.objects.popular_tags()
-    best_users = Profile.objects.best_profiles()
-    
-    return render(request, 'signup.html', {
-        'popular_tags': popular_tags,
-        'best_users': best_users,
-    })
+    return render(request, 'signup.html')
 
 def ask_view(request):
     """Страница создания вопроса (заглушка)"""
-    popular_tags = Tag.objects.popular_tags()
-    best_users = Profile.objects.best_profiles()
-    
-    return render(request, 'ask.html', {
-        'popular_tags': popular_tags,
-        'best_users': best_users,
-    })
+    return render(request, 'ask.html')
 
 def settings_view(request):
-    """Страница настроек пользователя (заглушка)"""
-    popular_tags = Tag.objects.popular_tags()
-    best_users = Profile.objects.best_profiles()
-    
-    user_data = {
-        'username': 'GudAlex61',
-        'email': 'gudalex61@example.com',
-        'reputation': 1256,
-        'questions': 42,
-        'answers': 87,
-        'member_since': '2023'
-    }
+    """Страница настроек пользователя (заглушка формы, реальная статистика профиля)"""
+    username = request.user.username if request.user.is_authenticated else user_context(request)['user'].username
+    profile = Profile.objects.select_related('user').filter(user__username=username).first()
+    user_data = None
+    if profile is not None:
+        user_data = {
+            'username': profile.user.username,
+            'email': profile.user.email,
+            'reputation': profile.reputation,
+            'questions': profile.questions.count(),
+            'answers': profile.answers.count(),
+            'member_since': profile.user.date_joined.year,
+        }
     
     return render(request, 'settings.html', {
-        'popular_tags': popular_tags,
-        'best_users': best_users,
         'user_data': user_data,
+        'profile': profile,
     })
 
+def avatar_thumbnail(request, profile_id, size):
+    """Миниатюра аватара, для которого их еще нет: строится при первом запросе"""
+    if size not in avatars.SIZES:
+        raise Http404
+    digest = avatars.process(profile_id)
+    if digest is None:
+        raise Http404
+    response = HttpResponseRedirect(avatars.stored_url(digest, size))
+    # Аватар профиля может смениться, поэтому кэшируется только перенаправление
+    patch_cache_control(response, public=True, max_age=300)
+    return response
+
+def avatar_file(request, path):
+    """Файл миниатюры при DEBUG; в продакшене его отдает веб-сервер с тем же заголовком"""
+    response = serve(request, path, document_root=os.path.join(settings.MEDIA_ROOT, avatars.THUMB_DIR))
+    patch_cache_control(response, public=True, max_age=avatars.CACHE_SECONDS, immutable=True)
+    return response
+
 def logout_view(request):
     """Заглушка для выхода - перенаправляет на главную"""
     return HttpResponseRedirect(reverse('app:index'))
+
+@staff_member_required
+def performance_stats(request):
+    """Перцентили времени, SQL и шаблонов по представлениям, метрики пула БД (только для staff)"""
+    if request.GET.get('reset'):
+        registry.reset()
+    stats = registry.snapshot()
+    stats['db_pool'] = db_pool.stats()
+    stats['db_replicas'] = replicas.status()
+    stats['live'] = live.stats()
+    return JsonResponse(stats, json_dumps_params={'ensure_ascii': False, 'indent': 2})
@@ -0,0 +1,185 @@
+"""Голосование за вопросы и ответы: рейтинг меняется на разницу голосов через F()"""
+from collections import namedtuple
+
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from . import counters, live, reputation, versions
+from .models import Answer, AnswerLike, Question, QuestionLike
+
+VOTE_VALUES = (-1, 0, 1)
+
+# kind -> (модель оценки, модель цели, поле цели)
+KINDS = {
+    'question': (QuestionLike, Question, 'question'),
+    'answer': (AnswerLike, Answer, 'answer'),
+}
+
+Vote = namedtuple('Vote', ['profile_id', 'kind', 'target_id', 'value'])
+
+
+def _check_value(value):
+    if value not in VOTE_VALUES:
+        raise ValueError(f'Недопустимое значение голоса: {value}')
+
+
+def record_vote(profile, target, value, _retry=True):
+    """
+    Голос profile за вопрос или ответ: 1, -1 или 0 (отзыв голоса).
+    Повторный голос с другим знаком меняет рейтинг на 2. Возвращает изменение рейтинга.
+    """
+    _check_value(value)
+    kind = 'question' if isinstance(target, Question) else 'answer'
+    like_model, _, field = KINDS[kind]
+
+    with transaction.atomic():
+        like = like_model.objects.select_for_update().filter(
+            user=profile, **{field: target}
+        ).first()
+
+        if like is None:
+            if value == 0:
+                return 0
+            try:
+                with transaction.atomic():
+                    like_model(user=profile, value=value, **{field: target}).save()
+            except IntegrityError:
+                # Параллельный первый голос того же пользователя - повторяем с блокировкой
+                if not _retry:
+                    raise
+                return record_vote(profile, target, value, _retry=False)
+            return value
+
+        old_value = like.value
+        if value == old_value:
+            return 0
+        if value == 0:
+            like.delete()
+        else:
+            like.value = value
+            like.save(update_fields=['value'])
+        return value - old_value
+
+
+def viewer_votes(user, kind, target_ids):
+    """{id цели: голос} пользователя сайта user одним запросом; для анонима - пусто"""
+    if not user.is_authenticated or not target_ids:
+        return {}
+    like_model, _, field = KINDS[kind]
+    return dict(
+        like_model.objects.filter(user__user_id=user.pk, **{f'{field}_id__in': target_ids})
+        .values_list(f'{field}_id', 'value')
+    )
+
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _rating_update(target_model, deltas, batch_size=1000):
+    """UPDATE на пачку целей: rating = rating + CASE id WHEN ... END"""
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    for pks in _chunks(deltas, batch_size):
+        changes = {'rating': F('rating') + Case(
+            *[When(pk=pk, then=Value(deltas[pk])) for pk in pks],
+            default=Value(0),
+            output_field=IntegerField(),
+        )}
+        if target_model is Question:
+            changes['hot_dirty'] = True
+        target_model.objects.filter(pk__in=pks).update(**changes)
+
+
+def _existing_likes(like_model, target_key, pairs, batch_size):
+    """
+    Оценки с блокировкой для пар (профиль, цель): запрос на пачку из batch_size
+    пар по IN профилей и IN целей, лишние совпадения отсеиваются здесь
+    """
+    existing = {}
+    for chunk in _chunks(pairs, batch_size):
+        wanted = set(chunk)
+        likes = like_model.objects.select_for_update().filter(
+            user_id__in={profile_id for profile_id, _ in chunk},
+            **{f'{target_key}__in': {target_id for _, target_id in chunk}},
+        )
+        for like in likes:
+            key = (like.user_id, getattr(like, target_key))
+            if key in wanted:
+                existing[key] = like
+    return existing
+
+
+def _rating_changed(kind, deltas):
+    """Сброс фрагментов и события для зрителей вопросов, чей рейтинг или ответы изменились"""
+    ids = [pk for pk, delta in deltas.items() if delta]
+    if kind == 'answer':
+        question_ids = dict(Answer.objects.filter(pk__in=ids).values_list('pk', 'question_id'))
+    else:
+        question_ids = {pk: pk for pk in ids}
+    versions.bump('question', set(question_ids.values()))
+    live.ratings_changed(kind, deltas, question_ids)
+
+
+def apply_votes(votes, batch_size=1000):
+    """
+    Применяет пачку голосов Vote в одной транзакции. Для пары (пользователь, цель)
+    учитывается последний голос. Возвращает {kind: {target_id: изменение рейтинга}}.
+    """
+    by_kind = {}
+    for vote in votes:
+        _check_value(vote.value)
+        by_kind.setdefault(vote.kind, {})[(vote.profile_id, vote.target_id)] = vote.value
+
+    result = {}
+    with transaction.atomic():
+        for kind, wanted in by_kind.items():
+            like_model, target_model, field = KINDS[kind]
+            target_key = f'{field}_id'
+
+            existing = _existing_likes(like_model, target_key, wanted, batch_size)
+
+            to_create, to_update, to_delete = [], [], []
+            deltas = {}
+            for (profile_id, target_id), value in wanted.items():
+                like = existing.get((profile_id, target_id))
+                old_value = like.value if like else 0
+                if value == old_value:
+                    continue
+                if like is None:
+                    to_create.append(like_model(user_id=profile_id, value=value, **{target_key: target_id}))
+                elif value == 0:
+                    to_delete.append(like.pk)
+                else:
+                    like.value = value
+                    to_update.append(like)
+                deltas[target_id] = deltas.get(target_id, 0) + value - old_value
+
+            like_model.objects.bulk_create(to_create, batch_size=batch_size)
+            like_model.objects.bulk_update(to_update, ['value'], batch_size=batch_size)
+            for pks in _chunks(to_delete, batch_size):
+                like_model.objects.filter(pk__in=pks).delete()
+            _rating_update(target_model, deltas, batch_size)
+            reputation.votes_received(target_model, deltas)
+            _rating_changed(kind, deltas)
+            result[kind] = deltas
+    return result
+
+
+def check_ratings(kind, batch_size=1000, fix=False):
+    """Сверяет рейтинг с суммой оценок; возвращает число расхождений"""
+    like_model, target_model, field = KINDS[kind]
+    target_key = f'{field}_id'
+
+    def count(ids):
+        return (
+            like_model.objects.using(DEFAULT_DB_ALIAS).filter(**{f'{target_key}__in': ids}).order_by()
+            .values(target_key).annotate(total=Sum('value'))
+            .values_list(target_key, 'total')
+        )
+
+    return sum(
+        counters.repair_column(target_model, 'rating', ids, count, batch_size, fix=fix)
+        for ids in counters.id_batches(target_model, batch_size)
+    )
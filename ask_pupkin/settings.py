@@ -20,6 +20,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.PerformanceMiddleware',
+    'app.replicas.StickyPrimaryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -29,7 +31,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'ask_pupkin.urls'
+# Асинхронные представления лент и страницы вопроса (для запуска под ASGI;
+# под WSGI они работают, но поток событий страницы вопроса отключен)
+ASYNC_VIEWS = os.environ.get('ASK_PUPKIN_ASYNC_VIEWS') == '1'
+
+ROOT_URLCONF = 'ask_pupkin.urls_async' if ASYNC_VIEWS else 'ask_pupkin.urls'
 
 TEMPLATES = [
     {
@@ -43,23 +49,117 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'app.context_processors.user_context',
+                'app.context_processors.sidebar_context',
+                'app.context_processors.fragment_cache_context',
             ],
         },
     },
 ]
 WSGI_APPLICATION = 'ask_pupkin.wsgi.application'
 
-DATABASES = {
+# PostgreSQL с пулом соединений процесса (app/backends/postgresql_pool).
+# ASK_PUPKIN_DB_POOL=0 - обычный бэкенд без пула; ASK_PUPKIN_DB=sqlite -
+# SQLite-файл для тестов и машин без PostgreSQL. CONN_MAX_AGE держит
+# соединение в потоке между запросами, пул - между потоками (async-
+# представления, воркеры с несколькими потоками). Размер пула - на процесс:
+# воркеры * ASK_PUPKIN_DB_POOL_SIZE не должно превышать max_connections сервера.
+if os.environ.get('ASK_PUPKIN_DB') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('ASK_PUPKIN_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': ('app.backends.postgresql_pool' if os.environ.get('ASK_PUPKIN_DB_POOL', '1') == '1'
+                       else 'django.db.backends.postgresql'),
+            'NAME': os.environ.get('ASK_PUPKIN_DB_NAME', 'ask_pupkin_db'),
+            'USER': os.environ.get('ASK_PUPKIN_DB_USER', 'ask_pupkin_user'),
+            'PASSWORD': os.environ.get('ASK_PUPKIN_DB_PASSWORD', 'your_password_here'),
+            'HOST': os.environ.get('ASK_PUPKIN_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('ASK_PUPKIN_DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('ASK_PUPKIN_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'POOL': {
+                'MAX_SIZE': int(os.environ.get('ASK_PUPKIN_DB_POOL_SIZE', '10')),
+                'TIMEOUT': 5,
+                'MAX_IDLE': 300,
+                'CHECK_INTERVAL': 30,
+            },
+        }
+    }
+
+# Реплики для чтения (app/replicas.py). ASK_PUPKIN_DB_REPLICAS - через запятую
+# хосты PostgreSQL (host или host:port) или, при ASK_PUPKIN_DB=sqlite, пути
+# к копиям файла базы (локальная проверка на двух SQLite-файлах; файл
+# открывается только для чтения и не создается, если его нет). Без
+# переменной все запросы идут в default.
+DATABASE_REPLICAS = []
+for number, location in enumerate(filter(None, os.environ.get('ASK_PUPKIN_DB_REPLICAS', '').split(',')), 1):
+    replica = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if replica['ENGINE'] == 'django.db.backends.sqlite3':
+        replica['NAME'] = f'file:{location.strip()}?mode=ro'
+    else:
+        host, _, port = location.strip().partition(':')
+        replica.update(HOST=host, PORT=port or replica['PORT'], OPTIONS={'connect_timeout': 2})
+    DATABASES[f'replica{number}'] = replica
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['app.replicas.ReplicaRouter'] if DATABASE_REPLICAS else []
+
+# Проверка реплик не чаще раза в REPLICA_CHECK_INTERVAL секунд; реплика,
+# отстающая больше REPLICA_MAX_LAG секунд, не используется; после записи
+# пользователь REPLICA_STICKY_SECONDS секунд читает из default
+REPLICA_CHECK_INTERVAL = 5
+REPLICA_MAX_LAG = 10
+REPLICA_STICKY_SECONDS = 15
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'ask_pupkin_db',
-        'USER': 'ask_pupkin_user',
-        'PASSWORD': 'your_password_here',
-        'HOST': 'localhost',
-        'PORT': '5432',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+# Общий для нескольких процессов кэш без внешних сервисов
+if os.environ.get('ASK_PUPKIN_CACHE_DIR'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['ASK_PUPKIN_CACHE_DIR'],
+    }
+
+# Сколько последних замеров на каждый URL хранит PerformanceMiddleware
+PERFORMANCE_HISTOGRAM_SIZE = 1000
+
+# Фрагменты шаблонов сбрасываются по версиям объектов; время жизни
+# ограничивает только устаревание относительных дат ("5 минут назад")
+TEMPLATE_FRAGMENT_TIMEOUT = 600
+
+# Сайдбар: через сколько секунд блок пересчитывается даже без изменений,
+# и как часто его можно пересчитывать при непрерывных записях
+SIDEBAR_CACHE_TTL = 300
+SIDEBAR_MIN_REFRESH = 5
+SIDEBAR_LOCK_TIMEOUT = 30
+SIDEBAR_BACKGROUND_REFRESH = True
+
+# Показывать в лентах приблизительное число вопросов (статистика PostgreSQL)
+FEED_APPROXIMATE_COUNT = False
+
+# Просмотры вопросов: как часто буфер пишется в БД, при скольких накопленных
+# просмотрах запись идет досрочно и сколько секунд повтор из той же сессии
+# не считается (None - считать каждый просмотр)
+VIEW_COUNT_FLUSH_INTERVAL = 10
+VIEW_COUNT_MAX_PENDING = 1000
+VIEW_COUNT_DEDUPE_TTL = 3600
+
+# Живые обновления страницы вопроса (только ASGI): как часто слать keepalive,
+# сколько событий ждет медленного зрителя до отключения и через сколько
+# миллисекунд браузер переподключается
+LIVE_KEEPALIVE_SECONDS = 15
+LIVE_QUEUE_SIZE = 100
+LIVE_RETRY_MS = 5000
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -86,4 +186,9 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 MEDIA_URL = '/uploads/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'uploads')
 
+# Миниатюры аватаров строятся в пуле из AVATAR_WORKERS потоков. Файлы
+# MEDIA_URL + 'avatars/thumbs/' не меняются, веб-сервер должен отдавать их
+# с заголовком Cache-Control: public, max-age=31536000, immutable
+AVATAR_WORKERS = 2
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
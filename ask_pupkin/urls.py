@@ -3,10 +3,16 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from app import avatars
+from app.views import avatar_file
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('app.urls')),
 ]
 
 if settings.DEBUG:
+    urlpatterns += [
+        path(f'{settings.MEDIA_URL.lstrip("/")}{avatars.THUMB_DIR}/<path:path>', avatar_file),
+    ]
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file